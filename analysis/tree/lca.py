@@ -0,0 +1 @@
+node = tree.lca(*taxa)
@@ -0,0 +1 @@
+pruned = tree.prune(taxa)
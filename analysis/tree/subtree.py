@@ -0,0 +1 @@
+subtree = tree.subtree(node)
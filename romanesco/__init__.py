@@ -1,12 +1,19 @@
+import atexit
+import collections
+import hashlib
 import json
+import multiprocessing
+import multiprocessing.pool
 import StringIO
+import sys
 import tempfile
+import threading
 import os
 import romanesco.format
 import romanesco.io
 
 from ConfigParser import ConfigParser
-from . import tasks, utils
+from . import cache, tasks, utils
 
 
 # Read the configuration files
@@ -14,6 +21,40 @@ _cfgs = ('worker.dist.cfg', 'worker.local.cfg')
 config = ConfigParser()
 config.read([os.path.join(os.path.dirname(__file__), f) for f in _cfgs])
 
+
+def _getint(option, default=0):
+    if config.has_option('romanesco', option):
+        return config.getint('romanesco', option)
+    return default
+
+# Cache of conversion results shared by every call to convert()
+conversion_cache = cache.ConversionCache(
+    memoryBytes=_getint('convert_cache_memory'),
+    diskBytes=_getint('convert_cache_disk'),
+    diskRoot=os.path.abspath(
+        config.get('romanesco', 'convert_cache_dir')
+        if config.has_option('romanesco', 'convert_cache_dir') else
+        os.path.join(config.get('romanesco', 'tmp_root'), 'conversion_cache')))
+
+# Cache of HTTP responses fetched by the http IO mode, shared by the worker
+# processes of a host
+http_cache = cache.HttpCache(
+    diskBytes=_getint('http_cache_disk'),
+    diskRoot=os.path.abspath(
+        config.get('romanesco', 'http_cache_dir')
+        if config.has_option('romanesco', 'http_cache_dir') else
+        os.path.join(config.get('romanesco', 'tmp_root'), 'http_cache')))
+
+# Results of script-based validators, see isvalid()
+validation_cache = utils.LruCache(maxSize=4096)
+
+# Maximum threads used by run() to fetch inputs and push outputs at once
+io_threads = _getint('io_threads', 8)
+
+# Size of the process pool used by run() to convert fetched inputs, 0 to
+# convert them in the fetching threads
+convert_processes = _getint('convert_processes')
+
 # Maps task modes to their implementation
 _taskMap = {
     'docker': tasks.docker.run,
@@ -50,10 +91,46 @@ def load(task_file):
     return task
 
 
+class _ValidationMark(str):
+    """
+    The ``"validated"`` mark of a binding. Only marks of this class are
+    trusted, so a ``"validated"`` string in a binding deserialized from JSON,
+    for example one sent to the celery tasks, cannot skip validation. Marks
+    still serialize as plain strings.
+    """
+
+
+def _mark(type, format):
+    return _ValidationMark("%s:%s" % (type, format))
+
+
+def _isMarked(binding, type, format):
+    mark = binding.get("validated")
+    return isinstance(mark, _ValidationMark) and mark == _mark(type, format)
+
+
+def _validation_key(type, format, data):
+    if isinstance(data, unicode):
+        data = data.encode("utf8")
+    if isinstance(data, str):
+        return (type, format, hashlib.sha1(data).hexdigest())
+    return None
+
+
 def isvalid(type, binding):
     """
     Determine whether a data binding is of the appropriate type and format.
 
+    Bindings that pass validation, as well as bindings produced by
+    :py:func:`convert`, are marked with a ``"validated"`` field of the form
+    ``"type:format"``. Marked bindings are trusted and not validated again,
+    so the mark must be removed if the data of a binding is replaced. Marks
+    are set by Romanesco only, and a ``"validated"`` field given by the
+    caller is ignored.
+    Results of validators that are not native functions are also cached in
+    ``validation_cache`` for string data, keyed by its hash. Only the result
+    is kept, not the data.
+
     :param type: The expected type specifier string of the binding.
     :param binding: A binding dict of the form
         ``{"format": format, "data", data}``, where ``format`` is the format
@@ -64,12 +141,63 @@ def isvalid(type, binding):
     :returns: ``True`` if the binding matches the type and format,
         ``False`` otherwise.
     """
+    if _isMarked(binding, type, binding["format"]):
+        return True
+
     if "data" not in binding:
         binding["data"] = romanesco.io.fetch(binding)
     validator = romanesco.format.validators[type][binding["format"]]
-    outputs = romanesco.run(validator, {"input": binding}, auto_convert=False,
-                            validate=False)
-    return outputs["output"]["data"]
+    function = romanesco.format.get_function(validator)
+    if function is not None:
+        valid = function(binding["data"])
+    else:
+        key = _validation_key(type, binding["format"], binding["data"])
+        valid = None
+        if key is not None:
+            valid = validation_cache.get(key)
+        if valid is None:
+            outputs = romanesco.run(validator, {"input": binding},
+                                    auto_convert=False, validate=False)
+            valid = outputs["output"]["data"]
+            if key is not None:
+                validation_cache.put(key, valid)
+
+    if valid:
+        binding["validated"] = _mark(type, binding["format"])
+    return valid
+
+
+def _convert(type, input, output_format, apply):
+    """
+    Convert the data of a binding for :py:func:`convert` and
+    :py:class:`BatchConverter`, fetching it first if needed and going through
+    ``conversion_cache``. ``apply`` is called with the input binding to do
+    the conversion on a cache miss.
+
+    :returns: A tuple ``(data, mark)`` where ``mark`` is the validation mark
+        of the output, or ``None`` if it is not known to be valid.
+    """
+    if "data" not in input:
+        input["data"] = romanesco.io.fetch(input)
+
+    if input["format"] == output_format:
+        if _isMarked(input, type, output_format):
+            return input["data"], _mark(type, output_format)
+        return input["data"], None
+
+    key = None
+    found = False
+    if conversion_cache.enabled:
+        key = conversion_cache.key(
+            type, input["format"], output_format, input["data"])
+    if key is not None:
+        found, data = conversion_cache.get(key)
+
+    if not found:
+        data = apply(input)
+        if key is not None:
+            conversion_cache.put(key, data)
+    return data, _mark(type, output_format)
 
 
 def convert(type, input, output):
@@ -94,31 +222,343 @@ def convert(type, input, output):
         If ``"uri"`` is present in the output binding, instead saves the data
         to the specified URI and
         returns the output binding unchanged.
+
+    Results of converting string data are cached in ``conversion_cache``,
+    sized by the ``convert_cache_memory`` and ``convert_cache_disk`` config
+    settings.
     """
 
-    if "data" not in input:
-        input["data"] = romanesco.io.fetch(input)
+    def apply(input):
+        for c in romanesco.format.conversion_path(
+                type, input["format"], output["format"]):
+            input = romanesco.format.apply_converter(c, input)
+        return input["data"]
+
+    data, mark = _convert(type, input, output["format"], apply)
+    if "mode" in output:
+        romanesco.io.push(data, output)
+    else:
+        output["data"] = data
+        if mark is not None:
+            output["validated"] = mark
+    return output
+
+
+class BatchConverter(object):
+    """
+    Converts many bindings of one type to the same output format. Conversion
+    paths and the functions that run each step are resolved once per input
+    format and reused for every binding, see
+    :py:func:`romanesco.format.converter_function`. Instances are callable
+    and may be shared between threads.
+    """
+    def __init__(self, type, output_format):
+        self.type = type
+        self.output_format = output_format
+        self.paths = {}
+
+    def steps(self, input_format):
+        """
+        Return the list of conversion functions from an input format.
+        """
+        steps = self.paths.get(input_format)
+        if steps is None:
+            steps = [romanesco.format.converter_function(c) for c in
+                     romanesco.format.conversion_path(
+                         self.type, input_format, self.output_format)]
+            self.paths[input_format] = steps
+        return steps
+
+    def apply(self, input):
+        """
+        Run the conversion steps on the data of a binding.
+        """
+        data = input["data"]
+        for step in self.steps(input["format"]):
+            data = step(data)
+        return data
+
+    def __call__(self, input):
+        """
+        Convert a single binding. Errors are returned in the ``"error"``
+        field of the output binding instead of being raised.
+        """
+        output = {"format": self.output_format}
+        try:
+            data, mark = _convert(
+                self.type, input, self.output_format, self.apply)
+            output["data"] = data
+            if mark is not None:
+                output["validated"] = mark
+        except Exception, e:
+            output["error"] = str(e)
+        return output
+
+
+# Batch converters of pool worker processes
+_batchConverters = {}
+
+
+def _convertInProcess(args):
+    type, output_format, input = args
+    key = (type, output_format)
+    if key not in _batchConverters:
+        _batchConverters[key] = BatchConverter(type, output_format)
+    return _batchConverters[key](input)
+
+
+def convert_many(type, inputs, output_format, pool=None, workers=None,
+                 chunk_size=1):
+    """
+    Convert many bindings of the same type to one output format. This is
+    much faster than calling :py:func:`convert` for each binding, as the
+    conversion path is resolved once and script converters are run with
+    their compiled code directly, without going through
+    :py:func:`run` for every step.
+
+    :param type: The type specifier string of the input data.
+    :param inputs: A list of input bindings, as accepted by
+        :py:func:`convert`.
+    :param output_format: The format specifier string to convert to.
+    :param pool: ``None`` (the default) to convert in the calling thread,
+        ``"thread"`` to use a pool of threads or ``"process"`` to use a
+        pool of processes. Process pools require picklable input and output
+        data. Daemonic processes, such as celery workers, use a pool of
+        threads instead, as they may not start processes.
+    :param workers: The number of pool workers. Defaults to the number of
+        CPUs.
+    :param chunk_size: The number of bindings handed to a pool worker at a
+        time.
+    :returns: A list of output bindings in the order of ``inputs``. A binding
+        that failed to convert has an ``"error"`` field with the error
+        message instead of a ``"data"`` field.
+    """
+    if pool is None:
+        converter = BatchConverter(type, output_format)
+        return [converter(input) for input in inputs]
+
+    if pool == "process" and not _canFork():
+        pool = "thread"
+
+    if pool == "thread":
+        workerPool = multiprocessing.pool.ThreadPool(workers)
+        converter = BatchConverter(type, output_format)
+        items = inputs
+    elif pool == "process":
+        workerPool = multiprocessing.Pool(workers)
+        converter = _convertInProcess
+        items = [(type, output_format, input) for input in inputs]
+    else:
+        raise Exception("Invalid pool: %s" % pool)
+
+    try:
+        return workerPool.map(converter, items, chunk_size)
+    finally:
+        workerPool.close()
+        workerPool.join()
+
 
-    if input["format"] == output["format"]:
+def convert_stream(type, input, output, chunk_size=10000):
+    """
+    Convert data from one format to another in chunks, so that memory use is
+    bounded by the chunk size rather than the size of the data. See
+    :py:mod:`romanesco.format.streams` for the supported formats and the
+    form of their chunks.
+
+    :param type: The type specifier string of the input data.
+    :param input: An input binding as accepted by :py:func:`convert`. If it
+        has no ``"data"`` field, the data is fetched as a stream. The data
+        may also be an iterator of chunks or a whole value.
+    :param output: An output binding of the form ``{"format": format}``,
+        optionally with a ``"mode"`` and location to push the data to.
+    :param chunk_size: The number of table rows per chunk.
+    :returns: The output binding. Unless the data was pushed, its ``"data"``
+        field holds an iterator over the converted chunks, which performs the
+        conversion as it is consumed.
+    """
+    if "data" in input:
         data = input["data"]
     else:
-        converter_type = romanesco.format.converters[type]
-        converter_path = converter_type[input["format"]][output["format"]]
-        data_descriptor = input
-        for c in converter_path:
-            result = romanesco.run(c, {"input": data_descriptor},
-                                   auto_convert=False)
-            data_descriptor = result["output"]
-        data = data_descriptor["data"]
+        data = romanesco.io.fetch(input, task_input={"target": "stream"})
+
+    chunks = romanesco.format.streams.to_chunks(
+        type, input["format"], data, chunk_size)
+    for converter in romanesco.format.streams.stream_conversion_path(
+            type, input["format"], output["format"]):
+        chunks = converter(chunks, chunk_size)
 
     if "mode" in output:
-        romanesco.io.push(data, output)
+        romanesco.io.push(chunks, output)
     else:
-        output["data"] = data
+        output["data"] = chunks
     return output
 
 
-@utils.with_tmpdir
+def _prepareInput(name, d, task_input, auto_convert, validate, kwargs):
+    # Lazy formats are fetched as a stream before validation, which would
+    # otherwise read them whole
+    lazy = romanesco.format.lazy_formats.get(task_input["type"], ())
+    if auto_convert and "data" not in d and d["format"] in lazy:
+        d["data"] = romanesco.io.fetch(d, task_input={"target": "stream"})
+
+    # Validate the input
+    if validate and not romanesco.isvalid(task_input["type"], d):
+        raise Exception(
+            "Input %s (Python type %s) is not in the expected type (%s) "
+            "and format (%s)." % (
+                name, type(d["data"]), task_input["type"], d["format"])
+            )
+
+    # Convert data
+    if auto_convert:
+        if "data" not in d:
+            d["data"] = romanesco.io.fetch(d)
+        pool = _conversionPool()
+        if pool is not None and d["format"] != task_input["format"] and \
+                isinstance(d["data"], (str, unicode)) and \
+                task_input["format"] not in lazy:
+            d["script_data"] = pool.apply(
+                _convertData, (task_input["type"], d, task_input["format"]))
+        else:
+            converted = romanesco.convert(task_input["type"], d,
+                                          {"format": task_input["format"]})
+            d["script_data"] = converted["data"]
+    elif (d.get("format", task_input.get("format")) ==
+          task_input.get("format")):
+        if "data" not in d:
+            d["data"] = romanesco.io.fetch(
+                d, task_input=task_input, **kwargs)
+        d["script_data"] = d["data"]
+    else:
+        raise Exception("Expected exact format match but '%s != %s'." % (
+            d["format"], task_input["format"])
+        )
+
+
+def _finishOutput(name, outputs, task_output, auto_convert, validate,
+                  kwargs):
+    d = outputs[name]
+    script_output = {"data": d["script_data"],
+                     "format": task_output["format"]}
+
+    # Validate the output
+    if validate and not romanesco.isvalid(task_output["type"],
+                                          script_output):
+        raise Exception(
+            "Output %s (%s) is not in the expected type (%s) and format "
+            " (%s)." % (
+                name, type(script_output["data"]), task_output["type"],
+                d["format"])
+            )
+
+    if auto_convert:
+        outputs[name] = romanesco.convert(
+            task_output["type"], script_output, d)
+    elif d["format"] == task_output["format"]:
+        data = d["script_data"]
+        if d.get("mode"):
+            romanesco.io.push(data, d, task_output=task_output, **kwargs)
+        else:
+            d["data"] = data
+    else:
+        raise Exception("Expected exact format match but %s != %s.'" % (
+            d["format"], task_output["format"]))
+
+    if "script_data" in outputs[name]:
+        del outputs[name]["script_data"]
+
+
+def _runAll(kind, jobs, concurrent):
+    """
+    Run the per-binding jobs ``(name, function, args)`` of a task. If
+    ``concurrent`` is set and there is more than one job, they are run on up
+    to ``io_threads`` threads. If any fail, the error of a single failed job
+    is raised as is, while failures of several jobs are reported together
+    by binding name.
+    """
+    threads = min(io_threads, len(jobs))
+    if not concurrent or threads < 2:
+        for name, function, args in jobs:
+            function(*args)
+        return
+
+    # Plain threads start and stop much faster than a ThreadPool
+    pending = collections.deque(jobs)
+    errors = []
+
+    def work():
+        while True:
+            try:
+                name, function, args = pending.popleft()
+            except IndexError:
+                return
+            try:
+                function(*args)
+            except Exception:
+                errors.append((name, sys.exc_info()))
+
+    workers = [threading.Thread(target=work) for i in xrange(threads)]
+    for worker in workers:
+        worker.daemon = True
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    if len(errors) == 1:
+        raise errors[0][1][0], errors[0][1][1], errors[0][1][2]
+    elif errors:
+        raise Exception("Errors in %ss:\n%s" % (kind, "\n".join(
+            "%s: %s" % (name, error[1]) for name, error in sorted(errors))))
+
+
+# Process pool for input conversions, see _conversionPool()
+_pool = None
+_poolPid = None
+_poolLock = threading.Lock()
+
+
+def _canFork():
+    # Daemonic processes, such as celery prefork workers, may not have
+    # children of their own
+    return not multiprocessing.current_process().daemon
+
+
+def _conversionPool():
+    """
+    Return the process pool used to convert fetched inputs, or ``None`` if
+    the ``convert_processes`` setting is 0 (the default) or this process is
+    not allowed to start one, in which case inputs are converted in the
+    fetching threads. The pool is shut down when the process exits.
+    """
+    global _pool, _poolPid
+    if convert_processes < 1 or not _canFork():
+        return None
+    with _poolLock:
+        # A pool inherited by a forked worker is not usable there
+        if _poolPid != os.getpid():
+            _pool = multiprocessing.Pool(convert_processes)
+            _poolPid = os.getpid()
+        return _pool
+
+
+@atexit.register
+def _closePool():
+    """
+    Shut down the conversion process pool started by this process, if any.
+    """
+    global _pool, _poolPid
+    with _poolLock:
+        if _pool is not None and _poolPid == os.getpid():
+            _pool.terminate()
+            _pool.join()
+        _pool = _poolPid = None
+
+
+def _convertData(type, input, format):
+    return convert(type, input, {"format": format})["data"]
+
+
+@utils.with_scratch
 def run(task, inputs, outputs=None, auto_convert=True, validate=True,
         **kwargs):
     """
@@ -177,32 +617,13 @@ def run(task, inputs, outputs=None, auto_convert=True, validate=True,
             else:
                 raise Exception("Required input '%s' not provided." % name)
 
-    for name, d in inputs.iteritems():
-        task_input = task_inputs[name]
-
-        # Validate the input
-        if validate and not romanesco.isvalid(task_input["type"], d):
-            raise Exception(
-                "Input %s (Python type %s) is not in the expected type (%s) "
-                "and format (%s)." % (
-                    name, type(d["data"]), task_input["type"], d["format"])
-                )
-
-        # Convert data
-        if auto_convert:
-            converted = romanesco.convert(task_input["type"], d,
-                                          {"format": task_input["format"]})
-            d["script_data"] = converted["data"]
-        elif (d.get("format", task_input.get("format")) ==
-              task_input.get("format")):
-            if "data" not in d:
-                d["data"] = romanesco.io.fetch(
-                    d, task_input=task_input, **kwargs)
-            d["script_data"] = d["data"]
-        else:
-            raise Exception("Expected exact format match but '%s != %s'." % (
-                d["format"], task_input["format"])
-            )
+    # Fetch, validate and convert the inputs, concurrently if any of them
+    # need to be fetched
+    _runAll("input", [
+        (name, _prepareInput, (name, d, task_inputs[name], auto_convert,
+                               validate, kwargs))
+        for name, d in inputs.iteritems()
+    ], concurrent=any("data" not in d for d in inputs.itervalues()))
 
     # Make sure all outputs are there
     if outputs is None:
@@ -217,35 +638,13 @@ def run(task, inputs, outputs=None, auto_convert=True, validate=True,
                    task_inputs=task_inputs, task_outputs=task_outputs,
                    auto_convert=auto_convert, validate=validate, **kwargs)
 
-    for name, task_output in task_outputs.iteritems():
-        d = outputs[name]
-        script_output = {"data": d["script_data"],
-                         "format": task_output["format"]}
-
-        # Validate the output
-        if validate and not romanesco.isvalid(task_output["type"],
-                                              script_output):
-            raise Exception(
-                "Output %s (%s) is not in the expected type (%s) and format "
-                " (%s)." % (
-                    name, type(script_output["data"]), task_output["type"],
-                    d["format"])
-                )
-
-        if auto_convert:
-            outputs[name] = romanesco.convert(
-                task_output["type"], script_output, d)
-        elif d["format"] == task_output["format"]:
-            data = d["script_data"]
-            if d.get("mode"):
-                romanesco.io.push(data, d, task_output=task_output, **kwargs)
-            else:
-                d["data"] = data
-        else:
-            raise Exception("Expected exact format match but %s != %s.'" % (
-                d["format"], task_output["format"]))
-
-        if "script_data" in outputs[name]:
-            del outputs[name]["script_data"]
+    # Validate, convert and push the outputs, concurrently if more than one
+    # of them is pushed
+    _runAll("output", [
+        (name, _finishOutput, (name, outputs, task_output, auto_convert,
+                               validate, kwargs))
+        for name, task_output in task_outputs.iteritems()
+    ], concurrent=sum(1 for name in task_outputs
+                      if outputs[name].get("mode")) > 1)
 
     return outputs
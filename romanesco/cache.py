@@ -0,0 +1,451 @@
+import collections
+import contextlib
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+
+from six.moves import cPickle
+from .utils import LruCache
+
+try:
+    import fcntl
+except ImportError:  # Not available on Windows
+    fcntl = None
+
+# Container types whose conversion results are cached by pickling them
+_PICKLED_TYPES = (dict, list, tuple, collections.OrderedDict)
+
+
+class _TooLarge(Exception):
+    pass
+
+
+class _BoundedBuffer(object):
+    # File-like target for pickling that gives up as soon as the pickle
+    # grows past a size limit
+    def __init__(self, limit):
+        self.limit = limit
+        self.size = 0
+        self.parts = []
+
+    def write(self, data):
+        self.size += len(data)
+        if self.size > self.limit:
+            raise _TooLarge()
+        self.parts.append(data)
+
+    def getvalue(self):
+        return ''.join(self.parts)
+
+
+class ConversionCache(object):
+    """
+    A content-addressed cache of conversion results. Entries are keyed by the
+    type, the input and output formats, and a hash of the input data, so
+    only serialized (string) input data is cached. Results are held in a
+    bounded in-memory LRU tier and optionally in an on-disk tier, each
+    limited by the total number of bytes stored.
+
+    Results that are not strings are stored pickled and unpickled on every
+    hit, so callers never share mutable results with each other.
+    """
+    def __init__(self, memoryBytes=0, diskBytes=0, diskRoot=None):
+        """
+        :param memoryBytes: Maximum bytes held in memory, 0 to disable.
+        :type memoryBytes: int
+        :param diskBytes: Maximum bytes held on disk, 0 to disable.
+        :type diskBytes: int
+        :param diskRoot: Directory of the on-disk tier.
+        :type diskRoot: str
+        """
+        self.memory = LruCache(maxBytes=memoryBytes)
+        self.memoryBytes = memoryBytes
+        self.diskBytes = diskBytes
+        self.diskRoot = diskRoot
+        self.diskHits = 0
+        self.diskMisses = 0
+
+        self._diskUsage = None
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.memoryBytes > 0 or self.diskBytes > 0
+
+    def key(self, type, inFormat, outFormat, data):
+        """
+        Return the cache key for converting ``data``, or ``None`` if data of
+        this kind is not cached.
+        """
+        if isinstance(data, unicode):
+            data = data.encode('utf8')
+        elif not isinstance(data, str):
+            return None
+
+        digest = hashlib.sha1(data).hexdigest()
+        return hashlib.sha1('\0'.join(
+            (type, inFormat, outFormat, digest))).hexdigest()
+
+    def get(self, key):
+        """
+        Look up a conversion result.
+
+        :returns: A tuple ``(found, data)``.
+        """
+        entry = None
+        if self.memoryBytes > 0:
+            entry = self.memory.get(key)
+
+        if entry is None and self.diskBytes > 0:
+            entry = self._diskGet(key)
+            if entry is not None and len(entry[1]) + 1 <= self.memoryBytes:
+                self.memory.put(key, entry, len(entry[1]) + 1)
+
+        if entry is None:
+            return False, None
+        return True, self._decode(entry)
+
+    def put(self, key, data):
+        """
+        Store a conversion result. Results that cannot be serialized, or that
+        are larger than both tiers, are silently skipped. Serialization stops
+        as soon as a result is known to be too large.
+        """
+        # Entries are charged for their kind byte as well as their blob in
+        # both tiers, matching the size of the file written to disk
+        entry = self._encode(
+            data, max(self.memoryBytes, self.diskBytes) - 1)
+        if entry is None:
+            return
+        size = len(entry[1]) + 1
+        if size <= self.memoryBytes:
+            self.memory.put(key, entry, size)
+        if size <= self.diskBytes:
+            self._diskPut(key, entry)
+
+    def clear(self):
+        """
+        Remove all entries from both tiers and reset the statistics. Files
+        other processes are still writing are left alone.
+        """
+        self.memory.clear()
+        self.diskHits = 0
+        self.diskMisses = 0
+        root = self.diskRoot
+        if root and os.path.isdir(root):
+            for name in os.listdir(root):
+                if not name.startswith('.'):
+                    try:
+                        os.remove(os.path.join(root, name))
+                    except OSError:
+                        pass
+        self._diskUsage = None
+
+    def stats(self):
+        """
+        Return a dictionary of hit/miss statistics for each tier.
+        """
+        return {
+            'memory': self.memory.stats(),
+            'disk': {
+                'hits': self.diskHits,
+                'misses': self.diskMisses,
+                'bytes': self._diskUsage or 0
+            }
+        }
+
+    def _encode(self, data, limit):
+        if isinstance(data, basestring) and len(data) > limit:
+            return None
+        if isinstance(data, str):
+            return ('r', data)
+        elif isinstance(data, unicode):
+            return ('u', data.encode('utf8'))
+        elif isinstance(data, (bool, int, long, float)) or data is None or \
+                isinstance(data, _PICKLED_TYPES):
+            buf = _BoundedBuffer(limit)
+            try:
+                cPickle.Pickler(buf, 2).dump(data)
+            except Exception:
+                return None
+            return ('p', buf.getvalue())
+        return None
+
+    def _decode(self, entry):
+        kind, blob = entry
+        if kind == 'r':
+            return blob
+        elif kind == 'u':
+            return blob.decode('utf8')
+        return cPickle.loads(blob)
+
+    def _diskGet(self, key):
+        path = os.path.join(self.diskRoot, key)
+        try:
+            with open(path, 'rb') as f:
+                blob = f.read()
+            os.utime(path, None)
+        except (IOError, OSError):
+            self.diskMisses += 1
+            return None
+        self.diskHits += 1
+        return (blob[0], blob[1:])
+
+    def _diskPut(self, key, entry):
+        root = self.diskRoot
+        try:
+            os.makedirs(root)
+        except OSError:
+            if not os.path.isdir(root):
+                raise
+
+        # Write to a temp file and rename so readers never see partial files
+        fd, tmp = tempfile.mkstemp(dir=root, prefix='.')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(entry[0])
+            f.write(entry[1])
+        path = os.path.join(root, key)
+        os.rename(tmp, path)
+        # Stamp with the same clock used on reads, as write times may be
+        # coarser and make a fresh entry look older than recently read ones
+        os.utime(path, None)
+
+        with self._lock:
+            if self._diskUsage is None:
+                self._diskUsage = self._scanDisk()[1]
+            else:
+                self._diskUsage += len(entry[1]) + 1
+            if self._diskUsage > self.diskBytes:
+                self._diskEvict()
+
+    def _scanDisk(self):
+        files = []
+        total = 0
+        for name in os.listdir(self.diskRoot):
+            if name.startswith('.'):
+                continue
+            path = os.path.join(self.diskRoot, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+            total += stat.st_size
+        return files, total
+
+    def _diskEvict(self):
+        files, total = self._scanDisk()
+        files.sort()
+        while files and total > self.diskBytes:
+            mtime, size, path = files.pop(0)
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+        self._diskUsage = total
+
+
+class HttpCache(object):
+    """
+    An on-disk cache of HTTP responses that may be shared by the worker
+    processes of a host. Entries are keyed by the URL and request headers of
+    a GET request, and hold the response body with its ``ETag`` and
+    ``Last-Modified`` validators, so a cached response is revalidated with a
+    conditional request and served from disk if the server answers 304 Not
+    Modified. Only responses with a validator are stored.
+
+    Each entry is a single file holding a line of JSON metadata followed by
+    the body. Entries are written to temp files and renamed into place, so
+    readers never see partial entries, and an entry that is replaced or
+    evicted while open stays readable. The total size of the entries is
+    bounded by evicting the least recently used ones, while holding an
+    exclusive lock on the directory so that processes do not evict at the
+    same time.
+    """
+    def __init__(self, diskBytes=0, diskRoot=None):
+        """
+        :param diskBytes: Maximum bytes held on disk, 0 to disable.
+        :type diskBytes: int
+        :param diskRoot: Directory of the cache.
+        :type diskRoot: str
+        """
+        self.diskBytes = diskBytes
+        self.diskRoot = diskRoot
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def enabled(self):
+        return self.diskBytes > 0
+
+    def key(self, url, headers):
+        """
+        Return the cache key for a GET request of ``url`` with ``headers``.
+        """
+        parts = [url] + ['%s:%s' % (k.lower(), v)
+                         for k, v in sorted(headers.items())]
+        return hashlib.sha1('\0'.join(
+            p.encode('utf8') if isinstance(p, unicode) else p
+            for p in parts)).hexdigest()
+
+    def get(self, key):
+        """
+        Look up a cached response, marking it as recently used.
+
+        :returns: A tuple ``(meta, file)`` of the metadata and a file object
+            positioned at the start of the body, or None if not cached. The
+            caller must close the file.
+        """
+        path = os.path.join(self.diskRoot, key)
+        try:
+            f = open(path, 'rb')
+        except IOError:
+            self.misses += 1
+            return None
+        try:
+            meta = json.loads(f.readline())
+            os.utime(path, None)
+        except (ValueError, OSError):
+            f.close()
+            self.misses += 1
+            return None
+        self.hits += 1
+        return meta, f
+
+    @staticmethod
+    def conditions(meta):
+        """
+        Return the headers that revalidate a cached response.
+        """
+        headers = {}
+        if meta.get('etag'):
+            headers['If-None-Match'] = meta['etag']
+        if meta.get('lastModified'):
+            headers['If-Modified-Since'] = meta['lastModified']
+        return headers
+
+    @staticmethod
+    def metadata(url, response):
+        """
+        Return the metadata to cache a response with, or None if it cannot be
+        revalidated or must not be stored.
+        """
+        headers = response.headers
+        if response.status_code != 200 or \
+                'no-store' in headers.get('Cache-Control', '') or not (
+                    headers.get('ETag') or headers.get('Last-Modified')):
+            return None
+        return {
+            'url': url,
+            'etag': headers.get('ETag'),
+            'lastModified': headers.get('Last-Modified'),
+            'headers': {k: headers[k] for k in (
+                'Content-Type', 'Content-Disposition') if k in headers}
+        }
+
+    def put(self, key, meta, chunks):
+        """
+        Yield the chunks of a response body while writing them to the cache.
+        The entry is only stored once all of the chunks have been read.
+        """
+        f, tmp = self._open(meta)
+        try:
+            with f:
+                for chunk in chunks:
+                    f.write(chunk)
+                    yield chunk
+        except BaseException:
+            os.remove(tmp)
+            raise
+        self._commit(tmp, key)
+
+    def putFile(self, key, meta, path):
+        """
+        Store the contents of a file as the body of a cached response.
+        """
+        f, tmp = self._open(meta)
+        try:
+            with f, open(path, 'rb') as src:
+                shutil.copyfileobj(src, f, 65536)
+        except BaseException:
+            os.remove(tmp)
+            raise
+        self._commit(tmp, key)
+
+    def clear(self):
+        """
+        Remove all entries and reset the statistics.
+        """
+        self.hits = 0
+        self.misses = 0
+        root = self.diskRoot
+        if root and os.path.isdir(root):
+            for name in os.listdir(root):
+                if not name.startswith('.'):
+                    os.remove(os.path.join(root, name))
+
+    def stats(self):
+        """
+        Return a dictionary of hit/miss statistics.
+        """
+        return {'hits': self.hits, 'misses': self.misses,
+                'bytes': self._scan()[1]}
+
+    def _open(self, meta):
+        root = self.diskRoot
+        try:
+            os.makedirs(root)
+        except OSError:
+            if not os.path.isdir(root):
+                raise
+        fd, tmp = tempfile.mkstemp(dir=root, prefix='.')
+        f = os.fdopen(fd, 'wb')
+        f.write(json.dumps(meta) + '\n')
+        return f, tmp
+
+    def _commit(self, tmp, key):
+        path = os.path.join(self.diskRoot, key)
+        with self._locked():
+            os.rename(tmp, path)
+            os.utime(path, None)
+            files, total = self._scan()
+            files.sort()
+            while files and total > self.diskBytes:
+                mtime, size, victim = files.pop(0)
+                try:
+                    os.remove(victim)
+                except OSError:
+                    pass
+                total -= size
+
+    @contextlib.contextmanager
+    def _locked(self):
+        with open(os.path.join(self.diskRoot, '.lock'), 'a') as lock:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _scan(self):
+        files = []
+        total = 0
+        if not self.diskRoot or not os.path.isdir(self.diskRoot):
+            return files, total
+        for name in os.listdir(self.diskRoot):
+            if name.startswith('.'):
+                continue
+            path = os.path.join(self.diskRoot, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+            total += stat.st_size
+        return files, total
@@ -1,59 +1,42 @@
 import csv
 import json
 import glob
+import hashlib
+import heapq
+import imp
+import importlib
+import marshal
 import os
-import math
 import romanesco.io
+import tempfile
+import time
 from StringIO import StringIO
 
+from . import native, newick, phyloxml, streams, tables, trees
+
+try:
+    from . import apetrees, columns, treearrays, treeindex
+except ImportError:  # NumPy is not installed
+    apetrees = columns = treearrays = treeindex = None
+
+try:
+    from . import vtkarrays
+except ImportError:  # VTK is not installed
+    vtkarrays = None
+
 
 def csv_to_rows(input):
 
     # csv package does not support unicode
     input = str(input)
 
-    # Special case: detect single-column files.
-    # This check assumes that our only valid delimiters are commas and tabs.
-    firstLine = input.split('\n')[0]
-    if not ('\t' in firstLine or ',' in firstLine) \
-            or len(input.splitlines()) == 1:
-        dialect = 'excel'
-
-    else:
-        # Take a data sample to determine dialect, but
-        # don't include incomplete last line
-        sample = ''
-        sampleSize = 0
-        while len(sample) == 0:
-            sampleSize += 5000
-            sample = '\n'.join(input[:sampleSize].splitlines()[:-1])
-        dialect = csv.Sniffer().sniff(sample)
-        dialect.skipinitialspace = True
-
-    reader = csv.DictReader(input.splitlines(), dialect=dialect)
-    rows = [d for d in reader]
-    fields = reader.fieldnames
-
-    output = {"fields": fields, "rows": rows}
-
-    # Attempt numeric conversion
-    for row in output["rows"]:
-        for col in row:
-            try:
-                row[col] = int(row[col])
-            except:
-                try:
-                    orig = row[col]
-                    row[col] = float(row[col])
-
-                    # Disallow NaN, Inf, -Inf since this does not
-                    # pass through JSON converters cleanly
-                    if math.isnan(row[col]) or math.isinf(row[col]):
-                        row[col] = orig
-                except:
-                    pass
+    dialect = tables.sniff_dialect(input)
+    reader = csv.reader(tables.text_lines(input), dialect=dialect)
+    fields = next(reader, None)
+    with tables.gc_paused():
+        rows = tables.records_to_rows(fields, [r for r in reader if r])
 
-    return output
+    return {"fields": fields, "rows": rows}
 
 
 def vtkrow_to_dict(attributes, i):
@@ -103,25 +86,90 @@ def dict_to_vtkrow(row, attributes):
         value = row[key]
         if not isinstance(value, (list, int, long, float, str, unicode)):
             value = str(value)
-        found = False
-        for i in range(attributes.GetNumberOfArrays()):
-            arr = attributes.GetAbstractArray(i)
-            if arr.GetName() == key:
-                if isinstance(value, list):
-                    for v in value:
-                        arr.InsertNextValue(v)
-                else:
-                    arr.InsertNextValue(value)
-                found = True
-                break
-        if not found:
+        arr = attributes.GetAbstractArray(key)
+        if arr is None:
             raise Exception("[dict_to_vtkrow] Unexpected key: " + key)
+        if isinstance(value, list):
+            for v in value:
+                arr.InsertNextValue(v)
+        else:
+            arr.InsertNextValue(value)
 
 converters = {}
 validators = {}
 
+# Formats whose data may be an iterator that is converted lazily, one item
+# at a time. Such data is fetched as a stream and never sent to another
+# process.
+lazy_formats = {
+    "tree": ("newick_multi", "nexus_multi", "nested_multi")
+}
+
+# Measured cost in seconds of each converter, of the form
+# {type: {in_format: {out_format: cost}}}
+conversion_costs = {}
+
+# Estimated costs for converters that have not been benchmarked
+default_costs = {
+    "function": 0.00001,
+    "python": 0.001,
+    "r": 0.1
+}
+
+# Memoized cheapest conversion paths, keyed by (type, in_format, out_format)
+_paths = {}
 
-def import_converters(search_paths):
+_cost_file = os.path.join(
+    os.path.dirname(os.path.realpath(__file__)), "converter_costs.json")
+
+# Cache of resolved native functions, keyed by their dotted import path
+_functions = {}
+
+
+def get_function(analysis):
+    """
+    Return the native Python callable implementing a converter or validator,
+    or ``None`` if the analysis must be run through :py:func:`romanesco.run`.
+
+    The ``"function"`` field of the analysis may either be a callable or a
+    dotted import path such as ``"json.loads"``. Import paths are resolved on
+    first use and cached.
+
+    :param analysis: The converter or validator analysis.
+    :type analysis: dict
+    """
+    function = analysis.get("function")
+    if function is None or callable(function):
+        return function
+
+    if function not in _functions:
+        module, name = function.rsplit(".", 1)
+        _functions[function] = getattr(importlib.import_module(module), name)
+    return _functions[function]
+
+
+def _add_validator(analysis):
+    in_type = analysis["inputs"][0]["type"]
+    in_format = analysis["inputs"][0]["format"]
+    if in_type not in validators:
+        validators[in_type] = {}
+    validators[in_type][in_format] = analysis
+
+
+def _add_converter(analysis):
+    in_type = analysis["inputs"][0]["type"]
+    in_format = analysis["inputs"][0]["format"]
+    out_format = analysis["outputs"][0]["format"]
+    if in_type not in converters:
+        converters[in_type] = {}
+    analysis_type = converters[in_type]
+    if in_format not in analysis_type:
+        analysis_type[in_format] = {}
+    analysis_type[in_format][out_format] = [analysis]
+    _paths.clear()
+
+
+def import_converters(search_paths, snapshot=None):
     """
     Import converters and validators from the specified search paths.
     These functions are loaded into the dictionaries
@@ -142,9 +190,32 @@ def import_converters(search_paths):
     output named ``"output"``. The input and output should have matching
     type but should be of different formats.
 
+    Converters and validators may also set a ``"function"`` field to the
+    dotted import path of a Python callable, such as ``"json.loads"``. The
+    callable takes the input data as its only argument and returns the
+    output data (or ``True``/``False`` for validators). It is called
+    directly by :py:func:`romanesco.convert` and :py:func:`romanesco.isvalid`
+    instead of running the script, which is then only needed for use as a
+    regular analysis and may be omitted.
+
+    Converters that cannot be benchmarked everywhere, such as those needing
+    R, may set a ``"cost"`` field to the estimated cost in seconds used to
+    plan conversion paths until they are measured.
+
     :param search_paths: A list of search paths relative to the current
         working directory.
+    :param snapshot: Optional path of a registry snapshot file. If the
+        snapshot was written for the same search paths and none of the files
+        in them have been added, removed or modified since, the converters
+        and validators are loaded from it instead of parsing every file.
+        Otherwise the files are imported and the snapshot is rewritten.
     """
+    if snapshot is not None:
+        sources = _source_mtimes(search_paths)
+        if _load_snapshot(snapshot, search_paths, sources):
+            return
+
+    loaded = {"validators": [], "converters": []}
     prevdir = os.getcwd()
     for path in search_paths:
         os.chdir(path)
@@ -152,59 +223,376 @@ def import_converters(search_paths):
             with open(filename) as f:
                 analysis = json.load(f)
 
-            if "script" not in analysis:
+            if "script" not in analysis and "script_uri" in analysis:
                 analysis["script"] = romanesco.io.fetch({
                     "mode": analysis.get("script_fetch_mode", "auto"),
                     "url": analysis["script_uri"]
                 })
 
             if os.path.basename(filename).startswith("validate_"):
+                _add_validator(analysis)
+                loaded["validators"].append(analysis)
+            else:
+                _add_converter(analysis)
+                loaded["converters"].append(analysis)
 
-                # This is a validator
-                in_type = analysis["inputs"][0]["type"]
-                in_format = analysis["inputs"][0]["format"]
-                if in_type not in validators:
-                    validators[in_type] = {}
-                validators[in_type][in_format] = analysis
+    os.chdir(prevdir)
 
-            else:
+    if snapshot is not None:
+        _save_snapshot(snapshot, search_paths, sources, loaded)
 
-                # This is a converter
-                in_type = analysis["inputs"][0]["type"]
-                in_format = analysis["inputs"][0]["format"]
-                out_format = analysis["outputs"][0]["format"]
-                if in_type not in converters:
-                    converters[in_type] = {}
-                analysis_type = converters[in_type]
-                if in_format not in analysis_type:
-                    analysis_type[in_format] = {}
-                input_format = analysis_type[in_format]
-                if out_format not in input_format:
-                    input_format[out_format] = {}
-                input_format[out_format] = [analysis]
 
-    os.chdir(prevdir)
+def _source_mtimes(search_paths):
+    sources = {}
+    for path in search_paths:
+        for name in os.listdir(path):
+            if name.startswith(".") or name.endswith((".pyc", ".pyo")):
+                continue
+            filename = os.path.join(path, name)
+            sources[filename] = os.stat(filename).st_mtime
+    return sources
+
+
+def _snapshot_version():
+    return "1:" + imp.get_magic()
+
+
+def _load_snapshot(snapshot, search_paths, sources):
+    try:
+        with open(snapshot, "rb") as f:
+            index = marshal.load(f)
+    except (IOError, EOFError, ValueError, TypeError):
+        return False
 
-    max_steps = 3
-    for i in range(max_steps):
-        to_add = []
-        for analysis_type, analysis_type_values in converters.iteritems():
-            for input_format, input_format_values in \
-                    analysis_type_values.iteritems():
-                for output_format, converter in \
-                        input_format_values.iteritems():
-                    if output_format in analysis_type_values:
-                        output_formats = analysis_type_values[output_format]
-                        for next_output_format, next_converter in \
-                                output_formats.iteritems():
-                            if input_format != next_output_format and \
-                                    next_output_format not in \
-                                    input_format_values:
-                                to_add.append((analysis_type, input_format,
-                                               next_output_format,
-                                               converter + next_converter))
-        for c in to_add:
-            converters[c[0]][c[1]][c[2]] = c[3]
+    if index.get("version") != _snapshot_version() or \
+            index.get("search_paths") != list(search_paths) or \
+            index.get("sources") != sources:
+        return False
+
+    from romanesco.tasks import python
+    python.precompiled.update(index["code"])
+
+    for analysis in index["validators"]:
+        _add_validator(analysis)
+    for analysis in index["converters"]:
+        _add_converter(analysis)
+    return True
+
+
+def _save_snapshot(snapshot, search_paths, sources, loaded):
+    from romanesco.tasks import python
+
+    # Precompile scripts that may still be run through romanesco.run
+    code = {}
+    for analysis in loaded["validators"] + loaded["converters"]:
+        if analysis.get("mode", "python") == "python" and \
+                "script" in analysis and "function" not in analysis:
+            try:
+                code[python.scriptKey(analysis["script"])] = marshal.dumps(
+                    compile(analysis["script"], "<string>", "exec"))
+            except SyntaxError:
+                pass
+
+    index = {
+        "version": _snapshot_version(),
+        "search_paths": list(search_paths),
+        "sources": sources,
+        "validators": loaded["validators"],
+        "converters": loaded["converters"],
+        "code": code
+    }
+
+    # Write to a temp file and rename so concurrent readers never see a
+    # partial snapshot. Failing to write the snapshot is not an error.
+    try:
+        directory = os.path.dirname(os.path.abspath(snapshot))
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        fd, tmp = tempfile.mkstemp(dir=directory, prefix=".registry")
+        with os.fdopen(fd, "wb") as f:
+            marshal.dump(index, f)
+        os.rename(tmp, snapshot)
+    except (IOError, OSError, ValueError):
+        pass
+
+
+def register_converter(type, in_format, out_format, function, name=None):
+    """
+    Register a Python callable as the converter between two formats of a
+    type, replacing any existing direct converter between them. The callable
+    is run in-process by :py:func:`romanesco.convert`.
+
+    :param type: The type specifier string of the data.
+    :param in_format: The format specifier string of the input data.
+    :param out_format: The format specifier string of the output data.
+    :param function: A callable taking the input data and returning the
+        converted data, or the dotted import path of such a callable.
+    :param name: An optional human-readable name for the converter.
+    :returns: The converter analysis that was registered.
+    """
+    analysis = {
+        "name": name or "%s to %s" % (in_format, out_format),
+        "inputs": [{"name": "input", "type": type, "format": in_format}],
+        "outputs": [{"name": "output", "type": type, "format": out_format}],
+        "function": function,
+        "mode": "python"
+    }
+    _add_converter(analysis)
+    return analysis
+
+
+def register_validator(type, format, function):
+    """
+    Register a Python callable as the validator for a format of a type,
+    replacing any existing validator. The callable is run in-process by
+    :py:func:`romanesco.isvalid`.
+
+    :param type: The type specifier string of the data.
+    :param format: The format specifier string of the data.
+    :param function: A callable taking the data and returning ``True`` if it
+        is valid and ``False`` otherwise, or the dotted import path of such a
+        callable.
+    :returns: The validator analysis that was registered.
+    """
+    analysis = {
+        "inputs": [{"name": "input", "type": type, "format": format}],
+        "outputs": [{"name": "output", "type": "boolean",
+                     "format": "boolean"}],
+        "function": function,
+        "mode": "python"
+    }
+    _add_validator(analysis)
+    return analysis
+
+
+def converter_cost(analysis):
+    """
+    Return the cost used to weigh a converter when planning conversion
+    paths. This is the measured cost from ``conversion_costs`` if the
+    converter has been benchmarked, otherwise the ``"cost"`` estimate of the
+    converter if it has one, for example because it needs R, or else an
+    estimate from ``default_costs`` based on how the converter is run.
+
+    :param analysis: The converter analysis.
+    :type analysis: dict
+    """
+    type = analysis["inputs"][0]["type"]
+    in_format = analysis["inputs"][0]["format"]
+    out_format = analysis["outputs"][0]["format"]
+    try:
+        return conversion_costs[type][in_format][out_format]
+    except KeyError:
+        pass
+
+    if "cost" in analysis:
+        return analysis["cost"]
+    if analysis.get("function") is not None:
+        return default_costs["function"]
+    return default_costs.get(analysis.get("mode", "python"),
+                             default_costs["python"])
+
+
+def _plan_conversions(type, in_format):
+    """
+    Run a shortest path search from ``in_format`` over the converter graph of
+    a type, memoizing the cheapest path to every reachable format. A direct
+    converter is always used over a chain of converters, whatever their
+    costs, since chains are not guaranteed to give exactly the same result.
+    """
+    type_converters = converters.get(type, {})
+    costs = {in_format: 0}
+    paths = {in_format: []}
+    done = set()
+    queue = [(0, in_format)]
+
+    while queue:
+        cost, format = heapq.heappop(queue)
+        if format in done:
+            continue
+        done.add(format)
+        if format != in_format:
+            _paths[(type, in_format, format)] = paths[format]
+
+        for out_format, path in type_converters.get(format, {}).iteritems():
+            out_cost = cost + sum(converter_cost(c) for c in path)
+            if out_format not in costs or out_cost < costs[out_format]:
+                costs[out_format] = out_cost
+                paths[out_format] = paths[format] + path
+                heapq.heappush(queue, (out_cost, out_format))
+
+    for out_format, path in type_converters.get(in_format, {}).iteritems():
+        if out_format != in_format:
+            _paths[(type, in_format, out_format)] = path
+
+
+def conversion_path(type, in_format, out_format):
+    """
+    Return the list of converters that takes data of a type from one format
+    to another. This is the direct converter between the formats if there is
+    one, and otherwise the cheapest chain of converters. Paths are planned on
+    demand with a shortest path search weighted by :py:func:`converter_cost`
+    and memoized until the set of converters or their costs change.
+
+    :param type: The type specifier string of the data.
+    :param in_format: The format specifier string of the input data.
+    :param out_format: The format specifier string of the output data.
+    :returns: A list of converter analyses to apply in order.
+    """
+    key = (type, in_format, out_format)
+    if key not in _paths:
+        _plan_conversions(type, in_format)
+    if key not in _paths:
+        raise Exception("No conversion path from %s:%s to %s:%s." % (
+            type, in_format, type, out_format))
+    return _paths[key]
+
+
+def apply_converter(analysis, binding):
+    """
+    Run a single converter on a data binding, calling its native function
+    directly if it has one and otherwise running it with
+    :py:func:`romanesco.run`.
+
+    :param analysis: The converter analysis.
+    :type analysis: dict
+    :param binding: The input binding of the form
+        ``{"format": format, "data": data}``.
+    :returns: The output binding.
+    """
+    function = get_function(analysis)
+    if function is not None:
+        return {
+            "format": analysis["outputs"][0]["format"],
+            "data": function(binding["data"])
+        }
+
+    result = romanesco.run(analysis, {"input": binding}, auto_convert=False)
+    return result["output"]
+
+
+def converter_function(analysis):
+    """
+    Return a callable that runs a single converter on raw data. Native
+    converters are returned as is. Python converter scripts are executed
+    directly with their compiled code object, without the scratch directory
+    and the validation of intermediate results done by
+    :py:func:`romanesco.run`. Other converters go through
+    :py:func:`apply_converter`.
+
+    :param analysis: The converter analysis.
+    :type analysis: dict
+    :returns: A function taking the input data and returning the output data.
+    """
+    function = get_function(analysis)
+    if function is not None:
+        return function
+
+    in_spec = analysis["inputs"][0]
+    out_spec = analysis["outputs"][0]
+
+    if analysis.get("mode", "python") == "python":
+        code = romanesco.tasks.python.compileScript(analysis["script"])
+
+        def run_script(data):
+            env = {"__name__": "custom", in_spec["name"]: data}
+            exec code in env
+            return env[out_spec["name"]]
+        return run_script
+
+    def run_task(data):
+        return apply_converter(
+            analysis, {"format": in_spec["format"], "data": data})["data"]
+    return run_task
+
+
+def load_conversion_costs(path=None):
+    """
+    Load a converter cost table written by :py:func:`save_conversion_costs`
+    into ``conversion_costs``. The table shipped with Romanesco is loaded
+    when this module is first imported.
+
+    :param path: The JSON file to read. Defaults to the shipped table.
+    """
+    path = path or _cost_file
+    if os.path.isfile(path):
+        with open(path) as f:
+            costs = json.load(f)
+        for type, type_costs in costs.iteritems():
+            for in_format, format_costs in type_costs.iteritems():
+                conversion_costs.setdefault(type, {}).setdefault(
+                    in_format, {}).update(format_costs)
+    _paths.clear()
+
+
+def save_conversion_costs(path=None):
+    """
+    Write ``conversion_costs`` to a JSON file.
+
+    :param path: The JSON file to write. Defaults to the shipped table.
+    """
+    with open(path or _cost_file, "w") as f:
+        json.dump(conversion_costs, f, indent=4, sort_keys=True)
+
+
+# Seed data from which every format reachable in the benchmarks is generated
+benchmark_samples = {
+    "boolean": ("boolean", True),
+    "geometry": ("vtkpolydata.serialized", (
+        "# vtk DataFile Version 3.0\nvtk output\nASCII\nDATASET POLYDATA\n"
+        "POINTS 3 float\n0 0 0 1 0 0 0 1 0\nPOLYGONS 1 4\n3 0 1 2\n")),
+    "image": ("png.base64", (
+        "iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mNk"
+        "YPhfDwAChwGA60e6kgAAAABJRU5ErkJggg==")),
+    "number": ("number", 3.5),
+    "python": ("object", {"a": [1, 2.5, "b"]}),
+    "string": ("text", "a string"),
+    "table": ("csv", "a,b,c\n1,2.5,x\n3,4.5,y\n5,6.5,z\n"),
+    "tree": ("newick", "((ahli:0,allogus:1):2,rubribarbus:3);")
+}
+
+
+def benchmark_converters(samples=None, repeat=5):
+    """
+    Measure the cost of every converter reachable from a sample of each type
+    and record it in ``conversion_costs``. Converters that fail, for example
+    because an optional dependency is missing, keep their default cost.
+
+    :param samples: A dictionary of the form ``type: (format, data)``
+        giving the data to start from for each type. Defaults to
+        ``benchmark_samples``.
+    :param repeat: The number of times to time each converter. The fastest
+        time is recorded.
+    :returns: The updated ``conversion_costs``.
+    """
+    samples = samples or benchmark_samples
+    for type, (format, data) in samples.iteritems():
+        reached = {format: data}
+        pending = [format]
+        while pending:
+            in_format = pending.pop(0)
+            for out_format, path in \
+                    converters.get(type, {}).get(in_format, {}).iteritems():
+                best = None
+                for i in range(repeat):
+                    start = time.time()
+                    try:
+                        output = apply_converter(path[0], {
+                            "format": in_format, "data": reached[in_format]
+                        })
+                    except Exception:
+                        break
+                    elapsed = time.time() - start
+                    best = elapsed if best is None else min(best, elapsed)
+                if best is None:
+                    continue
+
+                conversion_costs.setdefault(type, {}).setdefault(
+                    in_format, {})[out_format] = best
+                if out_format not in reached:
+                    reached[out_format] = output["data"]
+                    pending.append(out_format)
+    _paths.clear()
+    return conversion_costs
 
 
 def print_conversion_graph():
@@ -231,11 +619,11 @@ def print_conversion_table():
 
     print "from,to"
     for analysis_type, analysis_type_values in converters.iteritems():
-        for input_format, input_format_values in \
-                analysis_type_values.iteritems():
-            for output_format in input_format_values:
-                print analysis_type + ":" + input_format + "," \
-                    + analysis_type + ":" + output_format
+        for input_format in analysis_type_values:
+            _plan_conversions(analysis_type, input_format)
+    for analysis_type, input_format, output_format in sorted(_paths):
+        print analysis_type + ":" + input_format + "," \
+            + analysis_type + ":" + output_format
 
 
 def import_default_converters():
@@ -245,9 +633,30 @@ def import_default_converters():
     """
 
     cur_path = os.path.dirname(os.path.realpath(__file__))
-    import_converters([os.path.join(cur_path, t) for t in [
+    search_paths = [os.path.join(cur_path, t) for t in [
         "r", "table", "tree",
         "string", "number", "image",
-        "boolean", "geometry", "netcdf", "python"]])
+        "boolean", "geometry", "netcdf", "python"]]
+    import_converters(search_paths, snapshot=default_snapshot(search_paths))
+
+
+def default_snapshot(search_paths):
+    """
+    Return the path of the registry snapshot used for a set of search paths.
+    Snapshots are kept in the directory named by the
+    ``ROMANESCO_SNAPSHOT_DIR`` environment variable, which defaults to
+    ``~/.cache/romanesco``. Setting the variable to an empty string disables
+    snapshots.
+
+    :param search_paths: The converter search paths.
+    :returns: The snapshot path, or ``None`` if snapshots are disabled.
+    """
+    root = os.environ.get("ROMANESCO_SNAPSHOT_DIR", os.path.join(
+        os.path.expanduser("~"), ".cache", "romanesco"))
+    if not root:
+        return None
+    digest = hashlib.sha1("\0".join(search_paths)).hexdigest()
+    return os.path.join(root, "registry-%s.snapshot" % digest)
 
 import_default_converters()
+load_conversion_costs()
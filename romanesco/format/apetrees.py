@@ -0,0 +1,227 @@
+"""
+Native implementations of the ``"tree"`` type converters for the
+``"r.apetree"`` format, a ``phylo`` object of the R package ape. The edge
+matrix, edge lengths and labels are read into NumPy arrays once, instead of
+indexing the rpy2 vectors value by value.
+
+Ape numbers the tips from 1, followed by the root and the other internal
+nodes. The edge matrix holds one row per edge with the numbers of its
+source and target, and R stores it column by column.
+"""
+
+import bson
+import collections
+import functools
+import itertools
+import numpy
+
+from . import treearrays
+from .trees import walk
+
+
+def _locked(function):
+    # Calls into embedded R hold the lock of R tasks, as R is not thread-safe
+    @functools.wraps(function)
+    def wrapper(input):
+        from romanesco.tasks import r
+        with r.lock:
+            return function(input)
+    return wrapper
+
+
+def _vector(value, dtype=None):
+    # The values of an R vector or matrix in R's (column major) order
+    return numpy.asarray(value, dtype=dtype).ravel(order='F')
+
+
+def _elements(input):
+    # The elements of the phylo list by name, as their order varies
+    elements = {}
+    for name, value in itertools.izip(input.do_slot('names'), input):
+        elements.setdefault(name, value)
+    return elements
+
+
+def _required(elements, name):
+    if name not in elements:
+        raise Exception('%s not found in input ape tree' % name)
+    return elements[name]
+
+
+def _phylo(input):
+    """
+    Read the parts of a phylo object, returning the tip count, node labels
+    indexed by ape number minus one, the edge sources and targets, and the
+    edge lengths or None.
+    """
+    elements = _elements(input)
+    tip_labels = list(_required(elements, 'tip.label'))
+    nodes = int(_vector(_required(elements, 'Nnode'))[0])
+    if 'node.label' in elements:
+        labels = tip_labels + list(elements['node.label'])
+    else:
+        labels = tip_labels + [''] * nodes
+
+    edge = _vector(_required(elements, 'edge'), numpy.int64)
+    count = len(edge) // 2
+    lengths = None
+    if 'edge.length' in elements:
+        lengths = _vector(elements['edge.length'], numpy.float64).tolist()
+    return len(tip_labels), labels, edge[:count], edge[count:], lengths
+
+
+def _preorder(children, root):
+    # Ape numbers of the nodes below root in pre-order with their parents'
+    # positions in that order
+    order = []
+    parent = []
+    stack = [(-1, root)]
+    while stack:
+        p, node = stack.pop()
+        index = len(order)
+        order.append(node)
+        parent.append(p)
+        stack.extend((index, child) for child in reversed(children[node]))
+    return order, parent
+
+
+@_locked
+def r_apetree_to_nested(input):
+    tips, labels, sources, targets, lengths = _phylo(input)
+
+    nodes = [{'node_data': {'node name': label}} for label in labels]
+    for node in nodes[tips:]:
+        node['children'] = []
+
+    # Edges are added in their order in the edge matrix
+    sources = (sources - 1).tolist()
+    targets = (targets - 1).tolist()
+    for edge, (source, target) in enumerate(
+            itertools.izip(sources, targets)):
+        if lengths is not None and edge < len(lengths):
+            nodes[target]['edge_data'] = {'weight': lengths[edge]}
+        nodes[source]['children'].append(nodes[target])
+
+    output = nodes[tips]
+    output['node_fields'] = ['node name', 'node weight']
+    output['edge_fields'] = ['weight']
+
+    # Parents come before their children, so their weights are already set
+    for parent, node in walk(output):
+        cur = 0.0 if parent is None else parent['node_data']['node weight']
+        weight = node.get('edge_data', {'weight': 0.0})['weight']
+        if isinstance(weight, (int, float)):
+            cur += weight
+        node['node_data']['node weight'] = cur
+    return output
+
+
+@_locked
+def r_apetree_to_arrays(input):
+    tips, labels, sources, targets, lengths = _phylo(input)
+    total = len(labels)
+
+    # Children of each node in edge order, found with a stable sort
+    edges = numpy.argsort(sources, kind='mergesort')
+    bounds = numpy.searchsorted(sources[edges], numpy.arange(total + 2))
+    targets_by_source = targets[edges].tolist()
+    children = [targets_by_source[bounds[i]:bounds[i + 1]]
+                for i in xrange(total + 1)]
+    order, parent = _preorder(children, tips + 1)
+
+    edge_of = numpy.zeros(total + 1, dtype=numpy.int64)
+    edge_of[targets] = numpy.arange(len(targets))
+    numbers = numpy.array(order[1:], dtype=numpy.int64)
+    if lengths is not None:
+        edge_lengths = numpy.asarray(lengths)[edge_of[numbers]].tolist()
+    else:
+        edge_lengths = [None] * len(numbers)
+
+    # Distances from the root, as in r_apetree_to_nested
+    depths = [0.0] * len(order)
+    for i in xrange(1, len(order)):
+        length = edge_lengths[i - 1]
+        depths[i] = depths[parent[i]] + (0.0 if length is None else length)
+
+    return treearrays.from_lists(
+        parent, [labels[node - 1] for node in order], [None] + edge_lengths,
+        [treearrays.DEPTH_FIELD], {treearrays.DEPTH_FIELD: depths}, [], {})
+
+
+@_locked
+def arrays_to_r_apetree(input):
+    import rpy2.robjects as robjects
+
+    parent = input['parent']
+    is_tip = numpy.bincount(parent[1:], minlength=len(parent)) == 0
+    tips = numpy.flatnonzero(is_tip)
+    internal = numpy.flatnonzero(~is_tip)
+
+    numbers = numpy.empty(len(parent), dtype=numpy.int64)
+    numbers[tips] = numpy.arange(1, len(tips) + 1)
+    numbers[internal] = numpy.arange(len(tips) + 1, len(parent) + 1)
+    edge = numpy.concatenate((numbers[parent[1:]], numbers[1:]))
+
+    labels = input['label']
+    phylo = collections.OrderedDict()
+    phylo['edge'] = robjects.r.matrix(
+        robjects.IntVector(edge.tolist()), ncol=2)
+    phylo['Nnode'] = robjects.IntVector([len(internal)])
+    phylo['tip.label'] = robjects.StrVector(labels[tips].tolist())
+    lengths = input['edge_length'][1:]
+    if len(lengths) and not numpy.isnan(lengths).all():
+        phylo['edge.length'] = robjects.FloatVector(lengths.tolist())
+    if any(labels[internal]):
+        phylo['node.label'] = robjects.StrVector(labels[internal].tolist())
+    output = robjects.vectors.ListVector(phylo)
+    output.rclass = robjects.StrVector(['phylo'])
+    return output
+
+
+@_locked
+def r_apetree_to_treestore(input):
+    """
+    Convert to the Arbor tree store, a list of BSON documents with one per
+    node and a final handle document pointing to the root. Internal nodes
+    have the ids of their children in ``"clades"``, and each node has the
+    length of the edge to it in ``"branch_length"``.
+    """
+    # The order of the phylo elements is assumed to be edge, tip.label,
+    # Nnode, edge.length, with tip.label and Nnode possibly swapped
+    leaf_index, count_index = (2, 1) if len(input[1]) == 1 else (1, 2)
+    tip_labels = list(input[leaf_index])
+    tips = len(tip_labels)
+    total = tips + int(_vector(input[count_index])[0])
+    edge = _vector(input[0], numpy.int64)
+    count = len(edge) // 2
+    try:
+        lengths = _vector(input[3], numpy.float64).tolist()
+    except TypeError:
+        lengths = None
+
+    # Internal nodes are named by number while they are linked, and nodes
+    # are found by name, so a repeated name resolves to its last node
+    names = tip_labels + ['node%d' % i for i in xrange(tips + 1, total + 1)]
+    last = dict(itertools.izip(names, xrange(total)))
+    canonical = numpy.array([last[name] for name in names], dtype=numpy.int64)
+
+    nodes = []
+    for i, name in enumerate(names):
+        node = {'name': name}
+        if i >= tips:
+            node['clades'] = []
+        node['_id'] = i
+        nodes.append(node)
+
+    sources = canonical[edge[:count] - 1].tolist()
+    targets = canonical[edge[count:] - 1].tolist()
+    for i, (source, target) in enumerate(itertools.izip(sources, targets)):
+        if lengths is not None:
+            nodes[target]['branch_length'] = lengths[i]
+        nodes[source]['clades'].append(nodes[target]['_id'])
+
+    handle = {'rooted': True, 'clades': [int(canonical[tips])]}
+    handle['_id'] = total
+    for node in nodes[tips:]:
+        node.pop('name', None)
+    return ''.join(bson.BSON.encode(d) for d in nodes + [handle])
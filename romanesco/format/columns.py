@@ -0,0 +1,218 @@
+"""
+Native implementations of the ``"table"`` type converters for the columnar
+``"columns"`` format, which holds one NumPy array per column. Columns of
+numbers are typed ``int64`` or ``float64`` arrays and may be two-dimensional
+for multi-component values, while other columns are object arrays. The
+converters work a column at a time instead of a row at a time.
+"""
+
+import csv
+import itertools
+import numpy
+from StringIO import StringIO
+
+from . import tables
+
+
+def is_columns(input):
+    """
+    Check the structure of a columns table. This only looks at each column
+    once, not at the values, so it takes time proportional to the number of
+    columns.
+    """
+    if not isinstance(input, dict) or 'fields' not in input or \
+            'columns' not in input:
+        return False
+    columns = input['columns']
+    length = None
+    for field in input['fields']:
+        column = columns.get(field)
+        if not isinstance(column, numpy.ndarray):
+            return False
+        if length is None:
+            length = len(column)
+        elif len(column) != length:
+            return False
+    return True
+
+
+def num_rows(input):
+    """
+    Return the number of rows of a columns table.
+    """
+    if not input['fields']:
+        return 0
+    return len(input['columns'][input['fields'][0]])
+
+
+def to_array(values):
+    """
+    Build a column array from a list of values, which is typed if all values
+    are numbers and an object array otherwise. Lists of the same length
+    give a two-dimensional column with one column per component.
+    """
+    if values and all(type(v) in (int, long, float) for v in values):
+        try:
+            return numpy.array(values)
+        except OverflowError:
+            pass
+    elif values and all(type(v) is list for v in values):
+        width = len(values[0])
+        if width and all(len(v) == width for v in values):
+            return to_array([x for v in values for x in v]).reshape(
+                len(values), width)
+    return object_array(values)
+
+
+def object_array(values):
+    array = numpy.empty(len(values), dtype=object)
+    try:
+        array[:] = values
+    except ValueError:
+        # Sequence values, which numpy would try to broadcast
+        for i, v in enumerate(values):
+            array[i] = v
+    return array
+
+
+def parse_column(values):
+    """
+    Build a column array from a list of strings read from delimited text,
+    with each value converted by
+    :py:func:`romanesco.format.tables.coerce_column` the same as for the
+    ``"rows"`` format. The column is ``int64`` if every value is an integer,
+    ``float64`` if every value is a float and an object array of the
+    converted values otherwise.
+    """
+    values = tables.coerce_column(list(values))
+    types = set(itertools.imap(type, values))
+    if types == {int}:
+        return numpy.array(values, dtype=numpy.int64)
+    elif types == {float}:
+        return numpy.array(values, dtype=numpy.float64)
+    return object_array(values)
+
+
+def _delimited_to_columns(input):
+    # csv package does not support unicode
+    input = str(input)
+
+    reader = csv.reader(tables.text_lines(input),
+                        dialect=tables.sniff_dialect(input))
+    try:
+        fields = reader.next()
+    except StopIteration:
+        return {'fields': [], 'columns': {}}
+
+    columns = {}
+    with tables.gc_paused():
+        rows = [row for row in reader if row]
+    if rows:
+        transposed = itertools.izip_longest(*rows)
+        for field, values in itertools.izip(fields, transposed):
+            columns[field] = parse_column(values)
+    else:
+        for field in fields:
+            columns[field] = object_array([])
+    return {'fields': fields, 'columns': columns}
+
+
+def csv_to_columns(input):
+    return _delimited_to_columns(input)
+
+
+def tsv_to_columns(input):
+    return _delimited_to_columns(input)
+
+
+def _value_lists(input):
+    return [input['columns'][field].tolist() for field in input['fields']]
+
+
+def _columns_to_delimited(input, delimiter):
+    output = StringIO()
+    writer = csv.writer(output, delimiter=delimiter, lineterminator='\r\n')
+    writer.writerow(input['fields'])
+    writer.writerows(itertools.izip(*_value_lists(input)))
+    return output.getvalue()
+
+
+def columns_to_csv(input):
+    return _columns_to_delimited(input, ',')
+
+
+def columns_to_tsv(input):
+    return _columns_to_delimited(input, '\t')
+
+
+def rows_to_columns(input):
+    fields = input['fields']
+    rows = input['rows']
+    return {
+        'fields': fields,
+        'columns': {
+            field: to_array([row.get(field) for row in rows])
+            for field in fields
+        }
+    }
+
+
+def columns_to_rows(input):
+    fields = input['fields']
+    return {
+        'fields': fields,
+        'rows': [dict(itertools.izip(fields, values)) for values in
+                 itertools.izip(*_value_lists(input))]
+    }
+
+
+def objectlist_to_columns(input):
+    return rows_to_columns(tables.objectlist_to_rows(input))
+
+
+def columns_to_objectlist(input):
+    return tables.rows_to_objectlist(columns_to_rows(input))
+
+
+def vtktable_to_columns(input):
+    from vtk.util import numpy_support
+
+    fields = []
+    columns = {}
+    for c in range(input.GetNumberOfColumns()):
+        array = input.GetColumn(c)
+        name = array.GetName()
+        fields.append(name)
+        if array.IsNumeric():
+            column = numpy_support.vtk_to_numpy(array).copy()
+            if column.dtype.kind in 'iub':
+                column = column.astype(numpy.int64)
+            elif column.dtype.kind == 'f':
+                column = column.astype(numpy.float64)
+        else:
+            column = object_array([array.GetValue(i) for i in
+                                   xrange(array.GetNumberOfValues())])
+            if array.GetNumberOfComponents() > 1:
+                column = column.reshape(-1, array.GetNumberOfComponents())
+        columns[name] = column
+    return {'fields': fields, 'columns': columns}
+
+
+def columns_to_vtktable(input):
+    import vtk
+    from vtk.util import numpy_support
+    from . import vtkarrays
+
+    output = vtk.vtkTable()
+    for field in input['fields']:
+        column = input['columns'][field]
+        if column.dtype.kind in 'iufb':
+            array = numpy_support.numpy_to_vtk(
+                numpy.ascontiguousarray(column, dtype=numpy.float64),
+                deep=True, array_type=vtk.VTK_DOUBLE)
+            array.SetName(field)
+        else:
+            # The same array types as when converting from rows
+            array = vtkarrays.list_to_array(field, column.tolist())
+        output.AddColumn(array)
+    return output
@@ -0,0 +1,43 @@
+"""
+Native validators shared by many formats. These are referenced from the
+``"function"`` field of validator specifications and are called directly by
+:py:func:`romanesco.isvalid`.
+"""
+
+import collections
+
+
+def is_text(input):
+    return isinstance(input, (str, unicode))
+
+
+def is_text_or_iterator(input):
+    return isinstance(input, (str, unicode, collections.Iterator))
+
+
+def is_iterator(input):
+    return isinstance(input, collections.Iterator)
+
+
+def is_bytes(input):
+    return isinstance(input, str)
+
+
+def is_number(input):
+    return isinstance(input, (int, float))
+
+
+def is_boolean(input):
+    return isinstance(input, bool)
+
+
+def is_list(input):
+    return isinstance(input, list)
+
+
+def is_dict(input):
+    return isinstance(input, dict)
+
+
+def is_anything(input):
+    return True
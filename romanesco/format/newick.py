@@ -0,0 +1,480 @@
+"""
+Native Newick and Nexus readers and writers for the ``"tree"`` type. Text is
+split into tokens with a single regular expression and parsed with an
+explicit stack, so neither VTK nor R is needed and very deep trees do not
+hit Python's recursion limit.
+
+Parsed trees are flat lists indexed by node in depth-first pre-order, with
+the root at index 0: the index of each node's parent (-1 for the root), its
+label, and the length of the edge to its parent (None where missing). The
+``"nested"`` converters follow what ``vtkNewickTreeReader`` produced, and
+``romanesco.format.treearrays`` builds its ``"arrays"`` format from the
+same lists.
+"""
+
+import collections
+import itertools
+import re
+
+LABEL_FIELD = 'node name'
+LENGTH_FIELD = 'weight'
+DEPTH_FIELD = 'node weight'
+
+# Characters of tree set text looked at by the validators
+VALIDATE_SIZE = 4096
+
+# Groups of the token pattern, in order
+_SKIP, _QUOTED, _PUNCTUATION, _WORD, _OTHER = range(1, 6)
+
+_patterns = {}
+
+
+def _pattern(punctuation):
+    if punctuation not in _patterns:
+        p = re.escape(punctuation)
+        _patterns[punctuation] = re.compile(
+            r"(\s+|\[[^\]]*\])|'((?:[^']|'')*)'|([%s])|([^\s\['%s]+)|(.)" %
+            (p, p), re.DOTALL)
+    return _patterns[punctuation]
+
+
+def tokenize(text, punctuation='(),:;'):
+    """
+    Iterate over the tokens of Newick text as ``(punctuation, label)`` pairs,
+    one of which is None. Whitespace and bracketed comments are skipped, and
+    quoted labels are unquoted. The text may also be an iterator of chunks,
+    which are read as they are needed.
+    """
+    pattern = _pattern(punctuation)
+    if isinstance(text, basestring):
+        rest, chunks = text, ()
+    else:
+        rest, chunks = '', text
+    for chunk in itertools.chain(chunks, [None]):
+        final = chunk is None
+        text = rest + chunk if not final else rest
+        rest = ''
+        end = len(text)
+        for match in pattern.finditer(text):
+            group = match.lastindex
+            # A token at the end of a chunk, or an unterminated quote or
+            # comment, may continue in the next chunk
+            if not final and (match.end() == end or group == _OTHER and
+                              match.group(group) in "'["):
+                rest = text[match.start():]
+                break
+            if group == _PUNCTUATION:
+                yield match.group(group), None
+            elif group == _WORD:
+                yield None, match.group(group)
+            elif group == _QUOTED:
+                yield None, match.group(group).replace("''", "'")
+            elif group == _OTHER:
+                raise ValueError('Unexpected %r: char %d' % (
+                    match.group(group), match.start()))
+
+
+def parse(tokens):
+    """
+    Parse one tree from an iterator of tokens, consuming them up to and
+    including its terminating semicolon. Return the lists ``(parent, labels,
+    lengths)``, or None if there are no tokens left.
+    """
+    parent = []
+    labels = []
+    lengths = []
+    stack = []
+    # The node that a label or length applies to, or None if a new node
+    # starts at the next token
+    current = None
+    labelled = False
+
+    def start():
+        parent.append(stack[-1] if stack else -1)
+        labels.append('')
+        lengths.append(None)
+        return len(parent) - 1
+
+    for punctuation, label in tokens:
+        if punctuation is None:
+            if current is None:
+                current = start()
+            elif labelled:
+                raise ValueError('Unexpected label %r' % label)
+            labels[current] = label
+            labelled = True
+        elif punctuation == '(':
+            if current is not None:
+                raise ValueError("Unexpected '('")
+            stack.append(start())
+        elif punctuation == ',' or punctuation == ')':
+            if not stack:
+                raise ValueError("Unexpected '%s'" % punctuation)
+            if current is None:
+                start()
+            if punctuation == ',':
+                current = None
+            else:
+                current = stack.pop()
+            labelled = False
+        elif punctuation == ':':
+            if current is None:
+                current = start()
+            if lengths[current] is not None:
+                raise ValueError("Unexpected ':'")
+            value = next(tokens, (None, None))[1]
+            try:
+                lengths[current] = float(value)
+            except (TypeError, ValueError):
+                raise ValueError('Invalid branch length %r' % value)
+            labelled = True
+        elif punctuation == ';':
+            break
+        else:
+            raise ValueError("Unexpected '%s'" % punctuation)
+    else:
+        if not parent:
+            return None
+    if stack:
+        raise ValueError('Unbalanced parentheses')
+    if not parent:
+        start()
+    return parent, labels, lengths
+
+
+def parse_newick(text):
+    """
+    Parse the first tree of Newick text into ``(parent, labels, lengths)``.
+    """
+    tree = parse(tokenize(text))
+    if tree is None:
+        raise ValueError('No tree found')
+    return tree
+
+
+def newick_trees(text):
+    """
+    Iterate over the trees of Newick text with one or more trees, each ended
+    by a semicolon, yielding ``(parent, labels, lengths)`` for each. The text
+    may be an iterator of chunks.
+    """
+    tokens = tokenize(text)
+    while True:
+        tree = parse(tokens)
+        if tree is None:
+            return
+        yield tree
+
+
+def parse_nexus(text):
+    """
+    Parse the first tree of the TREES block of Nexus text into ``(parent,
+    labels, lengths)``, with tip labels translated by any TRANSLATE table.
+    """
+    for tree in nexus_trees(text):
+        return tree
+    raise ValueError('No tree found')
+
+
+def nexus_trees(text):
+    """
+    Iterate over the trees in the TREES blocks of Nexus text, yielding
+    ``(parent, labels, lengths)`` for each. The text may be an iterator of
+    chunks.
+    """
+    tokens = tokenize(text, '(),:;=')
+    punctuation, label = next(tokens, (None, None))
+    if label is None or label.upper() != '#NEXUS':
+        raise ValueError('Missing #NEXUS header')
+
+    block = None
+    translate = {}
+    for punctuation, label in tokens:
+        command = (label or '').upper()
+        if command == 'BEGIN':
+            block = next(tokens, (None, ''))[1].upper()
+            translate = {}
+        elif command in ('END', 'ENDBLOCK'):
+            block = None
+        elif block == 'TREES' and command == 'TRANSLATE':
+            translate = _translation(tokens)
+            continue
+        elif block == 'TREES' and command == 'TREE':
+            for punctuation, label in tokens:
+                if punctuation == '=':
+                    break
+            tree = parse(tokens)
+            if tree is None:
+                raise ValueError('Missing tree')
+            if translate:
+                _translate(tree, translate)
+            yield tree
+            continue
+        if punctuation != ';':
+            for punctuation, label in tokens:
+                if punctuation == ';':
+                    break
+
+
+def _translation(tokens):
+    # The TRANSLATE table, up to its semicolon
+    translate = {}
+    key = None
+    for punctuation, label in tokens:
+        if punctuation == ';':
+            break
+        if punctuation is None:
+            if key is None:
+                key = label
+            else:
+                translate[key] = label
+                key = None
+    return translate
+
+
+def _translate(tree, translate):
+    parent, labels, lengths = tree
+    internal = set(parent)
+    for i, label in enumerate(labels):
+        if i not in internal and label in translate:
+            labels[i] = translate[label]
+
+
+def children_lists(parent):
+    """
+    Return the list of child indices of each node.
+    """
+    children = [[] for p in parent]
+    for child, p in enumerate(parent[1:], 1):
+        children[p].append(child)
+    return children
+
+
+def weights(parent, lengths):
+    """
+    Return the edge weights and the node weights (distances from the root)
+    of a parsed tree, or ``(None, None)`` if it has no branch lengths. As
+    with ``vtkNewickTreeReader``, missing lengths count as zero and the
+    length of the root edge is ignored.
+    """
+    if all(length is None for length in lengths[1:]):
+        return None, None
+    edges = [None] + [0.0 if length is None else length
+                      for length in lengths[1:]]
+    depths = [0.0] * len(parent)
+    for i in xrange(1, len(parent)):
+        depths[i] = depths[parent[i]] + edges[i]
+    return edges, depths
+
+
+def to_nested(parent, labels, lengths):
+    """
+    Build a nested tree from a parsed tree.
+    """
+    edges, depths = weights(parent, lengths)
+    if edges is None:
+        root = {'node_fields': [LABEL_FIELD], 'edge_fields': []}
+    else:
+        root = {'node_fields': [LABEL_FIELD, DEPTH_FIELD],
+                'edge_fields': [LENGTH_FIELD]}
+    nodes = []
+    for i, label in enumerate(labels):
+        node_data = {LABEL_FIELD: label}
+        if edges is not None:
+            node_data[DEPTH_FIELD] = depths[i]
+        if i == 0:
+            node = root
+        else:
+            node = {'edge_data': {} if edges is None else
+                    {LENGTH_FIELD: edges[i]}}
+            siblings = nodes[parent[i]].get('children')
+            if siblings is None:
+                siblings = nodes[parent[i]]['children'] = []
+            siblings.append(node)
+        node['node_data'] = node_data
+        nodes.append(node)
+    return root
+
+
+def from_nested(input):
+    """
+    Flatten a nested tree into ``(parent, labels, lengths)`` lists.
+    """
+    parent = []
+    labels = []
+    lengths = []
+    stack = [(-1, input)]
+    while stack:
+        p, node = stack.pop()
+        index = len(parent)
+        parent.append(p)
+        labels.append(node.get('node_data', {}).get(LABEL_FIELD, ''))
+        lengths.append((node.get('edge_data') or {}).get(LENGTH_FIELD))
+        children = node.get('children')
+        if children:
+            stack.extend((index, child) for child in reversed(children))
+    lengths[0] = None
+    return parent, labels, lengths
+
+
+# Characters that require a Newick label to be quoted
+_SPECIAL = frozenset(' \t\r\n()[]\':;,=')
+
+
+def _label(label):
+    if isinstance(label, unicode):
+        label = label.encode('utf8')
+    elif not isinstance(label, str):
+        label = str(label)
+    if (len(label) < 2 or label[0] != "'" or label[-1] != "'") and \
+            not _SPECIAL.isdisjoint(label):
+        return "'" + label.replace("'", "''") + "'"
+    return label
+
+
+def _length(length):
+    if float(length).is_integer():
+        return ':%d' % length
+    return ':' + repr(float(length))
+
+
+def write_newick(children, labels, lengths):
+    """
+    Write a tree given the child indices, labels and edge lengths of its
+    nodes as Newick text. Lengths that are None or NaN are left out.
+    """
+    # Nodes are opened when first popped, and closed once their children
+    # have been written
+    pieces = []
+    stack = [0]
+    while stack:
+        item = stack.pop()
+        if isinstance(item, str):
+            pieces.append(item)
+            continue
+        if item >= 0 and children[item]:
+            pieces.append('(')
+            stack.append(~item)
+            items = []
+            for child in children[item]:
+                if items:
+                    items.append(',')
+                items.append(child)
+            stack.extend(reversed(items))
+            continue
+        if item < 0:
+            pieces.append(')')
+            item = ~item
+        pieces.append(_label(labels[item]))
+        length = lengths[item]
+        if length is not None and length == length:
+            pieces.append(_length(length))
+    pieces.append(';')
+    return ''.join(pieces)
+
+
+def write_nexus(children, labels, lengths):
+    """
+    Write a tree as Nexus text with TAXA and TREES blocks, in the layout of
+    ape's ``write.nexus``. Tips are written by number and translated.
+    """
+    tips = [i for i, c in enumerate(children) if not c]
+    numbered = list(labels)
+    for number, tip in enumerate(tips, 1):
+        numbered[tip] = str(number)
+    lines = ['#NEXUS', '[Romanesco]', '', 'BEGIN TAXA;',
+             '\tDIMENSIONS NTAX = %d;' % len(tips), '\tTAXLABELS']
+    lines.extend('\t\t' + _label(labels[tip]) for tip in tips)
+    lines.extend(['\t;', 'END;', 'BEGIN TREES;', '\tTRANSLATE'])
+    lines.extend('\t\t%d\t%s%s' % (number, _label(labels[tip]),
+                                   ',' if number < len(tips) else '')
+                 for number, tip in enumerate(tips, 1))
+    lines.extend(['\t;', '\tTREE * UNTITLED = [&R] ' +
+                  write_newick(children, numbered, lengths), 'END;', ''])
+    return '\n'.join(lines)
+
+
+def newick_to_nested(input):
+    return to_nested(*parse_newick(input))
+
+
+def nexus_to_nested(input):
+    return to_nested(*parse_nexus(input))
+
+
+def nested_to_newick(input):
+    parent, labels, lengths = from_nested(input)
+    return write_newick(children_lists(parent), labels, lengths)
+
+
+def nested_to_nexus(input):
+    parent, labels, lengths = from_nested(input)
+    return write_nexus(children_lists(parent), labels, lengths)
+
+
+def newick_to_nexus(input):
+    parent, labels, lengths = parse_newick(input)
+    return write_nexus(children_lists(parent), labels, lengths)
+
+
+def nexus_to_newick(input):
+    parent, labels, lengths = parse_nexus(input)
+    return write_newick(children_lists(parent), labels, lengths)
+
+
+def _first_token(text, punctuation):
+    try:
+        token = next(tokenize(text[:VALIDATE_SIZE], punctuation),
+                     (None, None))
+    except ValueError:
+        return None
+    return token[0] or token[1]
+
+
+def is_newick_multi(input):
+    """
+    Check that text is not Nexus, looking only at its first characters. An
+    iterator of chunks is accepted without reading it, and its trees are
+    checked as they are parsed.
+    """
+    if isinstance(input, collections.Iterator):
+        return True
+    if not isinstance(input, basestring):
+        return False
+    return (_first_token(input, '(),:;') or '').upper() != '#NEXUS'
+
+
+def is_nexus_multi(input):
+    """
+    Check that text starts with the ``#NEXUS`` header, looking only at its
+    first characters. An iterator of chunks is accepted without reading it,
+    and its trees are checked as they are parsed.
+    """
+    if isinstance(input, collections.Iterator):
+        return True
+    if not isinstance(input, basestring):
+        return False
+    return (_first_token(input, '(),:;=') or '').upper() == '#NEXUS'
+
+
+def newick_multi_to_nested_multi(input):
+    return (to_nested(*tree) for tree in newick_trees(input))
+
+
+def nexus_multi_to_nested_multi(input):
+    return (to_nested(*tree) for tree in nexus_trees(input))
+
+
+def nested_multi_to_newick_multi(input):
+    for tree in input:
+        parent, labels, lengths = from_nested(tree)
+        yield write_newick(children_lists(parent), labels, lengths) + '\n'
+
+
+def nested_multi_to_nexus_multi(input):
+    yield '#NEXUS\n[Romanesco]\n\nBEGIN TREES;\n'
+    for i, tree in enumerate(input, 1):
+        parent, labels, lengths = from_nested(tree)
+        yield '\tTREE tree_%d = [&R] %s\n' % (
+            i, write_newick(children_lists(parent), labels, lengths))
+    yield 'END;\n'
@@ -0,0 +1,162 @@
+"""
+Streaming conversion of the ``"phyloxml"`` tree format to the Arbor tree
+store. The document is read with ``iterparse`` and each clade is turned into
+a document as soon as its closing tag is read, after its children, so only
+the clades on the path from the root are held in memory at any time.
+
+Tree store documents have an integer ``"_id"`` and the ids of their child
+clades in ``"clades"``. The other phyloXML elements of a clade become fields
+named as in ``Bio.Phylo``, with repeatable elements such as ``confidence``
+collected in lists (``"confidences"``). The last document is a handle with
+``"rooted"`` and the id of the root clade in ``"clades"``.
+"""
+
+import bson
+import itertools
+from StringIO import StringIO
+from xml.etree import cElementTree
+
+# Repeatable clade elements and the list fields they are collected in
+_LISTS = {
+    'confidence': 'confidences',
+    'taxonomy': 'taxonomies',
+    'sequence': 'sequences',
+    'distribution': 'distributions',
+    'reference': 'references',
+    'property': 'properties'
+}
+
+# Elements whose text is a number
+_FLOATS = frozenset(['branch_length', 'width', 'confidence', 'value', 'lat',
+                     'long', 'alt', 'minimum', 'maximum'])
+_INTS = frozenset(['red', 'green', 'blue'])
+
+
+def _tag(element):
+    return element.tag.rpartition('}')[2]
+
+
+def _text(tag, text):
+    text = (text or '').strip()
+    try:
+        if tag in _FLOATS:
+            return float(text)
+        if tag in _INTS:
+            return int(text)
+    except ValueError:
+        pass
+    return text
+
+
+def _value(element):
+    # A plain element is its text, others a dict of attributes and children
+    tag = _tag(element)
+    if not len(element) and not element.attrib:
+        return _text(tag, element.text)
+    value = dict(element.attrib)
+    if len(element):
+        for child in element:
+            child_tag = _tag(child)
+            child_value = _value(child)
+            if child_tag in value:
+                if not isinstance(value[child_tag], list):
+                    value[child_tag] = [value[child_tag]]
+                value[child_tag].append(child_value)
+            else:
+                value[child_tag] = child_value
+    elif element.text and element.text.strip():
+        value['value'] = _text(tag, element.text)
+    return value
+
+
+def _clade(element, clades, next_id):
+    doc = {}
+    if 'branch_length' in element.attrib:
+        doc['branch_length'] = _text('branch_length',
+                                     element.attrib['branch_length'])
+    for child in element:
+        tag = _tag(child)
+        if tag == 'clade':
+            continue
+        if tag in _LISTS:
+            doc.setdefault(_LISTS[tag], []).append(_value(child))
+        else:
+            doc[tag] = _value(child)
+    if clades:
+        doc['clades'] = clades
+    doc['_id'] = next_id
+    return doc
+
+
+def treestore_batches(source, batch_size=1000):
+    """
+    Iterate over lists of at most ``batch_size`` tree store documents for
+    the first phylogeny in a phyloXML file name or file-like object. The
+    handle document comes last.
+    """
+    events = cElementTree.iterparse(source, events=('start', 'end'))
+    # Open elements below the phylogeny, and the child ids of open clades
+    path = []
+    clades = []
+    phylogeny = None
+    batch = []
+    next_id = 0
+    root_id = None
+    for event, element in events:
+        tag = _tag(element)
+        if event == 'start':
+            if phylogeny is None:
+                if tag == 'phylogeny':
+                    phylogeny = element
+                continue
+            path.append(element)
+            if tag == 'clade':
+                clades.append([])
+            continue
+        if element is phylogeny:
+            break
+        if phylogeny is None:
+            continue
+        path.pop()
+        if tag != 'clade':
+            continue
+
+        batch.append(_clade(element, clades.pop(), next_id))
+        if clades:
+            clades[-1].append(next_id)
+        else:
+            root_id = next_id
+        next_id += 1
+        # Drop the finished clade so the document does not build up
+        (path[-1] if path else phylogeny).remove(element)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+
+    if root_id is None:
+        raise Exception('No clades found in phyloXML input')
+    handle = {'rooted': phylogeny.get('rooted', 'true').lower() == 'true',
+              'clades': [root_id]}
+    for child in phylogeny:
+        if _tag(child) in ('name', 'description'):
+            handle[_tag(child)] = _value(child)
+    handle['_id'] = next_id
+    batch.append(handle)
+    yield batch
+
+
+def insert_treestore(source, collection, batch_size=1000):
+    """
+    Insert the tree store documents of a phyloXML file into a MongoDB
+    collection a batch at a time, returning the id of the handle document.
+    """
+    for batch in treestore_batches(source, batch_size):
+        collection.insert(batch)
+    return batch[-1]['_id']
+
+
+def phyloxml_to_treestore(input):
+    if isinstance(input, unicode):
+        input = input.encode('utf8')
+    docs = itertools.chain.from_iterable(treestore_batches(StringIO(input)))
+    return ''.join(bson.BSON.encode(doc) for doc in docs)
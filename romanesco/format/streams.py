@@ -0,0 +1,312 @@
+"""
+Streaming conversions. A stream is an iterator of chunks of data in some
+format, so data larger than memory can be converted chunk by chunk with
+:py:func:`romanesco.convert_stream`. Chunks of the ``"table"`` formats are:
+
+:``"csv"``, ``"tsv"``, ``"jsonlines"``: Strings of text. Chunk boundaries
+    may fall anywhere, including inside a line.
+
+:``"rows"``: Dictionaries with ``"fields"`` and ``"rows"`` keys holding up
+    to ``chunk_size`` rows.
+
+:``"objectlist"``: Lists of up to ``chunk_size`` dictionaries.
+
+Stream converters are functions taking an iterator of input chunks and the
+chunk size, and returning an iterator of output chunks.
+"""
+
+import bson.json_util
+import collections
+import csv
+from StringIO import StringIO
+
+from . import tables
+
+# Stream converters, stream_converters[type][in_format][out_format] = function
+stream_converters = {}
+
+# Formats whose chunks are pieces of text
+text_formats = {"table": ("csv", "tsv", "jsonlines")}
+
+# Memoized conversion paths, keyed by (type, in_format, out_format)
+_paths = {}
+
+
+def register_stream_converter(type, in_format, out_format, function):
+    """
+    Register a stream converter.
+
+    :param type: The type specifier string.
+    :param in_format: The format of the input chunks.
+    :param out_format: The format of the output chunks.
+    :param function: A function of the input chunk iterator and the chunk
+        size returning an iterator of output chunks.
+    """
+    stream_converters.setdefault(type, {}).setdefault(
+        in_format, {})[out_format] = function
+    _paths.clear()
+
+
+def stream_conversion_path(type, in_format, out_format):
+    """
+    Return the shortest list of stream converters from one format to another.
+
+    :returns: A list of stream converter functions to apply in order.
+    """
+    key = (type, in_format, out_format)
+    if key not in _paths:
+        edges = stream_converters.get(type, {})
+        previous = {in_format: None}
+        queue = collections.deque([in_format])
+        while queue and out_format not in previous:
+            format = queue.popleft()
+            for next_format in edges.get(format, {}):
+                if next_format not in previous:
+                    previous[next_format] = format
+                    queue.append(next_format)
+
+        if out_format not in previous:
+            raise Exception(
+                "No stream conversion path from %s:%s to %s:%s." % (
+                    type, in_format, type, out_format))
+
+        path = []
+        format = out_format
+        while previous[format] is not None:
+            path.insert(0, edges[previous[format]][format])
+            format = previous[format]
+        _paths[key] = path
+    return _paths[key]
+
+
+def to_chunks(type, format, data, chunk_size):
+    """
+    Return an iterator of chunks for data that is either already a stream or
+    a whole value in the given format.
+    """
+    if format in text_formats.get(type, ()):
+        if isinstance(data, (str, unicode)):
+            return iter([data])
+    elif format == "rows" and isinstance(data, dict):
+        return (
+            {"fields": data["fields"], "rows": data["rows"][i:i + chunk_size]}
+            for i in xrange(0, max(len(data["rows"]), 1), chunk_size))
+    elif format == "objectlist" and isinstance(data, list):
+        return (data[i:i + chunk_size]
+                for i in xrange(0, len(data), chunk_size))
+    return iter(data)
+
+
+def _encode(chunks):
+    for chunk in chunks:
+        yield chunk.encode("utf8") if isinstance(chunk, unicode) else chunk
+
+
+def _lines(chunks):
+    """
+    Split text chunks into lines, keeping the line endings.
+    """
+    rest = ""
+    for chunk in chunks:
+        lines = (rest + chunk).splitlines(True)
+        rest = ""
+        if lines and not lines[-1].endswith("\n"):
+            rest = lines.pop()
+        for line in lines:
+            yield line
+    if rest:
+        yield rest
+
+
+def _sniff_prefix(chunks):
+    """
+    Read just enough of a text stream for
+    :py:func:`romanesco.format.tables.sniff_dialect` to see the same sample
+    as it would for the whole text.
+
+    :returns: A tuple ``(prefix, complete)``.
+    """
+    prefix = ""
+    for chunk in chunks:
+        prefix += chunk
+        newline = prefix.find("\n")
+        if newline < 0 or newline == len(prefix) - 1:
+            continue
+        size = tables.SNIFF_SIZE
+        while size <= len(prefix):
+            if "\n".join(prefix[:size].splitlines()[:-1]):
+                return prefix, False
+            size += tables.SNIFF_SIZE
+    return prefix, True
+
+
+def delimited_to_rows(chunks, chunk_size):
+    """
+    Parse a stream of CSV or TSV text into rows chunks. The dialect is
+    determined from a bounded prefix of the stream, and numeric values are
+    converted as by :py:func:`romanesco.format.csv_to_rows`.
+    """
+    chunks = _encode(chunks)
+    prefix, complete = _sniff_prefix(chunks)
+    dialect = tables.sniff_dialect(prefix)
+
+    def text():
+        yield prefix
+        if not complete:
+            for chunk in chunks:
+                yield chunk
+
+    reader = csv.reader(_lines(text()), dialect=dialect)
+    fields = next(reader, None)
+    records = []
+    emitted = False
+    for record in reader:
+        if record:
+            records.append(record)
+        if len(records) == chunk_size:
+            with tables.gc_paused():
+                rows = tables.records_to_rows(fields, records)
+            yield {"fields": fields, "rows": rows}
+            records = []
+            emitted = True
+    if records or not emitted:
+        with tables.gc_paused():
+            rows = tables.records_to_rows(fields, records)
+        yield {"fields": fields, "rows": rows}
+
+
+def select_delimited(chunks, fields=None, query=None, limit=None,
+                     chunk_size=1000):
+    """
+    Select from a stream of CSV or TSV text as it is read, yielding text in
+    the same dialect. Only the columns named in ``fields`` are kept, only
+    records whose values equal those of the ``query`` dict (as text or once
+    converted to numbers), and at most ``limit`` records. Reading stops as
+    soon as the limit is reached.
+    """
+    chunks = _encode(chunks)
+    prefix, complete = _sniff_prefix(chunks)
+    dialect = tables.sniff_dialect(prefix)
+
+    def text():
+        yield prefix
+        if not complete:
+            for chunk in chunks:
+                yield chunk
+
+    reader = csv.reader(_lines(text()), dialect=dialect)
+    header = next(reader, None)
+    if header is None:
+        return
+    position = {field: i for i, field in reversed(list(enumerate(header)))}
+    for field in list(fields or ()) + list(query or ()):
+        if field not in position:
+            raise Exception("Unknown column: %s" % field)
+    kept = [position[f] for f in fields] if fields else range(len(header))
+    conditions = [(position[f], value) for f, value in (query or {}).items()]
+
+    output = StringIO()
+    writer = csv.writer(output, dialect=dialect, lineterminator="\n")
+    writer.writerow([header[i] for i in kept])
+    count = 0
+    for record in reader:
+        if limit is not None and count >= limit:
+            break
+        if not record:
+            continue
+        record.extend([""] * (len(header) - len(record)))
+        if not all(record[i] == value or
+                   tables.coerce_value(record[i]) == value
+                   for i, value in conditions):
+            continue
+        writer.writerow([record[i] for i in kept])
+        count += 1
+        if count % chunk_size == 0:
+            yield output.getvalue()
+            output.seek(0)
+            output.truncate()
+    yield output.getvalue()
+
+
+def _rows_to_delimited(chunks, delimiter):
+    output = StringIO()
+    writer = None
+    for chunk in chunks:
+        if writer is None:
+            fields = chunk["fields"]
+            writer = csv.DictWriter(output, fields, delimiter=delimiter)
+            writer.writerow({d: d for d in fields})
+        added = [d for d in chunk["fields"] if d not in writer.fieldnames]
+        if added:
+            raise Exception(
+                "Fields %s first appear after the header was written; "
+                "streamed tables must give every field in their first "
+                "chunk." % ", ".join(map(repr, added)))
+        for row in chunk["rows"]:
+            writer.writerow(row)
+        yield output.getvalue()
+        output.seek(0)
+        output.truncate()
+
+
+def rows_to_csv(chunks, chunk_size):
+    """
+    Write rows chunks as CSV text. The header is taken from the fields of the
+    first chunk, and later chunks may not add fields.
+    """
+    return _rows_to_delimited(chunks, ",")
+
+
+def rows_to_tsv(chunks, chunk_size):
+    """
+    Write rows chunks as TSV text. The header is taken from the fields of the
+    first chunk, and later chunks may not add fields.
+    """
+    return _rows_to_delimited(chunks, "\t")
+
+
+def rows_to_objectlist(chunks, chunk_size):
+    for chunk in chunks:
+        yield tables.rows_to_objectlist(chunk)
+
+
+def objectlist_to_rows(chunks, chunk_size):
+    """
+    Convert objectlist chunks to rows chunks. The fields of each chunk are
+    all fields seen so far, in the order they were first seen.
+    """
+    fields = collections.OrderedDict()
+    for chunk in chunks:
+        output = tables.objectlist_to_rows(chunk)
+        for field in output["fields"]:
+            fields[field] = True
+        output["fields"] = fields.keys()
+        yield output
+
+
+def jsonlines_to_objectlist(chunks, chunk_size):
+    rows = []
+    for line in _lines(chunks):
+        rows.append(bson.json_util.loads(line))
+        if len(rows) == chunk_size:
+            yield rows
+            rows = []
+    if rows:
+        yield rows
+
+
+def objectlist_to_jsonlines(chunks, chunk_size):
+    for chunk in chunks:
+        yield tables.objectlist_to_jsonlines(chunk)
+
+
+for _in, _out, _function in [
+        ("csv", "rows", delimited_to_rows),
+        ("tsv", "rows", delimited_to_rows),
+        ("rows", "csv", rows_to_csv),
+        ("rows", "tsv", rows_to_tsv),
+        ("rows", "objectlist", rows_to_objectlist),
+        ("objectlist", "rows", objectlist_to_rows),
+        ("jsonlines", "objectlist", jsonlines_to_objectlist),
+        ("objectlist", "jsonlines", objectlist_to_jsonlines)]:
+    register_stream_converter("table", _in, _out, _function)
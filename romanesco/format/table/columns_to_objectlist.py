@@ -0,0 +1,3 @@
+from romanesco.format.columns import columns_to_objectlist
+
+output = columns_to_objectlist(input)
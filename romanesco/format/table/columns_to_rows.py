@@ -0,0 +1,3 @@
+from romanesco.format.columns import columns_to_rows
+
+output = columns_to_rows(input)
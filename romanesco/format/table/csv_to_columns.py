@@ -0,0 +1,3 @@
+from romanesco.format.columns import csv_to_columns
+
+output = csv_to_columns(input)
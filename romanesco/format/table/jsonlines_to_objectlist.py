@@ -1,3 +1,3 @@
-import bson.json_util
+from romanesco.format.tables import jsonlines_to_objectlist
 
-output = [bson.json_util.loads(line) for line in input.splitlines()]
+output = jsonlines_to_objectlist(input)
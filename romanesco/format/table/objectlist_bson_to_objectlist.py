@@ -1,4 +1,3 @@
-import bson
-import collections
+from romanesco.format.tables import objectlist_bson_to_objectlist
 
-output = bson.decode_all(input, collections.OrderedDict)
+output = objectlist_bson_to_objectlist(input)
@@ -0,0 +1,3 @@
+from romanesco.format.columns import objectlist_to_columns
+
+output = objectlist_to_columns(input)
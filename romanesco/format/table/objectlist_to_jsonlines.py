@@ -0,0 +1,3 @@
+from romanesco.format.tables import objectlist_to_jsonlines
+
+output = objectlist_to_jsonlines(input)
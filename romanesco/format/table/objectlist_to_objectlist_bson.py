@@ -1,3 +1,3 @@
-import bson
+from romanesco.format.tables import objectlist_to_objectlist_bson
 
-output = "".join([bson.BSON.encode(row) for row in input])
+output = objectlist_to_objectlist_bson(input)
@@ -1 +1,3 @@
-output = input["fields"]
+from romanesco.format.tables import rows_to_column_names
+
+output = rows_to_column_names(input)
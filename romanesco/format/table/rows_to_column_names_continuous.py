@@ -1,4 +1,3 @@
-output = []
-for column in input["fields"]:
-    if isinstance(input["rows"][0][column], (int, float)):
-        output.append(column)
+from romanesco.format.tables import rows_to_column_names_continuous
+
+output = rows_to_column_names_continuous(input)
@@ -1,4 +1,3 @@
-output = []
-for column in input["fields"]:
-    if isinstance(input["rows"][0][column], (str, unicode)):
-        output.append(column)
+from romanesco.format.tables import rows_to_column_names_discrete
+
+output = rows_to_column_names_discrete(input)
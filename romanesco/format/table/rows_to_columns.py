@@ -0,0 +1,3 @@
+from romanesco.format.columns import rows_to_columns
+
+output = rows_to_columns(input)
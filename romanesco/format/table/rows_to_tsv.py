@@ -1,9 +1,3 @@
-import csv
-import StringIO
+from romanesco.format.tables import rows_to_tsv
 
-output = StringIO.StringIO()
-writer = csv.DictWriter(output, input["fields"], delimiter='\t')
-writer.writerow({d: d for d in input["fields"]})
-for d in input["rows"]:
-    writer.writerow(d)
-output = output.getvalue()
+output = rows_to_tsv(input)
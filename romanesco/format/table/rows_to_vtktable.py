@@ -1,8 +1,3 @@
-from romanesco.format import dict_to_vtkarrays, dict_to_vtkrow
-import vtk
+from romanesco.format.vtkarrays import rows_to_vtktable
 
-output = vtk.vtkTable()
-if len(input["rows"]) > 0:
-    dict_to_vtkarrays(input["rows"][0], input["fields"], output.GetRowData())
-    for d in input["rows"]:
-        dict_to_vtkrow(d, output.GetRowData())
+output = rows_to_vtktable(input)
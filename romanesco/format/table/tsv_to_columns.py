@@ -0,0 +1,3 @@
+from romanesco.format.columns import tsv_to_columns
+
+output = tsv_to_columns(input)
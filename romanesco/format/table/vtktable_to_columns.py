@@ -0,0 +1,3 @@
+from romanesco.format.columns import vtktable_to_columns
+
+output = vtktable_to_columns(input)
@@ -1,7 +1,3 @@
-from romanesco.format import vtkrow_to_dict
+from romanesco.format.vtkarrays import vtktable_to_rows
 
-output = {"fields": [], "rows": []}
-for c in range(input.GetNumberOfColumns()):
-    output["fields"].append(input.GetColumnName(c))
-for r in range(input.GetNumberOfRows()):
-    output["rows"].append(vtkrow_to_dict(input.GetRowData(), r))
+output = vtktable_to_rows(input)
@@ -0,0 +1,284 @@
+"""
+Native implementations of the ``"table"`` type converters and validators.
+"""
+
+import bson
+import bson.json_util
+import collections
+import contextlib
+import csv
+import gc
+import itertools
+import math
+import re
+from StringIO import StringIO
+
+
+def is_rows(input):
+    return isinstance(input, dict) and 'fields' in input and 'rows' in input
+
+
+def is_objectlist(input):
+    return isinstance(input, list) and (
+        len(input) == 0 or isinstance(input[0], dict))
+
+
+# Size of the steps in which the sample for sniff_dialect grows
+SNIFF_SIZE = 5000
+
+# Number of values of each column used to guess its type
+TYPE_SAMPLE_SIZE = 100
+
+# Prefix of every string accepted by int() or float()
+_NUMBER = re.compile(r'\s*[-+]?\s*(?:\d|\.\d|inf|nan)', re.IGNORECASE)
+
+# Strings accepted by int()
+_INTEGER = re.compile(r'\s*[-+]?\s*\d+\s*$')
+
+# A carriage return that does not start a CRLF line ending
+_LONE_CR = re.compile(r'\r(?!\n)')
+
+
+def sniff_dialect(input):
+    """
+    Determine the CSV dialect of delimited text. Only a bounded prefix of the
+    text is examined, so this may also be called with a prefix of the data
+    that is long enough to hold the sample.
+    """
+    # Special case: detect single-column files.
+    # This check assumes that our only valid delimiters are commas and tabs.
+    end = input.find('\n')
+    firstLine = input if end < 0 else input[:end]
+    if not ('\t' in firstLine or ',' in firstLine) or _single_line(input):
+        return 'excel'
+
+    # Take a data sample to determine dialect, but
+    # don't include incomplete last line
+    sample = ''
+    sampleSize = 0
+    while len(sample) == 0:
+        sampleSize += SNIFF_SIZE
+        sample = '\n'.join(input[:sampleSize].splitlines()[:-1])
+    dialect = csv.Sniffer().sniff(sample)
+    dialect.skipinitialspace = True
+    return dialect
+
+
+def _single_line(input):
+    # Same as len(input.splitlines()) == 1, without splitting all of input
+    size = SNIFF_SIZE
+    while True:
+        lines = len(input[:size].splitlines())
+        if lines > 1 or size >= len(input):
+            return lines == 1
+        size *= 2
+
+
+@contextlib.contextmanager
+def gc_paused():
+    """
+    Pause the cyclic garbage collector while building many containers, such
+    as the rows of a large table, since none of them can form cycles yet and
+    repeated collections would only rescan them.
+    """
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+
+def text_lines(input):
+    """
+    Iterate over the lines of delimited text, keeping line endings so that
+    quoted values spanning lines are read correctly.
+    """
+    if _LONE_CR.search(input):
+        return iter(input.splitlines(True))
+    return StringIO(input)
+
+
+def coerce_value(value):
+    """
+    Convert a string read from delimited text to an ``int`` or a ``float``
+    if possible. NaN, Inf and -Inf are kept as strings, since they do not
+    pass through JSON converters cleanly.
+    """
+    if not isinstance(value, str) or not _NUMBER.match(value):
+        return value
+    if _INTEGER.match(value):
+        return int(value)
+    try:
+        number = float(value)
+    except ValueError:
+        return value
+    if math.isnan(number) or math.isinf(number):
+        return value
+    return number
+
+
+def coerce_column(values):
+    """
+    Apply :py:func:`coerce_value` to a list of strings. The type of the
+    column is guessed from its first values, so that columns of integers or
+    floats can be converted in bulk, and only the values that do not match
+    the guess are converted one at a time.
+    """
+    if None in values:
+        return map(coerce_value, values)
+
+    sample = values[:TYPE_SAMPLE_SIZE]
+    if all(_INTEGER.match(v) for v in sample):
+        try:
+            return map(int, values)
+        except ValueError:
+            pass
+    elif all(_NUMBER.match(v) for v in sample):
+        try:
+            numbers = map(float, values)
+        except ValueError:
+            pass
+        else:
+            # Integers, NaN and infinities need another look
+            for flags in (map(float.is_integer, numbers),
+                          map(math.isnan, numbers),
+                          map(math.isinf, numbers)):
+                for i in itertools.compress(xrange(len(numbers)), flags):
+                    numbers[i] = coerce_value(values[i])
+            return numbers
+
+    # Only values that look like numbers need converting
+    output = list(values)
+    matches = map(_NUMBER.match, values)
+    for i in itertools.compress(xrange(len(values)), matches):
+        output[i] = coerce_value(values[i])
+    return output
+
+
+def records_to_rows(fields, records):
+    """
+    Build the rows of a table from records read with a CSV reader, the same
+    as :py:class:`csv.DictReader` does but with numbers converted a column
+    at a time with :py:func:`coerce_column`.
+
+    :param fields: The field names from the header.
+    :param records: Lists of values, excluding empty records.
+    """
+    if not records:
+        return []
+    width = len(fields)
+    if width == 0:
+        return [{None: record} for record in records]
+
+    columns = [coerce_column(list(values)) for values in
+               itertools.islice(itertools.izip_longest(*records), width)]
+    if len(columns) < width:
+        columns.extend([[None] * len(records)] * (width - len(columns)))
+    rows = [dict(itertools.izip(fields, values))
+            for values in itertools.izip(*columns)]
+
+    # Extra values go under the None key, as with csv.DictReader
+    for row, record in itertools.izip(rows, records):
+        if len(record) > width:
+            row[None] = record[width:]
+    return rows
+
+
+def _rows_to_delimited(input, delimiter):
+    output = StringIO()
+    writer = csv.DictWriter(output, input["fields"], delimiter=delimiter)
+    writer.writerow({d: d for d in input["fields"]})
+    for d in input["rows"]:
+        writer.writerow(d)
+    return output.getvalue()
+
+
+def rows_to_csv(input):
+    return _rows_to_delimited(input, ',')
+
+
+def rows_to_tsv(input):
+    return _rows_to_delimited(input, '\t')
+
+
+def objectlist_to_rows(input):
+    # Attempt to keep column ordering if objects happen to have ordered keys
+    field_map = collections.OrderedDict()
+    rows = []
+
+    def subkeys(path, obj, row):
+        if isinstance(obj, dict):
+            for k in obj:
+                if isinstance(k, (str, unicode)):
+                    subkeys(path + [k], obj[k], row)
+        elif len(path) > 0:
+            field = ".".join(path)
+            field_map[field] = True
+            row[field] = obj
+
+    for obj in input:
+        row = {}
+        subkeys([], obj, row)
+        rows.append(row)
+
+    fields = [key for key in field_map]
+
+    return {"fields": fields, "rows": rows}
+
+
+def rows_to_objectlist(input):
+    def set_nested(obj, path, v):
+        key = path.pop()
+        if len(path) == 0:
+            obj[key] = v
+            return
+        obj[key] = {}
+        set_nested(obj[key], path, v)
+
+    output = []
+    for row in input["rows"]:
+        item = {}
+        for k, v in row.iteritems():
+            path = k.split('.')
+            path.reverse()
+            set_nested(item, path, v)
+        output.append(item)
+    return output
+
+
+def jsonlines_to_objectlist(input):
+    return [bson.json_util.loads(line) for line in input.splitlines()]
+
+
+def objectlist_to_jsonlines(input):
+    return "".join([bson.json_util.dumps(row) + "\n" for row in input])
+
+
+def objectlist_bson_to_objectlist(input):
+    return bson.decode_all(input, collections.OrderedDict)
+
+
+def objectlist_to_objectlist_bson(input):
+    return "".join([bson.BSON.encode(row) for row in input])
+
+
+def rows_to_column_names(input):
+    return input["fields"]
+
+
+def rows_to_column_names_continuous(input):
+    output = []
+    for column in input["fields"]:
+        if isinstance(input["rows"][0][column], (int, float)):
+            output.append(column)
+    return output
+
+
+def rows_to_column_names_discrete(input):
+    output = []
+    for column in input["fields"]:
+        if isinstance(input["rows"][0][column], (str, unicode)):
+            output.append(column)
+    return output
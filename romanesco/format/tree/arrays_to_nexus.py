@@ -0,0 +1,3 @@
+from romanesco.format.treearrays import arrays_to_nexus
+
+output = arrays_to_nexus(input)
@@ -0,0 +1,3 @@
+from romanesco.format.apetrees import arrays_to_r_apetree
+
+output = arrays_to_r_apetree(input)
@@ -0,0 +1,3 @@
+from romanesco.format.treearrays import arrays_to_vtktree
+
+output = arrays_to_vtktree(input)
@@ -1,2 +1,3 @@
-import bson.json_util
-output = bson.json_util.loads(input)
+from romanesco.format.trees import nested_json_to_nested
+
+output = nested_json_to_nested(input)
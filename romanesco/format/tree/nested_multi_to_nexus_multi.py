@@ -0,0 +1,3 @@
+from romanesco.format.newick import nested_multi_to_nexus_multi
+
+output = nested_multi_to_nexus_multi(input)
@@ -0,0 +1,3 @@
+from romanesco.format.treearrays import nested_to_arrays
+
+output = nested_to_arrays(input)
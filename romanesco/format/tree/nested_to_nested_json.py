@@ -1,2 +1,3 @@
-import bson.json_util
-output = bson.json_util.dumps(input)
+from romanesco.format.trees import nested_to_nested_json
+
+output = nested_to_nested_json(input)
@@ -0,0 +1,3 @@
+from romanesco.format.newick import nested_to_newick
+
+output = nested_to_newick(input)
@@ -0,0 +1,3 @@
+from romanesco.format.newick import nested_to_nexus
+
+output = nested_to_nexus(input)
@@ -0,0 +1,3 @@
+from romanesco.format.treeindex import nested_to_treeindex
+
+output = nested_to_treeindex(input)
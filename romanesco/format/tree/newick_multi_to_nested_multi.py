@@ -0,0 +1,3 @@
+from romanesco.format.newick import newick_multi_to_nested_multi
+
+output = newick_multi_to_nested_multi(input)
@@ -0,0 +1,3 @@
+from romanesco.format.treearrays import newick_to_arrays
+
+output = newick_to_arrays(input)
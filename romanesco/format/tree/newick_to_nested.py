@@ -0,0 +1,3 @@
+from romanesco.format.newick import newick_to_nested
+
+output = newick_to_nested(input)
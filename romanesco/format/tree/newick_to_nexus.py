@@ -0,0 +1,3 @@
+from romanesco.format.newick import newick_to_nexus
+
+output = newick_to_nexus(input)
@@ -0,0 +1,3 @@
+from romanesco.format.newick import nexus_multi_to_nested_multi
+
+output = nexus_multi_to_nested_multi(input)
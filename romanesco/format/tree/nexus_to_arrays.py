@@ -0,0 +1,3 @@
+from romanesco.format.treearrays import nexus_to_arrays
+
+output = nexus_to_arrays(input)
@@ -0,0 +1,3 @@
+from romanesco.format.newick import nexus_to_nested
+
+output = nexus_to_nested(input)
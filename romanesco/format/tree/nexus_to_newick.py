@@ -0,0 +1,3 @@
+from romanesco.format.newick import nexus_to_newick
+
+output = nexus_to_newick(input)
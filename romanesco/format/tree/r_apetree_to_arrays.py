@@ -0,0 +1,3 @@
+from romanesco.format.apetrees import r_apetree_to_arrays
+
+output = r_apetree_to_arrays(input)
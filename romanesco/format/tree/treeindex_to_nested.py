@@ -0,0 +1,3 @@
+from romanesco.format.treeindex import treeindex_to_nested
+
+output = treeindex_to_nested(input)
@@ -0,0 +1,3 @@
+from romanesco.format.treeindex import treeindex_to_treestore
+
+output = treeindex_to_treestore(input)
@@ -0,0 +1,3 @@
+from romanesco.format.treeindex import treestore_to_treeindex
+
+output = treestore_to_treeindex(input)
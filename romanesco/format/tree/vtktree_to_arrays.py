@@ -0,0 +1,3 @@
+from romanesco.format.treearrays import vtktree_to_arrays
+
+output = vtktree_to_arrays(input)
@@ -0,0 +1,275 @@
+"""
+Native implementations of the ``"tree"`` type converters for the
+array-backed ``"arrays"`` format. A tree of ``n`` nodes is stored as flat
+NumPy arrays indexed by node, with every parent before its children and the
+root at index 0:
+
+``"parent"``: ``int64`` index of the parent of each node, -1 for the root.
+
+``"edge_length"``: ``float64`` length of the edge to each node's parent, NaN
+for the root and for edges without a length.
+
+``"label"``: Object array of node names.
+
+``"node_data"``: Other node attributes as a ``"columns"`` table with one row
+per node.
+
+``"edge_data"``: Other edge attributes as a ``"columns"`` table with one row
+per edge, row ``i - 1`` holding the edge from node ``i`` to its parent.
+
+Siblings appear in the order of their indices. In the other tree formats the
+label is the ``"node name"`` node attribute and the edge length is the
+``"weight"`` edge attribute.
+"""
+
+import itertools
+import numpy
+
+from . import columns, newick
+
+LABEL_FIELD = 'node name'
+LENGTH_FIELD = 'weight'
+DEPTH_FIELD = 'node weight'
+
+
+def is_arrays(input):
+    """
+    Check the structure of an arrays tree. This only looks at each array
+    once, not at the values.
+    """
+    if not isinstance(input, dict):
+        return False
+    try:
+        parent = input['parent']
+        arrays = (parent, input['edge_length'], input['label'])
+        node_data = input['node_data']
+        edge_data = input['edge_data']
+    except KeyError:
+        return False
+    if not all(isinstance(a, numpy.ndarray) for a in arrays):
+        return False
+    count = len(parent)
+    return (count > 0 and parent[0] == -1 and
+            all(len(a) == count for a in arrays) and
+            columns.is_columns(node_data) and
+            columns.is_columns(edge_data) and
+            (not node_data['fields'] or
+             columns.num_rows(node_data) == count) and
+            (not edge_data['fields'] or
+             columns.num_rows(edge_data) == count - 1))
+
+
+def children_lists(input):
+    """
+    Return the list of child indices of each node.
+    """
+    parent = input['parent'].tolist()
+    children = [[] for p in parent]
+    for child, p in enumerate(parent[1:], 1):
+        children[p].append(child)
+    return children
+
+
+def _table(fields, values):
+    return {
+        'fields': fields,
+        'columns': {
+            field: columns.to_array(values[field]) for field in fields
+        }
+    }
+
+
+def _value_rows(table, count):
+    fields = table['fields']
+    if not fields:
+        return [{} for i in xrange(count)]
+    return [dict(itertools.izip(fields, values)) for values in
+            itertools.izip(*[table['columns'][field].tolist()
+                             for field in fields])]
+
+
+def from_lists(parent, labels, lengths, node_fields, node_values,
+               edge_fields, edge_values):
+    """
+    Build an arrays tree from lists of parent indices, labels and edge
+    lengths (None where missing), and dicts mapping the node and edge fields
+    to lists of their values.
+    """
+    label = numpy.empty(len(labels), dtype=object)
+    label[:] = labels
+    return {
+        'parent': numpy.array(parent, dtype=numpy.int64),
+        'edge_length': numpy.array(lengths, dtype=numpy.float64),
+        'label': label,
+        'node_data': _table(node_fields, node_values),
+        'edge_data': _table(edge_fields, edge_values)
+    }
+
+
+def _has_lengths(input):
+    return bool(len(input['parent']) > 1 and
+                not numpy.isnan(input['edge_length'][1:]).all())
+
+
+def nested_to_arrays(input):
+    node_fields = [f for f in input['node_fields'] if f != LABEL_FIELD]
+    edge_fields = [f for f in input['edge_fields'] if f != LENGTH_FIELD]
+
+    parent = []
+    nodes = []
+    stack = [(-1, input)]
+    while stack:
+        p, node = stack.pop()
+        index = len(nodes)
+        parent.append(p)
+        nodes.append(node)
+        children = node.get('children')
+        if children:
+            stack.extend((index, child) for child in reversed(children))
+
+    node_rows = [node.get('node_data', {}) for node in nodes]
+    edge_rows = [node.get('edge_data') or {} for node in nodes[1:]]
+    return from_lists(
+        parent, [row.get(LABEL_FIELD, '') for row in node_rows],
+        [None] + [row.get(LENGTH_FIELD) for row in edge_rows],
+        node_fields,
+        {f: [row.get(f) for row in node_rows] for f in node_fields},
+        edge_fields,
+        {f: [row.get(f) for row in edge_rows] for f in edge_fields})
+
+
+def arrays_to_nested(input):
+    parent = input['parent'].tolist()
+    labels = input['label'].tolist()
+    lengths = input['edge_length'].tolist()
+    has_lengths = _has_lengths(input)
+    node_rows = _value_rows(input['node_data'], len(parent))
+    edge_rows = _value_rows(input['edge_data'], len(parent) - 1)
+
+    nodes = []
+    for i, label in enumerate(labels):
+        node_data = {LABEL_FIELD: label}
+        node_data.update(node_rows[i])
+        if i == 0:
+            node = {
+                'node_fields': [LABEL_FIELD] + input['node_data']['fields'],
+                'edge_fields': ([LENGTH_FIELD] if has_lengths else []) +
+                input['edge_data']['fields'],
+                'node_data': node_data
+            }
+        else:
+            edge_data = {LENGTH_FIELD: lengths[i]} if has_lengths else {}
+            edge_data.update(edge_rows[i - 1])
+            node = {'edge_data': edge_data, 'node_data': node_data}
+            siblings = nodes[parent[i]].get('children')
+            if siblings is None:
+                siblings = nodes[parent[i]]['children'] = []
+            siblings.append(node)
+        nodes.append(node)
+    return nodes[0]
+
+
+def vtktree_to_arrays(input):
+    import vtk
+    from . import vtkarrays
+
+    node_fields, node_columns = vtkarrays.attributes_to_columns(
+        input.GetVertexData())
+    edge_fields, edge_columns = vtkarrays.attributes_to_columns(
+        input.GetEdgeData())
+
+    # Number the vertices in pre-order, keeping the edge to each one
+    order = []
+    parent = []
+    edge_ids = []
+    edges = vtk.vtkOutEdgeIterator()
+    stack = [(-1, -1, input.GetRoot())]
+    while stack:
+        p, edge_id, vertex = stack.pop()
+        index = len(order)
+        order.append(vertex)
+        parent.append(p)
+        edge_ids.append(edge_id)
+        input.GetOutEdges(vertex, edges)
+        children = []
+        while edges.HasNext():
+            edge = edges.NextGraphEdge()
+            children.append((index, edge.GetId(), edge.GetTarget()))
+        stack.extend(reversed(children))
+    edge_ids = edge_ids[1:]
+
+    labels = node_columns.get(LABEL_FIELD)
+    lengths = edge_columns.get(LENGTH_FIELD)
+    node_fields = [f for f in node_fields if f != LABEL_FIELD]
+    edge_fields = [f for f in edge_fields if f != LENGTH_FIELD]
+    return from_lists(
+        parent,
+        [labels[v] for v in order] if labels is not None else
+        [''] * len(order),
+        [None] + ([lengths[e] for e in edge_ids] if lengths is not None else
+                  [None] * len(edge_ids)),
+        node_fields,
+        {f: [node_columns[f][v] for v in order] for f in node_fields},
+        edge_fields,
+        {f: [edge_columns[f][e] for e in edge_ids] for f in edge_fields})
+
+
+def arrays_to_vtktree(input):
+    import vtk
+    from vtk.util import numpy_support
+    from . import vtkarrays
+
+    builder = vtk.vtkMutableDirectedGraph()
+    parent = input['parent'].tolist()
+    for i in xrange(len(parent)):
+        builder.AddVertex()
+    for child, p in enumerate(parent[1:], 1):
+        builder.AddGraphEdge(p, child)
+
+    vertex_data = builder.GetVertexData()
+    vertex_data.AddArray(vtkarrays.list_to_array(
+        LABEL_FIELD, input['label'].tolist()))
+    node_table = columns.columns_to_vtktable(input['node_data'])
+    for c in xrange(node_table.GetNumberOfColumns()):
+        vertex_data.AddArray(node_table.GetColumn(c))
+
+    edge_data = builder.GetEdgeData()
+    if _has_lengths(input):
+        lengths = numpy_support.numpy_to_vtk(
+            numpy.ascontiguousarray(input['edge_length'][1:]), deep=True,
+            array_type=vtk.VTK_DOUBLE)
+        lengths.SetName(LENGTH_FIELD)
+        edge_data.AddArray(lengths)
+    edge_table = columns.columns_to_vtktable(input['edge_data'])
+    for c in xrange(edge_table.GetNumberOfColumns()):
+        edge_data.AddArray(edge_table.GetColumn(c))
+
+    output = vtk.vtkTree()
+    output.ShallowCopy(builder)
+    return output
+
+
+def _from_parsed(parent, labels, lengths):
+    edges, depths = newick.weights(parent, lengths)
+    if edges is None:
+        return from_lists(parent, labels, [None] * len(parent), [], {}, [], {})
+    return from_lists(parent, labels, edges, [DEPTH_FIELD],
+                      {DEPTH_FIELD: depths}, [], {})
+
+
+def newick_to_arrays(input):
+    return _from_parsed(*newick.parse_newick(input))
+
+
+def nexus_to_arrays(input):
+    return _from_parsed(*newick.parse_nexus(input))
+
+
+def arrays_to_newick(input):
+    return newick.write_newick(children_lists(input), input['label'].tolist(),
+                               input['edge_length'].tolist())
+
+
+def arrays_to_nexus(input):
+    return newick.write_nexus(children_lists(input), input['label'].tolist(),
+                              input['edge_length'].tolist())
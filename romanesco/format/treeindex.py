@@ -0,0 +1,411 @@
+"""
+An index of a ``"nested"`` or ``"treestore"`` tree for queries on parts of
+large trees. Nodes are numbered by their position in depth-first pre-order,
+so the subtree of the node at position ``i`` is the range of positions
+``[i, end[i])``, and each node's id (the ``"_id"`` of a tree store document,
+or the position of a nested node) maps to its position.
+
+Indexes of tree store data are kept in a small cache keyed by the hash of
+the data. Indexes of nested trees are found by the identity of the tree for
+as long as the index is in use elsewhere, without the cache keeping either
+alive. A nested tree that is modified in place after it has been indexed is
+still given its old index.
+The Euler tour used for lowest common ancestor queries is only built by the
+first such query.
+"""
+
+import bson
+import hashlib
+import numpy
+import weakref
+
+from romanesco import utils
+
+LABEL_FIELD = 'node name'
+LENGTH_FIELD = 'weight'
+DEPTH_FIELD = 'node weight'
+
+# Euler tour entries per block of the range minimum table
+_BLOCK = 32
+
+# Indexes of recently used tree store data, by hash
+_indexes = utils.LruCache(maxSize=16)
+
+# Indexes of nested trees in use, by the identity of the tree
+_nested = weakref.WeakValueDictionary()
+
+
+class TreeIndex(object):
+    """
+    The index of a tree in the ``"nested"`` or ``"treestore"`` format, given
+    by ``format``. ``nodes`` holds the nested nodes or the decoded tree store
+    documents in pre-order, and the NumPy arrays ``parent``, ``end``,
+    ``depth`` (edges from the root) and ``distance`` (sum of the edge lengths
+    from the root) are indexed by position.
+    """
+    def __init__(self, format, nodes, parent, labels, lengths, ids=None,
+                 handle=None, data=None):
+        """
+        :param format: ``"nested"`` or ``"treestore"``.
+        :param nodes: The nodes in pre-order, with the root first.
+        :param parent: The position of the parent of each node, -1 for the
+            root.
+        :param labels: The name of each node.
+        :param lengths: The length of the edge to each node's parent, None
+            where missing.
+        :param ids: The tree store id of each node. Nested nodes are
+            identified by position.
+        :param handle: The tree store handle document.
+        :param data: The tree store data the index was built from, if any.
+        """
+        count = len(parent)
+        self.format = format
+        self.nodes = nodes
+        self.labels = labels
+        self.lengths = lengths
+        self.ids = ids if ids is not None else range(count)
+        self.handle = handle
+        self.data = data
+        self.offsets = {node_id: i for i, node_id in enumerate(self.ids)}
+        self.has_lengths = any(length is not None for length in lengths[1:])
+
+        parent = list(parent)
+        size = [1] * count
+        for i in xrange(count - 1, 0, -1):
+            size[parent[i]] += size[i]
+        depth = [0] * count
+        distance = [0.0] * count
+        for i in xrange(1, count):
+            depth[i] = depth[parent[i]] + 1
+            distance[i] = distance[parent[i]] + (lengths[i] or 0.0)
+
+        self.parent = numpy.array(parent, dtype=numpy.int64)
+        self.end = numpy.arange(count, dtype=numpy.int64) + size
+        self.depth = numpy.array(depth, dtype=numpy.int64)
+        self.distance = numpy.array(distance, dtype=numpy.float64)
+        self._by_label = None
+        self._euler = None
+
+    def __len__(self):
+        return len(self.nodes)
+
+    @classmethod
+    def from_nested(cls, tree):
+        nodes = []
+        parent = []
+        stack = [(-1, tree)]
+        while stack:
+            p, node = stack.pop()
+            index = len(nodes)
+            nodes.append(node)
+            parent.append(p)
+            children = node.get('children')
+            if children:
+                stack.extend((index, child) for child in reversed(children))
+        lengths = [(node.get('edge_data') or {}).get(LENGTH_FIELD)
+                   for node in nodes]
+        lengths[0] = None
+        return cls('nested', nodes, parent,
+                   [node.get('node_data', {}).get(LABEL_FIELD, '')
+                    for node in nodes], lengths)
+
+    @classmethod
+    def from_treestore(cls, data):
+        docs = bson.decode_all(data)
+        if not docs or not docs[-1].get('clades'):
+            raise Exception('Tree store handle not found')
+        handle = docs.pop()
+        by_id = {doc['_id']: doc for doc in docs}
+
+        nodes = []
+        parent = []
+        stack = [(-1, handle['clades'][0])]
+        while stack:
+            p, node_id = stack.pop()
+            index = len(nodes)
+            try:
+                nodes.append(by_id[node_id])
+            except KeyError:
+                raise Exception('Tree store node %r not found' % node_id)
+            parent.append(p)
+            stack.extend((index, child) for child in
+                         reversed(nodes[-1].get('clades', ())))
+        lengths = [node.get('branch_length') for node in nodes]
+        lengths[0] = None
+        return cls('treestore', nodes, parent,
+                   [node.get('name', '') for node in nodes], lengths,
+                   [node['_id'] for node in nodes], handle, data)
+
+    def offset(self, node):
+        """
+        Return the position of a node given its id or, failing that, its
+        name. Repeated names resolve to their first node in pre-order.
+        """
+        try:
+            return self.offsets[node]
+        except (KeyError, TypeError):
+            pass
+        if self._by_label is None:
+            by_label = {}
+            for i, label in enumerate(self.labels):
+                by_label.setdefault(label, i)
+            self._by_label = by_label
+        try:
+            return self._by_label[node]
+        except (KeyError, TypeError):
+            raise Exception('Node %r not found in tree' % (node,))
+
+    def is_ancestor(self, ancestor, node):
+        """
+        Whether the node at position ``ancestor`` is the node at position
+        ``node`` or one of its ancestors.
+        """
+        return ancestor <= node < self.end[ancestor]
+
+    def _build_euler(self):
+        # The Euler tour, the first tour entry of each node, and a sparse
+        # table of the positions of the shallowest entry in runs of blocks
+        parent = self.parent.tolist()
+        tour = [0]
+        first = [0] * len(parent)
+        stack = [0]
+        for i in xrange(1, len(parent)):
+            while stack[-1] != parent[i]:
+                stack.pop()
+                tour.append(stack[-1])
+            first[i] = len(tour)
+            tour.append(i)
+            stack.append(i)
+        while len(stack) > 1:
+            stack.pop()
+            tour.append(stack[-1])
+
+        tour = numpy.array(tour, dtype=numpy.int64)
+        depth = self.depth[tour]
+        blocks = -(-len(tour) // _BLOCK)
+        padded = numpy.empty(blocks * _BLOCK, dtype=numpy.int64)
+        padded.fill(numpy.iinfo(numpy.int64).max)
+        padded[:len(tour)] = depth
+        table = [padded.reshape(blocks, _BLOCK).argmin(axis=1) +
+                 numpy.arange(blocks) * _BLOCK]
+        while 2 ** len(table) <= blocks:
+            previous = table[-1]
+            half = 2 ** (len(table) - 1)
+            left = previous[:-half]
+            right = previous[half:]
+            table.append(numpy.where(depth[right] < depth[left], right, left))
+        self._euler = tour, numpy.array(first, dtype=numpy.int64), depth, table
+
+    def _shallowest(self, start, stop):
+        # The tour entry of least depth in [start, stop]
+        tour, first, depth, table = self._euler
+        first_block = start // _BLOCK
+        last_block = stop // _BLOCK
+        if first_block == last_block:
+            return start + int(depth[start:stop + 1].argmin())
+        split = last_block * _BLOCK
+        candidates = [
+            start + int(depth[start:(first_block + 1) * _BLOCK].argmin()),
+            split + int(depth[split:stop + 1].argmin())]
+        blocks = last_block - first_block - 1
+        if blocks:
+            level = blocks.bit_length() - 1
+            candidates.append(int(table[level][first_block + 1]))
+            candidates.append(int(table[level][last_block - 2 ** level]))
+        return min(candidates, key=lambda entry: depth[entry])
+
+    def lca_position(self, a, b):
+        """
+        Return the position of the lowest common ancestor of the nodes at
+        positions ``a`` and ``b``, in constant time once the Euler tour is
+        built.
+        """
+        if a > b:
+            a, b = b, a
+        if self.is_ancestor(a, b):
+            return a
+        if self._euler is None:
+            self._build_euler()
+        tour, first = self._euler[:2]
+        return int(tour[self._shallowest(first[a], first[b])])
+
+    def lca(self, *nodes):
+        """
+        Return the id of the lowest common ancestor of nodes given by id or
+        name.
+        """
+        if not nodes:
+            raise Exception('No nodes given')
+        positions = [self.offset(node) for node in nodes]
+        # The ancestor of the first and last nodes in pre-order is that of
+        # all the nodes
+        return self.ids[self.lca_position(min(positions), max(positions))]
+
+    def subtree(self, node):
+        """
+        Return the index of the subtree below a node given by id or name, in
+        the format of this index. As for :py:meth:`prune`, nested nodes are
+        copied and their ``"node weight"`` is the distance from the new root.
+        """
+        start = self.offset(node)
+        stop = int(self.end[start])
+        parent = (self.parent[start:stop] - start).tolist()
+        parent[0] = -1
+        lengths = [None] + self.lengths[start + 1:stop]
+        if self.format == 'nested':
+            nodes = self._nested_nodes(range(start, stop), parent, lengths)
+            return TreeIndex('nested', nodes, parent,
+                             self.labels[start:stop], lengths)
+        top = dict(self.nodes[start])
+        top.pop('branch_length', None)
+        handle = dict(self.handle, clades=[self.ids[start]])
+        return TreeIndex('treestore', [top] + self.nodes[start + 1:stop],
+                         parent, self.labels[start:stop], lengths,
+                         self.ids[start:stop], handle)
+
+    def prune(self, taxa):
+        """
+        Return the index of the tree spanning the nodes given by id or name in
+        ``taxa``, rooted at their lowest common ancestor. Nodes with a single
+        child are left out, and the lengths of the edges they join are added.
+        """
+        positions = sorted(set(self.offset(taxon) for taxon in taxa))
+        if not positions:
+            raise Exception('No taxa to prune the tree to')
+        # The ancestors of consecutive taxa in pre-order complete the tree
+        keep = set(positions)
+        for a, b in zip(positions, positions[1:]):
+            keep.add(self.lca_position(a, b))
+        keep = sorted(keep)
+
+        parent = []
+        lengths = []
+        stack = []
+        for position in keep:
+            while stack and not self.is_ancestor(keep[stack[-1]], position):
+                stack.pop()
+            if stack:
+                parent.append(stack[-1])
+                lengths.append(
+                    float(self.distance[position] -
+                          self.distance[keep[stack[-1]]])
+                    if self.has_lengths else None)
+            else:
+                parent.append(-1)
+                lengths.append(None)
+            stack.append(len(parent) - 1)
+
+        if self.format == 'nested':
+            nodes = self._nested_nodes(keep, parent, lengths)
+            return TreeIndex('nested', nodes, parent,
+                             [self.labels[p] for p in keep], lengths)
+        nodes = self._treestore_nodes(keep, parent, lengths)
+        handle = dict(self.handle, clades=[self.ids[keep[0]]])
+        return TreeIndex('treestore', nodes, parent,
+                         [self.labels[p] for p in keep], lengths,
+                         [self.ids[p] for p in keep], handle)
+
+    def _nested_nodes(self, keep, parent, lengths):
+        nodes = []
+        root_distance = self.distance[keep[0]]
+        for i, position in enumerate(keep):
+            source = self.nodes[position]
+            node = {'node_data': dict(source.get('node_data', {}))}
+            if DEPTH_FIELD in node['node_data']:
+                node['node_data'][DEPTH_FIELD] = float(
+                    self.distance[position] - root_distance)
+            if i == 0:
+                node['node_fields'] = self.nodes[0].get('node_fields', [])
+                node['edge_fields'] = self.nodes[0].get('edge_fields', [])
+            else:
+                node['edge_data'] = dict(source.get('edge_data') or {})
+                if lengths[i] is not None:
+                    node['edge_data'][LENGTH_FIELD] = lengths[i]
+                nodes[parent[i]].setdefault('children', []).append(node)
+            nodes.append(node)
+        return nodes
+
+    def _treestore_nodes(self, keep, parent, lengths):
+        nodes = []
+        for i, position in enumerate(keep):
+            node = dict(self.nodes[position])
+            node.pop('clades', None)
+            node.pop('branch_length', None)
+            if lengths[i] is not None:
+                node['branch_length'] = lengths[i]
+            if i:
+                nodes[parent[i]].setdefault('clades', []).append(node['_id'])
+            nodes.append(node)
+        return nodes
+
+    def to_nested(self):
+        """
+        Return the tree in the ``"nested"`` format.
+        """
+        if self.format == 'nested':
+            return self.nodes[0]
+        from . import newick
+        return newick.to_nested(self.parent.tolist(), self.labels,
+                                self.lengths)
+
+    def to_treestore(self):
+        """
+        Return the tree in the ``"treestore"`` format.
+        """
+        if self.data is not None:
+            return self.data
+        if self.format == 'treestore':
+            docs = self.nodes + [self.handle]
+        else:
+            docs = [{'_id': i} for i in xrange(len(self.nodes))]
+            for i, p in enumerate(self.parent.tolist()):
+                if self.labels[i]:
+                    docs[i]['name'] = self.labels[i]
+                if self.lengths[i] is not None:
+                    docs[i]['branch_length'] = self.lengths[i]
+                if i:
+                    docs[p].setdefault('clades', []).append(i)
+            docs.append({'rooted': True, 'clades': [0], '_id': len(docs)})
+        self.data = ''.join(bson.BSON.encode(doc) for doc in docs)
+        return self.data
+
+
+def index(format, data):
+    """
+    Return the cached index of a tree in the ``"nested"`` or ``"treestore"``
+    format, building it if needed.
+    """
+    if format == 'treestore':
+        key = hashlib.sha1(data).hexdigest()
+        result = _indexes.get(key)
+        if result is None:
+            result = TreeIndex.from_treestore(data)
+            _indexes.put(key, result)
+        return result
+
+    result = _nested.get(id(data))
+    # A live index holds its tree, so a match on its root is the same tree
+    if result is None or result.nodes[0] is not data:
+        result = TreeIndex.from_nested(data)
+        _nested[id(data)] = result
+    return result
+
+
+def is_treeindex(input):
+    return isinstance(input, TreeIndex)
+
+
+def nested_to_treeindex(input):
+    return index('nested', input)
+
+
+def treestore_to_treeindex(input):
+    return index('treestore', input)
+
+
+def treeindex_to_nested(input):
+    return input.to_nested()
+
+
+def treeindex_to_treestore(input):
+    return input.to_treestore()
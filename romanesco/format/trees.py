@@ -0,0 +1,187 @@
+"""
+Native implementations of the ``"tree"`` type converters. Trees are walked
+with explicit stacks rather than recursion so that very deep trees, such as
+ladderized phylogenies with tens of thousands of tips, do not hit Python's
+recursion limit.
+"""
+
+import bson.json_util
+import json
+import re
+from json import decoder, scanner
+
+
+def walk(root):
+    """
+    Iterate over the nodes of a nested tree in depth-first pre-order,
+    yielding ``(parent, node)`` pairs. The parent of the root is None.
+    """
+    stack = [(None, root)]
+    while stack:
+        parent, node = stack.pop()
+        yield parent, node
+        children = node.get('children')
+        if children:
+            stack.extend((node, child) for child in reversed(children))
+
+
+# Encodes the values within nodes, using bson.json_util for BSON types
+_encode = json.JSONEncoder(default=bson.json_util.default).encode
+
+
+def _node_pieces(node):
+    # Pieces of the JSON encoding of a node, with internal child nodes in
+    # place of their own encodings
+    yield '{'
+    for i, (key, value) in enumerate(node.iteritems()):
+        if i:
+            yield ', '
+        yield _encode(key) + ': '
+        if key == 'children' and isinstance(value, (list, tuple)):
+            yield '['
+            for j, child in enumerate(value):
+                if j:
+                    yield ', '
+                if isinstance(child, dict) and 'children' in child:
+                    yield child
+                else:
+                    yield _encode(child)
+            yield ']'
+        else:
+            yield _encode(value)
+    yield '}'
+
+
+def nested_to_nested_json(input):
+    """
+    Encode a nested tree the way ``bson.json_util.dumps`` does, one node at
+    a time.
+    """
+    pieces = []
+    stack = [_node_pieces(input)]
+    while stack:
+        for piece in stack[-1]:
+            if isinstance(piece, dict):
+                stack.append(_node_pieces(piece))
+                break
+            pieces.append(piece)
+        else:
+            stack.pop()
+    return ''.join(pieces)
+
+
+def nested_json_to_nested(input):
+    try:
+        return bson.json_util.loads(input)
+    except RuntimeError:
+        # Nested too deeply for the json module, which recurses
+        return loads(input, bson.json_util.object_hook)
+
+
+_WHITESPACE = re.compile(r'[ \t\n\r]*')
+
+_CONSTANTS = [
+    ('null', None), ('true', True), ('false', False),
+    ('NaN', float('nan')), ('Infinity', float('inf')),
+    ('-Infinity', float('-inf'))
+]
+
+
+def _error(message, index):
+    raise ValueError('%s: char %d' % (message, index))
+
+
+def loads(s, object_hook=None):
+    """
+    Decode a JSON document like ``json.loads``, keeping the objects and
+    arrays being built on an explicit stack so that the depth of the
+    document is not limited by the recursion limit.
+    """
+    ws = _WHITESPACE.match
+    number = scanner.NUMBER_RE.match
+    scanstring = decoder.scanstring
+    # Each entry is [container, key], with key None for arrays
+    stack = []
+    index = ws(s, 0).end()
+    while True:
+        char = s[index:index + 1]
+        if char == '{':
+            index = ws(s, index + 1).end()
+            if s[index:index + 1] == '}':
+                value = object_hook({}) if object_hook else {}
+                index += 1
+            else:
+                if s[index:index + 1] != '"':
+                    _error('Expecting property name', index)
+                key, index = scanstring(s, index + 1)
+                index = ws(s, index).end()
+                if s[index:index + 1] != ':':
+                    _error('Expecting : delimiter', index)
+                stack.append([{}, key])
+                index = ws(s, index + 1).end()
+                continue
+        elif char == '[':
+            index = ws(s, index + 1).end()
+            if s[index:index + 1] == ']':
+                value = []
+                index += 1
+            else:
+                stack.append([[], None])
+                continue
+        elif char == '"':
+            value, index = scanstring(s, index + 1)
+        else:
+            match = number(s, index)
+            if match:
+                integer, frac, exp = match.groups()
+                if frac or exp:
+                    value = float(integer + (frac or '') + (exp or ''))
+                else:
+                    value = int(integer)
+                index = match.end()
+            else:
+                for name, value in _CONSTANTS:
+                    if s.startswith(name, index):
+                        index += len(name)
+                        break
+                else:
+                    _error('No JSON object could be decoded', index)
+
+        # Add the value to the enclosing containers, closing those that end
+        while True:
+            index = ws(s, index).end()
+            if not stack:
+                if index != len(s):
+                    _error('Extra data', index)
+                return value
+            container, key = stack[-1]
+            char = s[index:index + 1]
+            if key is None:
+                container.append(value)
+                if char == ']':
+                    stack.pop()
+                    value = container
+                    index += 1
+                    continue
+                if char != ',':
+                    _error('Expecting , delimiter', index)
+                index = ws(s, index + 1).end()
+                break
+            container[key] = value
+            if char == '}':
+                stack.pop()
+                value = object_hook(container) if object_hook else container
+                index += 1
+                continue
+            if char != ',':
+                _error('Expecting , delimiter', index)
+            index = ws(s, index + 1).end()
+            if s[index:index + 1] != '"':
+                _error('Expecting property name', index)
+            key, index = scanstring(s, index + 1)
+            index = ws(s, index).end()
+            if s[index:index + 1] != ':':
+                _error('Expecting : delimiter', index)
+            stack[-1][1] = key
+            index = ws(s, index + 1).end()
+            break
@@ -0,0 +1,246 @@
+"""
+Whole-column transfers between Python values and the VTK arrays held by
+``vtkDataSetAttributes`` (the row data of a ``vtkTable`` or the vertex and
+edge data of a ``vtkTree``). Each column is read or written as a single
+array, using NumPy buffers for numeric arrays when NumPy is available, so
+converters never look arrays up per value. The ``"vtktable"`` and
+``"vtktree"`` converters are built on these transfers.
+"""
+
+import itertools
+import vtk
+
+try:
+    from vtk.util import numpy_support
+    import numpy
+except ImportError:  # NumPy is not installed
+    numpy_support = None
+
+# Array types whose values vtkrow_to_dict always returned as numbers.
+# Values of other types are read through vtkVariant to keep their
+# conversions unchanged.
+_NUMERIC_TYPES = (vtk.VTK_INT, vtk.VTK_LONG, vtk.VTK_FLOAT, vtk.VTK_DOUBLE)
+
+
+def variant_value(variant):
+    """
+    Convert a ``vtkVariant`` to an int, float or string.
+    """
+    if variant.IsInt():
+        return variant.ToInt()
+    elif variant.IsLong():
+        return variant.ToLong()
+    elif variant.IsDouble() or variant.IsFloat():
+        return variant.ToDouble()
+    return variant.ToString()
+
+
+def _group(values, components):
+    if components == 1:
+        return values
+    return [values[i:i + components]
+            for i in xrange(0, len(values), components)]
+
+
+def array_to_list(array):
+    """
+    Read a VTK array into a list with one value per tuple. Values of
+    multi-component arrays are lists.
+    """
+    data_type = array.GetDataType()
+    if data_type in _NUMERIC_TYPES and numpy_support is not None:
+        return numpy_support.vtk_to_numpy(array).tolist()
+
+    components = array.GetNumberOfComponents()
+    count = array.GetNumberOfTuples() * components
+    if data_type == vtk.VTK_STRING:
+        values = [array.GetValue(i) for i in xrange(count)]
+    else:
+        values = [variant_value(array.GetVariantValue(i))
+                  for i in xrange(count)]
+    return _group(values, components)
+
+
+def attributes_to_columns(attributes):
+    """
+    Read every array of a ``vtkDataSetAttributes`` and return the list of
+    array names and a dict mapping each name to its values.
+    """
+    fields = []
+    columns = {}
+    for i in xrange(attributes.GetNumberOfArrays()):
+        array = attributes.GetAbstractArray(i)
+        fields.append(array.GetName())
+        columns[array.GetName()] = array_to_list(array)
+    return fields, columns
+
+
+def columns_to_rows(fields, columns, count):
+    """
+    Transpose the columns read by :py:func:`attributes_to_columns` into a
+    list of ``count`` row dicts.
+    """
+    if not fields:
+        return [{} for i in xrange(count)]
+    return [dict(itertools.izip(fields, values)) for values in
+            itertools.izip(*[columns[field] for field in fields])]
+
+
+def attributes_to_rows(attributes):
+    """
+    Read a ``vtkDataSetAttributes`` into a list of dicts, one per tuple.
+    """
+    fields, columns = attributes_to_columns(attributes)
+    return columns_to_rows(fields, columns, attributes.GetNumberOfTuples())
+
+
+def list_to_array(name, values):
+    """
+    Build a VTK array from a list of values. The type is chosen from the
+    first value that is not None: numbers give a ``vtkDoubleArray``,
+    unicode strings a ``vtkUnicodeStringArray`` and anything else a
+    ``vtkStringArray``. Lists give multi-component arrays. Missing (None)
+    values are stored as NaN in numeric arrays and empty strings otherwise.
+    """
+    first = next((v for v in values if v is not None), None)
+    components = 1
+    if isinstance(first, list):
+        components = len(first)
+        first = first[0] if first else None
+        flat = []
+        for value in values:
+            if value is None:
+                value = [None] * components
+            elif len(value) != components:
+                raise Exception(
+                    'Inconsistent number of components in column ' + name)
+            flat.extend(value)
+        values = flat
+
+    if isinstance(first, (int, long, float)):
+        if numpy_support is not None:
+            data = numpy.array(values, dtype=numpy.float64)
+            array = numpy_support.numpy_to_vtk(
+                data.reshape(-1, components) if components > 1 else data,
+                deep=True, array_type=vtk.VTK_DOUBLE)
+            array.SetName(name)
+            return array
+        array = vtk.vtkDoubleArray()
+        values = [float('nan') if v is None else v for v in values]
+    elif isinstance(first, unicode):
+        array = vtk.vtkUnicodeStringArray()
+        values = [u'' if v is None else v if isinstance(v, unicode)
+                  else unicode(str(v), 'utf8') for v in values]
+    else:
+        array = vtk.vtkStringArray()
+        values = ['' if v is None else v if isinstance(v, str) else
+                  v.encode('utf8') if isinstance(v, unicode) else str(v)
+                  for v in values]
+
+    array.SetName(name)
+    array.SetNumberOfComponents(components)
+    array.SetNumberOfValues(len(values))
+    for i, value in enumerate(values):
+        array.SetValue(i, value)
+    return array
+
+
+def columns_to_attributes(fields, columns, attributes):
+    """
+    Add one array per field to a ``vtkDataSetAttributes``, built from the
+    lists of values in the ``columns`` dict.
+    """
+    for field in fields:
+        attributes.AddArray(list_to_array(field, columns[field]))
+
+
+def rows_to_attributes(fields, rows, attributes):
+    """
+    Add one array per field to a ``vtkDataSetAttributes``, built from a
+    list of row dicts. Fields missing from a row are stored as missing
+    values, while keys that are not fields raise an exception.
+    """
+    known = set(fields)
+    for row in rows:
+        if not known.issuperset(row):
+            raise Exception('Unexpected key: ' + str(
+                next(key for key in row if key not in known)))
+    columns_to_attributes(
+        fields, {field: [row.get(field) for row in rows] for field in fields},
+        attributes)
+
+
+def rows_to_vtktable(input):
+    output = vtk.vtkTable()
+    if len(input['rows']) > 0:
+        rows_to_attributes(input['fields'], input['rows'],
+                           output.GetRowData())
+    return output
+
+
+def vtktable_to_rows(input):
+    return {
+        'fields': [input.GetColumnName(c)
+                   for c in xrange(input.GetNumberOfColumns())],
+        'rows': attributes_to_rows(input.GetRowData())
+    }
+
+
+def nested_to_vtktree(input):
+    builder = vtk.vtkMutableDirectedGraph()
+    node_rows = []
+    edge_rows = []
+    # Vertices and edges are added in the pre-order of the nested tree
+    stack = [(None, input)]
+    while stack:
+        parent, node = stack.pop()
+        vertex = builder.AddVertex()
+        node_rows.append(node['node_data'])
+        if parent is not None:
+            builder.AddGraphEdge(parent, vertex)
+            edge_rows.append(node.get('edge_data'))
+        children = node.get('children')
+        if children:
+            stack.extend((vertex, child) for child in reversed(children))
+
+    rows_to_attributes(input['node_fields'], node_rows,
+                       builder.GetVertexData())
+    if edge_rows and edge_rows[0] is not None:
+        rows_to_attributes(input['edge_fields'],
+                           [row or {} for row in edge_rows],
+                           builder.GetEdgeData())
+    output = vtk.vtkTree()
+    output.ShallowCopy(builder)
+    return output
+
+
+def vtktree_to_nested(input):
+    node_fields, node_columns = attributes_to_columns(input.GetVertexData())
+    node_rows = columns_to_rows(node_fields, node_columns,
+                                input.GetNumberOfVertices())
+    edge_fields, edge_columns = attributes_to_columns(input.GetEdgeData())
+    edge_rows = columns_to_rows(edge_fields, edge_columns,
+                                input.GetNumberOfEdges())
+
+    vtkroot = input.GetRoot()
+    output = {
+        'node_fields': node_fields,
+        'edge_fields': edge_fields,
+        'node_data': node_rows[vtkroot]
+    }
+    edges = vtk.vtkOutEdgeIterator()
+    stack = [(vtkroot, output)]
+    while stack:
+        vtknode, node = stack.pop()
+        input.GetOutEdges(vtknode, edges)
+        children = []
+        while edges.HasNext():
+            edge = edges.NextGraphEdge()
+            vtkchild = edge.GetTarget()
+            child = {'edge_data': edge_rows[edge.GetId()],
+                     'node_data': node_rows[vtkchild]}
+            children.append(child)
+            stack.append((vtkchild, child))
+        if children:
+            node['children'] = children
+    return output
@@ -2,6 +2,9 @@ from __future__ import absolute_import
 
 from . import http, local, mongodb
 
+# Formats of input bindings that can be selected from as they are fetched
+_DELIMITED_FORMATS = ('csv', 'tsv')
+
 
 def _detectMode(spec):
     mode = spec.get('mode', 'auto')
@@ -23,6 +26,35 @@ def _detectMode(spec):
     return mode
 
 
+def selection(spec):
+    """
+    Return the selection to push down to the source of an input binding as a
+    tuple ``(query, fields, limit)``, each None if not given. These are read
+    from the ``"query"`` (or ``"filter"``), ``"fields"`` (or ``"columns"``)
+    and ``"limit"`` keys of the binding.
+    """
+    return (spec.get('query', spec.get('filter')),
+            spec.get('fields', spec.get('columns')),
+            spec.get('limit'))
+
+
+def _fetchSelected(mode, spec, **kwargs):
+    """
+    Fetch delimited text as a stream, keeping only the selected columns and
+    records while it is read, so the rest is never held in memory.
+    """
+    from romanesco.format import streams
+
+    taskInput = kwargs.get('task_input', {})
+    target = taskInput.get('target', 'memory')
+    kwargs['task_input'] = dict(taskInput, target='stream')
+    module = http if mode == 'http' else local
+    query, fields, limit = selection(spec)
+    chunks = streams.select_delimited(
+        module.fetch(spec, **kwargs), fields, query, limit)
+    return chunks if target == 'stream' else ''.join(chunks)
+
+
 def fetch(spec, **kwargs):
     """
     This function can be called on any valid input binding specification and is
@@ -33,9 +65,21 @@ def fetch(spec, **kwargs):
     :param input_spec: The specification of the input to fetch. This is a
         LOCATION_SPEC type in the Romanesco grammar.
     :type input_spec: dict
+
+    Input bindings in the ``"mongodb"`` mode, and ``"csv"`` or ``"tsv"``
+    bindings in the ``"http"`` and ``"local"`` modes, may also select part
+    of the data (see :py:func:`selection`). The selection is applied at the
+    source, by a MongoDB query and projection or while the text is parsed.
     """
     mode = _detectMode(spec)
 
+    if mode in ('http', 'local') and \
+            spec.get('format') in _DELIMITED_FORMATS and \
+            any(s is not None for s in selection(spec)) and \
+            kwargs.get('task_input', {}).get('target', 'memory') in (
+                'memory', 'stream'):
+        return _fetchSelected(mode, spec, **kwargs)
+
     if mode == 'http':
         return http.fetch(spec, **kwargs)
     elif mode == 'mongodb':
@@ -1,16 +1,22 @@
 import os
 import re
 import requests
+import romanesco
+import sys
+import threading
+import time
 
+from romanesco.utils import get_tmp_dir, sessionPool
 
-def _readFilenameFromResponse(request, url):
+
+def _readFilenameFromResponse(headers, url):
     """
-    This helper will derive a filename from the HTTP response, first attempting
-    to use the content disposition header, otherwise falling back to the last
-    token of the URL.
+    This helper will derive a filename from the HTTP response headers, first
+    attempting to use the content disposition header, otherwise falling back
+    to the last token of the URL.
     """
     match = re.search('filename="(.*)"',
-                      request.headers.get('Content-Disposition', ''))
+                      headers.get('Content-Disposition', ''))
 
     if match is None:
         return [t for t in url.split('/') if t][-1]
@@ -18,32 +24,135 @@ def _readFilenameFromResponse(request, url):
         return match.group(1)
 
 
-def fetch(spec, **kwargs):
+def _checkSize(size, maxSize):
+    if maxSize and size > maxSize:
+        raise Exception('Exceeded max download size of %d bytes.' % maxSize)
+
+
+def _fetchRange(url, headers, path, start, end):
     """
-    Downloads an input file via HTTP using requests.
+    Download bytes ``[start, end)`` of a URL into the same bytes of a file.
+    After a connection error, a server error or a response that ends early,
+    the download resumes from the last byte written, up to ``http_retries``
+    times with exponential backoff. All retries are counted here, so the
+    requests are made with a session that does not retry on its own.
     """
-    if 'url' not in spec:
-        raise Exception('No URL specified for HTTP input.')
-    taskInput = kwargs.get('task_input', {})
-    target = taskInput.get('target', 'memory')
-    url = spec['url']
-    method = spec.get('method', 'GET').upper()
-    request = requests.request(method, url, headers=spec.get('headers', {}),
-                               stream=True, allow_redirects=True)
+    session = sessionPool.session(url, retry=False)
+    retries = sessionPool.setting('http_retries')
+    backoff = sessionPool.setting('http_backoff')
+    failures = 0
+    with open(path, 'r+b') as out:
+        out.seek(start)
+        while start < end:
+            request = None
+            try:
+                request = session.get(url, stream=True, headers=dict(
+                    headers, Range='bytes=%d-%d' % (start, end - 1)))
+                if request.status_code >= 500:
+                    raise IOError('HTTP status %d' % request.status_code)
+                elif request.status_code != 206:
+                    raise Exception(
+                        'Range request for %s returned HTTP status %d.' % (
+                            url, request.status_code))
+                for buf in request.iter_content(65536):
+                    buf = buf[:end - start]
+                    out.write(buf)
+                    start += len(buf)
+                    if start == end:
+                        break
+                if start < end:
+                    raise IOError('Response ended at byte %d' % start)
+            except (requests.RequestException, IOError):
+                failures += 1
+                if failures > retries:
+                    raise
+                time.sleep(backoff * 2 ** (failures - 1))
+            finally:
+                if request is not None:
+                    request.close()
 
+
+def _fetchRanges(spec, taskInput, parallel, kwargs, cacheKey=None):
+    """
+    Download a file as ``parallel`` byte ranges at once into a preallocated
+    file, if a HEAD request shows that the server accepts byte ranges and
+    gives the length. Returns the path of the file, or None if the server
+    does not support ranged downloads. If ``cacheKey`` is given, the file is
+    also stored in the HTTP response cache under that key.
+    """
+    url = spec['url']
+    headers = spec.get('headers', {})
     try:
-        request.raise_for_status()
-    except:
-        print 'HTTP fetch failed (%s). Response: %s' % (url, request.text)
-        raise
+        probe = sessionPool.session(url).head(
+            url, headers=headers, allow_redirects=True)
+    except requests.RequestException:
+        return None
+    length = probe.headers.get('Content-Length')
+    if probe.status_code != 200 or length is None or \
+            probe.headers.get('Accept-Ranges', '').lower() != 'bytes':
+        return None
+    length = int(length)
+    _checkSize(length, spec.get('maxSize'))
+
+    if 'filename' in taskInput:
+        filename = taskInput['filename']
+    else:
+        filename = _readFilenameFromResponse(probe.headers, url)
+    path = os.path.join(get_tmp_dir(kwargs), filename)
+    with open(path, 'wb') as out:
+        out.truncate(length)
+
+    # Ranges are requested from the redirected URL
+    size = max(-(-length // parallel), 1)
+    errors = []
+
+    def download(start):
+        try:
+            _fetchRange(probe.url, headers, path, start,
+                        min(start + size, length))
+        except Exception:
+            errors.append(sys.exc_info())
+
+    threads = [threading.Thread(target=download, args=(start,))
+               for start in xrange(0, length, size)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise errors[0][0], errors[0][1], errors[0][2]
+
+    if cacheKey is not None:
+        meta = romanesco.http_cache.metadata(url, probe)
+        if meta is not None:
+            romanesco.http_cache.putFile(cacheKey, meta, path)
+    return path
+
+
+def _readFile(f):
+    with f:
+        while True:
+            buf = f.read(65536)
+            if not buf:
+                break
+            yield buf
+
+
+def _deliver(chunks, headers, spec, kwargs):
+    """
+    Return the chunks of a response body in the form asked for by the
+    ``target`` of the task input.
+    """
+    taskInput = kwargs.get('task_input', {})
+    target = taskInput.get('target', 'memory')
 
     if target == 'filepath':
-        tmpDir = kwargs['_tmp_dir']  # TODO create if not set?
+        tmpDir = get_tmp_dir(kwargs)
 
         if 'filename' in taskInput:
             filename = taskInput['filename']
         else:
-            filename = _readFilenameFromResponse(request, url)
+            filename = _readFilenameFromResponse(headers, spec['url'])
 
         path = os.path.join(tmpDir, filename)
 
@@ -51,21 +160,93 @@ def fetch(spec, **kwargs):
         maxSize = spec.get('maxSize')
 
         with open(path, 'wb') as out:
-            for buf in request.iter_content(65536):
+            for buf in chunks:
                 length = len(buf)
-                if maxSize and length + total > maxSize:
-                    raise Exception(
-                        'Exceeded max download size of %d bytes.' % maxSize)
+                _checkSize(length + total, maxSize)
                 out.write(buf)
                 total += length
 
         return path
     elif target == 'memory':
-        return ''.join(request.iter_content(65536))
+        return ''.join(chunks)
+    elif target == 'stream':
+        return chunks
     else:
         raise Exception('Invalid HTTP fetch target: ' + target)
 
 
+def fetch(spec, **kwargs):
+    """
+    Downloads an input file via HTTP using requests.
+
+    With a ``"filepath"`` target, a ``"parallel"`` value greater than 1 in
+    the spec downloads that many byte ranges of the file at once, if the
+    server supports them.
+
+    If ``romanesco.http_cache`` is enabled, GET responses with an ``ETag`` or
+    ``Last-Modified`` header are cached on disk, and later fetches of the
+    same URL with the same headers send a conditional request and read the
+    body from the cache if it has not been modified. Set ``"cache"`` to
+    false in the spec to bypass the cache.
+    """
+    if 'url' not in spec:
+        raise Exception('No URL specified for HTTP input.')
+    taskInput = kwargs.get('task_input', {})
+    target = taskInput.get('target', 'memory')
+    url = spec['url']
+    method = spec.get('method', 'GET').upper()
+    headers = spec.get('headers', {})
+    session = sessionPool.session(url)
+    cache = romanesco.http_cache
+
+    cacheKey = None
+    request = None
+    if method == 'GET' and spec.get('cache', True) and cache.enabled:
+        cacheKey = cache.key(url, headers)
+        cached = cache.get(cacheKey)
+        if cached is not None:
+            meta, body = cached
+            try:
+                request = session.get(
+                    url, headers=dict(headers, **cache.conditions(meta)),
+                    stream=True, allow_redirects=True)
+            except Exception:
+                body.close()
+                raise
+            if request.status_code == 304:
+                request.close()
+                return _deliver(_readFile(body), meta['headers'], spec,
+                                kwargs)
+            body.close()
+
+    if target == 'filepath' and method == 'GET' and \
+            spec.get('parallel', 1) > 1:
+        if request is not None:
+            request.close()
+            request = None
+        path = _fetchRanges(spec, taskInput, spec['parallel'], kwargs,
+                            cacheKey)
+        if path is not None:
+            return path
+
+    if request is None:
+        request = session.request(method, url, headers=headers, stream=True,
+                                  allow_redirects=True)
+
+    try:
+        request.raise_for_status()
+    except:
+        print 'HTTP fetch failed (%s). Response: %s' % (url, request.text)
+        raise
+
+    chunks = request.iter_content(65536)
+    if cacheKey is not None:
+        meta = cache.metadata(url, request)
+        if meta is not None:
+            chunks = cache.put(cacheKey, meta, chunks)
+    return _deliver(chunks, request.headers, spec, kwargs)
+
+
 def push(data, spec, **kwargs):
     taskOutput = kwargs.get('task_output', {})
     target = taskOutput.get('target', 'memory')
@@ -73,13 +254,14 @@ def push(data, spec, **kwargs):
     url = spec['url']
     method = spec.get('method', 'POST').upper()
 
+    session = sessionPool.session(url)
     if target == 'filepath':
         with open(data, 'rb') as fd:
-            request = requests.request(
+            request = session.request(
                 method, url, headers=spec.get('headers', {}), data=fd,
                 allow_redirects=True)
     elif target == 'memory':
-        request = requests.request(
+        request = session.request(
             method, url, headers=spec.get('headers', {}), data=data,
             allow_redirects=True)
     else:
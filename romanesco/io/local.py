@@ -1,14 +1,35 @@
 def fetch(spec, **kwargs):
     """
-    Fetches a file on the local filesystem into memory.
+    Fetches a file on the local filesystem into memory. If the ``target`` of
+    the task input is ``"stream"``, returns an iterator over blocks of the
+    file instead.
     """
+    taskInput = kwargs.get('task_input', {})
+    if taskInput.get('target', 'memory') == 'stream':
+        return _readBlocks(spec['path'])
+
     with open(spec['path'], 'rb') as f:
         return f.read()
 
 
-def push(data, spec):
+def _readBlocks(path, blockSize=65536):
+    with open(path, 'rb') as f:
+        while True:
+            buf = f.read(blockSize)
+            if not buf:
+                break
+            yield buf
+
+
+def push(data, spec, **kwargs):
     """
     Write a blob of data in memory to a file specified in ``spec['path']``.
+    The data may also be an iterator of strings, which are written as they
+    are produced.
     """
     with open(spec['path'], 'wb') as out:
-        out.write(data)
+        if isinstance(data, basestring):
+            out.write(data)
+        else:
+            for buf in data:
+                out.write(buf)
@@ -1,25 +1,151 @@
-def fetch(spec, **kwargs):
+import itertools
+import struct
+import threading
+import uuid
+
+# Default number of documents per cursor batch and per bulk write
+BATCH_SIZE = 1000
+
+# Clients by host, shared by all fetches and pushes. Each client keeps its
+# own pool of connections and is safe to use from several threads.
+_clients = {}
+_clientsLock = threading.Lock()
+
+
+def getClient(host='localhost'):
+    """
+    Return the shared ``MongoClient`` for a host, creating it on first use.
+    """
     import pymongo
+    with _clientsLock:
+        if host not in _clients:
+            _clients[host] = pymongo.MongoClient(host)
+        return _clients[host]
+
+
+def _collection(spec):
+    return getClient(spec.get('host', 'localhost'))[spec['db']][
+        spec['collection']]
+
+
+def _batches(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        batch = list(itertools.islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def _encodedBatches(cursor, batchSize):
     import bson
-    db = spec['db']
-    collection = spec['collection']
-    host = spec.get('host', 'localhost')
-    data = ''.join([bson.BSON.encode(d) for d in
-                    pymongo.MongoClient(host)[db][collection].find()])
-    return data
+    for batch in _batches(cursor, batchSize):
+        yield ''.join(bson.BSON.encode(d) for d in batch)
 
 
-def push(data, spec, **kwargs):
-    import pymongo
+def _documents(data):
+    """
+    Decode BSON documents one at a time from a string or an iterable of
+    string chunks, instead of decoding them all into a list up front.
+    """
     import bson
-    db = spec['db']
-    collection = spec['collection']
-    host = spec.get('host', 'localhost')
-    bson_data = bson.decode_all(data)
-
-    c = pymongo.MongoClient(host)[db][collection]
-    # TODO is this really what we want? Dropping the whole collection?
-    # Seems dangerous, might be unexpected.
-    c.drop()
-    if len(bson_data) > 0:
-        c.insert(bson_data)
+    chunks = [data] if isinstance(data, basestring) else data
+    buf = ''
+    for chunk in chunks:
+        buf += chunk
+        offset = 0
+        while len(buf) - offset >= 4:
+            size = struct.unpack('<i', buf[offset:offset + 4])[0]
+            if len(buf) - offset < size:
+                break
+            yield bson.BSON(buf[offset:offset + size]).decode()
+            offset += size
+        buf = buf[offset:]
+    if buf:
+        raise Exception('Incomplete BSON document in MongoDB push data.')
+
+
+def fetch(spec, **kwargs):
+    """
+    Reads a collection through a cursor that fetches ``batchSize`` documents
+    at a time. With a ``"stream"`` target, the BSON of each batch is yielded
+    as it arrives instead of being joined into one string.
+
+    A query, fields and limit selected by the spec are passed to the server
+    as the filter, projection and limit of the cursor. Only the listed fields
+    are returned, leaving out ``_id`` unless it is one of them.
+    """
+    from romanesco.io import selection
+
+    taskInput = kwargs.get('task_input', {})
+    target = taskInput.get('target', 'memory')
+    batchSize = spec.get('batchSize', BATCH_SIZE)
+    query, fields, limit = selection(spec)
+
+    projection = None
+    if fields is not None:
+        projection = {field: 1 for field in fields}
+        projection.setdefault('_id', 0)
+    cursor = _collection(spec).find(query or {}, projection)
+    cursor.batch_size(batchSize)
+    if limit is not None:
+        cursor.limit(limit)
+    chunks = _encodedBatches(cursor, batchSize)
+
+    if target == 'memory':
+        return ''.join(chunks)
+    elif target == 'stream':
+        return chunks
+    else:
+        raise Exception('Invalid MongoDB fetch target: ' + target)
+
+
+def _write(collection, documents, writeMode, batchSize):
+    # Unordered bulk writes of at most batchSize documents each
+    count = 0
+    for batch in _batches(documents, batchSize):
+        bulk = collection.initialize_unordered_bulk_op()
+        for doc in batch:
+            if writeMode == 'upsert' and '_id' in doc:
+                bulk.find({'_id': doc['_id']}).upsert().replace_one(doc)
+            else:
+                bulk.insert(doc)
+        bulk.execute()
+        count += len(batch)
+    return count
+
+
+def push(data, spec, **kwargs):
+    """
+    Writes BSON documents to a collection in unordered bulk writes of
+    ``batchSize`` documents. The ``writeMode`` of the spec is one of:
+
+    ``"replace"`` (the default): Replace the contents of the collection. The
+    documents are written to a temporary collection that is then renamed over
+    the target, so the old contents stay in place until all of the documents
+    are written.
+
+    ``"append"``: Insert the documents into the collection.
+
+    ``"upsert"``: Replace documents that have the ``_id`` of a pushed
+    document and insert the others.
+    """
+    writeMode = spec.get('writeMode', 'replace')
+    batchSize = spec.get('batchSize', BATCH_SIZE)
+    collection = _collection(spec)
+    documents = _documents(data)
+
+    if writeMode in ('append', 'upsert'):
+        _write(collection, documents, writeMode, batchSize)
+    elif writeMode == 'replace':
+        tmp = collection.database['%s.tmp_%s' % (
+            collection.name, uuid.uuid4().hex)]
+        try:
+            if _write(tmp, documents, 'append', batchSize):
+                tmp.rename(collection.name, dropTarget=True)
+            else:
+                collection.drop()
+        finally:
+            tmp.drop()
+    else:
+        raise Exception('Invalid MongoDB write mode: ' + writeMode)
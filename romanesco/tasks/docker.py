@@ -4,6 +4,8 @@ import select
 import subprocess
 import sys
 
+from romanesco.utils import get_tmp_dir
+
 
 def _pullImage(image):
     """
@@ -67,7 +69,7 @@ def run(task, inputs, outputs, task_inputs, task_outputs, **kwargs):
     print('Pulling docker image: ' + image)
     _pullImage(image)
 
-    tmpDir = kwargs.get('_tmp_dir')
+    tmpDir = get_tmp_dir(kwargs)
     args = _expandArgs(task['container_args'], inputs, task_inputs, tmpDir)
 
     printStdErr, printStdOut = True, True
@@ -1,7 +1,52 @@
+import hashlib
 import imp
 import json
+import marshal
 import sys
 
+from romanesco.utils import LruCache
+
+# Process-wide cache of compiled task scripts, keyed by the SHA-1 hash of the
+# script source. Hit and miss counts are available via codeCache.stats().
+codeCache = LruCache(maxSize=1024)
+
+# Marshaled code objects compiled ahead of time (e.g. from the converter
+# registry snapshot), keyed like codeCache. They are unmarshaled on first use.
+precompiled = {}
+
+
+def scriptKey(script):
+    """
+    Return the key under which the compiled form of a script is cached.
+
+    :param script: The python source.
+    :type script: str or unicode
+    """
+    source = script.encode('utf8') if isinstance(script, unicode) else script
+    return hashlib.sha1(source).hexdigest()
+
+
+def compileScript(script):
+    """
+    Compile the source of a python mode task into a code object, reusing the
+    cached code object if the same source has been compiled before.
+
+    :param script: The python source to compile.
+    :type script: str or unicode
+    """
+    key = scriptKey(script)
+    code = codeCache.get(key)
+
+    if code is None:
+        blob = precompiled.pop(key, None)
+        if blob is not None:
+            code = marshal.loads(blob)
+        else:
+            code = compile(script, '<string>', 'exec')
+        codeCache.put(key, code)
+
+    return code
+
 
 def run(task, inputs, outputs, task_inputs, task_outputs, **kwargs):
     custom = imp.new_module("custom")
@@ -10,7 +55,7 @@ def run(task, inputs, outputs, task_inputs, task_outputs, **kwargs):
         custom.__dict__[name] = inputs[name]["script_data"]
 
     try:
-        exec task["script"] in custom.__dict__
+        exec compileScript(task["script"]) in custom.__dict__
     except Exception, e:
         trace = sys.exc_info()[2]
         lines = task["script"].split("\n")
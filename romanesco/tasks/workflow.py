@@ -111,6 +111,7 @@ def run(task, inputs, outputs, task_inputs, task_outputs, validate,
 
             if "script_data" in vis_bindings[b]:
                 del vis_bindings[b]["script_data"]
+            vis_bindings[b].pop("validated", None)
 
         outputs["_visualizations"].append({
             "mode": "preset",
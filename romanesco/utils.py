@@ -1,13 +1,18 @@
+import atexit
+import collections
 import contextlib
 import functools
 import os
+import Queue
 import requests
 import romanesco
 import shutil
 import sys
 import tempfile
+import threading
 import time
 import traceback
+import urlparse
 import zipfile
 
 
@@ -99,7 +104,7 @@ class JobManager(object):
                 self._progressCurrent is not None:
             self._redirectPipes(False)
 
-            requests.request(
+            sessionPool.session(self.url).request(
                 self.method.upper(), self.url, allow_redirects=True,
                 headers=self.headers, data={
                     'log': self._buf,
@@ -146,8 +151,9 @@ class JobManager(object):
             return
 
         self._redirectPipes(False)
-        requests.request(self.method.upper(), self.url, headers=self.headers,
-                         data={'status': status}, allow_redirects=True)
+        sessionPool.session(self.url).request(
+            self.method.upper(), self.url, headers=self.headers,
+            data={'status': status}, allow_redirects=True)
         self._redirectPipes(True)
 
     def updateProgress(self, total=None, current=None, message=None,
@@ -177,6 +183,109 @@ class JobManager(object):
             self._last = time.time()
 
 
+class LruCache(object):
+    """
+    A thread-safe least-recently-used cache. Entries are evicted once the
+    number of entries exceeds ``maxSize`` or, if ``maxBytes`` is set, once the
+    total size of the entries passed to :py:meth:`put` exceeds ``maxBytes``.
+    Hit and miss counts are recorded in the ``hits`` and ``misses``
+    attributes.
+    """
+    def __init__(self, maxSize=None, maxBytes=None):
+        """
+        :param maxSize: Maximum number of entries, or None for no limit.
+        :type maxSize: int or None
+        :param maxBytes: Maximum total size of the entries, or None for no
+            limit.
+        :type maxBytes: int or None
+        """
+        self.maxSize = maxSize
+        self.maxBytes = maxBytes
+        self.hits = 0
+        self.misses = 0
+        self.bytes = 0
+
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def get(self, key, default=None):
+        """
+        Return the value cached under ``key`` and mark it as the most recently
+        used entry, or return ``default`` if it is not cached.
+        """
+        with self._lock:
+            try:
+                value, size = self._entries.pop(key)
+            except KeyError:
+                self.misses += 1
+                return default
+            self._entries[key] = (value, size)
+            self.hits += 1
+            return value
+
+    def put(self, key, value, size=0):
+        """
+        Cache a value, evicting the least recently used entries as needed.
+
+        :param key: The cache key.
+        :param value: The value to cache.
+        :param size: The size of the value in bytes, counted against
+            ``maxBytes``.
+        :type size: int
+        """
+        with self._lock:
+            if key in self._entries:
+                self.bytes -= self._entries.pop(key)[1]
+            self._entries[key] = (value, size)
+            self.bytes += size
+            self._evict()
+
+    def pop(self, key, default=None):
+        """
+        Remove an entry from the cache, returning its value or ``default``.
+        """
+        with self._lock:
+            if key not in self._entries:
+                return default
+            value, size = self._entries.pop(key)
+            self.bytes -= size
+            return value
+
+    def clear(self):
+        """
+        Remove all entries and reset the hit and miss counts.
+        """
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        """
+        Return a dictionary describing the cache usage.
+        """
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'entries': len(self._entries),
+            'bytes': self.bytes
+        }
+
+    def _evict(self):
+        while self._entries and (
+                (self.maxSize is not None and
+                 len(self._entries) > self.maxSize) or
+                (self.maxBytes is not None and self.bytes > self.maxBytes)):
+            self.bytes -= self._entries.popitem(last=False)[1][1]
+
+
 def toposort(data):
     """
     General-purpose topological sort function. Dependencies are expressed as a
@@ -248,3 +357,344 @@ def with_tmpdir(fn):
             kwargs['_tmp_dir'] = tmp_dir
             return fn(*args, **kwargs)
     return wrapped
+
+
+class ScratchDir(object):
+    """
+    A scratch directory handed out by :py:class:`ScratchManager`. The
+    directory is only created when its :py:attr:`path` is first accessed.
+    """
+    def __init__(self, manager, cleanup=True):
+        self.manager = manager
+        self.cleanup = cleanup
+        self._path = None
+        self._lock = threading.Lock()
+
+    @property
+    def created(self):
+        return self._path is not None
+
+    @property
+    def path(self):
+        # Inputs of a run may be fetched from several threads
+        with self._lock:
+            if self._path is None:
+                self._path = self.manager._create()
+            return self._path
+
+    def release(self):
+        """
+        Give the directory back to the manager. If it was created and cleanup
+        is enabled, it is emptied in the background and reused.
+        """
+        if self._path is not None:
+            self.manager._release(self._path, self.cleanup)
+            self._path = None
+
+
+class ScratchManager(object):
+    """
+    Hands out lazily created scratch directories underneath the ``tmp_root``
+    config setting, or underneath ``tmpfs_root`` if it is set and its parent
+    directory exists. Released directories are emptied by a background
+    thread and kept in a pool for reuse, so runs that never ask for a
+    directory do no filesystem work at all. If ``tmp_quota`` is set, creating
+    a directory fails once the root holds more than that many bytes. The
+    usage is kept as a running count, adjusted as directories are released
+    and cleaned up, and only re-scanned every ``scanInterval`` seconds to pick
+    up files written by other processes.
+    """
+    def __init__(self, poolSize=16, scanInterval=60):
+        """
+        :param poolSize: Maximum number of emptied directories to keep for
+            reuse.
+        :type poolSize: int
+        :param scanInterval: Seconds after which the quota check re-scans
+            the root instead of trusting the running count.
+        :type scanInterval: float
+        """
+        self.poolSize = poolSize
+        self.scanInterval = scanInterval
+
+        self._pool = {}
+        self._usage = {}
+        self._sizes = {}
+        self._lock = threading.Lock()
+        self._queue = Queue.Queue()
+        self._thread = None
+
+        atexit.register(self.flush)
+
+    def acquire(self, cleanup=True):
+        """
+        Return a new :py:class:`ScratchDir`. No directory is created until its
+        path is requested.
+
+        :param cleanup: Whether to empty the directory once it is released.
+        :type cleanup: bool
+        """
+        return ScratchDir(self, cleanup=cleanup)
+
+    def root(self):
+        """
+        The directory under which scratch directories are currently created.
+        """
+        config = romanesco.config
+        if config.has_option('romanesco', 'tmpfs_root'):
+            tmpfs = os.path.abspath(config.get('romanesco', 'tmpfs_root'))
+            if os.path.isdir(os.path.dirname(tmpfs)):
+                return tmpfs
+        return os.path.abspath(config.get('romanesco', 'tmp_root'))
+
+    def usage(self, root=None):
+        """
+        Return the total size in bytes of the files under the scratch root,
+        not counting the conversion and HTTP caches, which bound their own
+        size.
+        """
+        caches = set(
+            getattr(romanesco, name).diskRoot
+            for name in ('conversion_cache', 'http_cache')
+            if getattr(romanesco, name, None) is not None)
+        total = 0
+        for dirpath, dirnames, filenames in os.walk(root or self.root()):
+            dirnames[:] = [
+                name for name in dirnames
+                if os.path.join(dirpath, name) not in caches]
+            for filename in filenames:
+                try:
+                    total += os.path.getsize(os.path.join(dirpath, filename))
+                except OSError:
+                    pass
+        return total
+
+    def flush(self):
+        """
+        Block until all released directories have been cleaned up.
+        """
+        self._queue.join()
+
+    def _checkQuota(self, root):
+        config = romanesco.config
+        if not config.has_option('romanesco', 'tmp_quota'):
+            return
+        quota = config.getint('romanesco', 'tmp_quota')
+        if self._used(root) > quota:
+            # Pending cleanup may free enough space
+            self.flush()
+            if self._used(root, rescan=True) > quota:
+                raise Exception(
+                    'Scratch space quota of %d bytes under %s exceeded.' % (
+                        quota, root))
+
+    def _used(self, root, rescan=False):
+        with self._lock:
+            entry = self._usage.get(root)
+        if (rescan or entry is None or
+                time.time() - entry[1] >= self.scanInterval):
+            entry = [self.usage(root), time.time()]
+            with self._lock:
+                self._usage[root] = entry
+        return entry[0]
+
+    def _create(self):
+        root = self.root()
+        self._checkQuota(root)
+
+        with self._lock:
+            pool = self._pool.get(root)
+            if pool:
+                return pool.pop()
+
+        try:
+            os.makedirs(root)
+        except OSError:
+            if not os.path.isdir(root):
+                raise
+        return tempfile.mkdtemp(dir=root)
+
+    def _release(self, path, cleanup):
+        size = self.usage(path)
+        with self._lock:
+            entry = self._usage.get(os.path.dirname(path))
+            if entry is not None:
+                entry[0] += size
+            if cleanup:
+                self._sizes[path] = size
+        if not cleanup:
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._cleanupLoop)
+                self._thread.daemon = True
+                self._thread.start()
+        self._queue.put(path)
+
+    def _cleanupLoop(self):
+        while True:
+            path = self._queue.get()
+            try:
+                self._clean(path)
+            except Exception:
+                traceback.print_exc()
+            finally:
+                self._queue.task_done()
+
+    def _clean(self, path):
+        root = os.path.dirname(path)
+        with self._lock:
+            size = self._sizes.pop(path, 0)
+            entry = self._usage.get(root)
+            if entry is not None:
+                entry[0] = max(0, entry[0] - size)
+
+        if not os.path.isdir(path):
+            return
+        for name in os.listdir(path):
+            child = os.path.join(path, name)
+            if os.path.isdir(child) and not os.path.islink(child):
+                shutil.rmtree(child)
+            else:
+                os.remove(child)
+
+        with self._lock:
+            pool = self._pool.setdefault(root, [])
+            if len(pool) < self.poolSize:
+                pool.append(path)
+                return
+        os.rmdir(path)
+
+
+scratchManager = ScratchManager()
+
+
+def with_scratch(fn):
+    """
+    Decorator that passes a lazily created :py:class:`ScratchDir` from
+    ``scratchManager`` into the function as the special kwarg ``"_scratch"``,
+    and releases it when the function returns. The ``cleanup`` kwarg
+    controls whether it is cleaned up afterward. Use :py:func:`get_tmp_dir` to
+    obtain the directory path. If the caller already passed ``"_scratch"`` or
+    ``"_tmp_dir"``, the function is called unchanged.
+    """
+    @functools.wraps(fn)
+    def wrapped(*args, **kwargs):
+        if '_scratch' in kwargs or '_tmp_dir' in kwargs:
+            return fn(*args, **kwargs)
+
+        scratch = scratchManager.acquire(cleanup=kwargs.get('cleanup', True))
+        kwargs['_scratch'] = scratch
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            scratch.release()
+    return wrapped
+
+
+def get_tmp_dir(kwargs):
+    """
+    Return the temp directory path for a run given its kwargs, creating the
+    scratch directory if this is the first time it has been asked for.
+    Returns ``None`` if the run has no scratch directory.
+
+    :param kwargs: The kwargs passed to a task or IO mode function.
+    :type kwargs: dict
+    """
+    if kwargs.get('_tmp_dir'):
+        return kwargs['_tmp_dir']
+    if kwargs.get('_scratch'):
+        return kwargs['_scratch'].path
+    return None
+
+
+class SessionPool(object):
+    """
+    Process-wide ``requests.Session`` objects, one per scheme and host, so
+    that connections to a host are kept alive and reused across fetches,
+    pushes and job updates. Each session keeps up to ``http_pool_size``
+    connections open (10 by default). Requests with idempotent methods are
+    retried up to ``http_retries`` times (3 by default) on connection errors
+    and 500, 502, 503 and 504 responses, with an exponential backoff of
+    ``http_backoff`` seconds (0.5 by default) times a power of two. If
+    ``http_keep_alive`` is false, connections are closed after each request.
+    These are read from the worker config when a session is created. Callers
+    that retry requests themselves can ask for a session that does not.
+    """
+    def __init__(self):
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def session(self, url, retry=True):
+        """
+        Return the shared session for the scheme and host of a URL, creating
+        it on first use.
+
+        :param url: The URL to be requested.
+        :type url: str
+        :param retry: Whether failed requests are retried by the session.
+        :type retry: bool
+        """
+        parts = urlparse.urlsplit(url)
+        key = (parts.scheme.lower(), parts.netloc.lower(), retry)
+        with self._lock:
+            if key not in self._sessions:
+                self._sessions[key] = self._create(retry)
+            return self._sessions[key]
+
+    def clear(self):
+        """
+        Close and forget all sessions, for instance after the config changed.
+        """
+        with self._lock:
+            sessions = self._sessions.values()
+            self._sessions = {}
+        for session in sessions:
+            session.close()
+
+    # Defaults of the worker config options used by the pool
+    defaults = {
+        'http_pool_size': 10,
+        'http_keep_alive': True,
+        'http_retries': 3,
+        'http_backoff': 0.5
+    }
+
+    def setting(self, name):
+        """
+        Return the value of one of the ``http_*`` worker config options in
+        :py:attr:`defaults`, or its default if it is not set.
+        """
+        default = self.defaults[name]
+        config = romanesco.config
+        if not config.has_option('romanesco', name):
+            return default
+        if isinstance(default, bool):
+            return config.getboolean('romanesco', name)
+        elif isinstance(default, int):
+            return config.getint('romanesco', name)
+        return config.getfloat('romanesco', name)
+
+    def _create(self, retry):
+        from requests.adapters import HTTPAdapter
+        from requests.packages.urllib3.util.retry import Retry
+
+        if retry:
+            retry = Retry(
+                total=self.setting('http_retries'),
+                backoff_factor=self.setting('http_backoff'),
+                status_forcelist=(500, 502, 503, 504))
+        else:
+            retry = 0
+        adapter = HTTPAdapter(pool_connections=1,
+                              pool_maxsize=self.setting('http_pool_size'),
+                              max_retries=retry)
+
+        session = requests.Session()
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        if not self.setting('http_keep_alive'):
+            session.headers['Connection'] = 'close'
+        return session
+
+
+sessionPool = SessionPool()
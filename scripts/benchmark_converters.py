@@ -0,0 +1,23 @@
+import argparse
+import romanesco
+
+
+def benchmark_converters(output, repeat):
+    costs = romanesco.format.benchmark_converters(repeat=repeat)
+    romanesco.format.save_conversion_costs(output)
+    for type in sorted(costs):
+        for in_format in sorted(costs[type]):
+            for out_format, cost in sorted(costs[type][in_format].items()):
+                print "%s:%s -> %s:%s  %.6f s" % (
+                    type, in_format, type, out_format, cost)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Measure the cost of each converter and write the cost "
+                    "table used to plan conversion paths.")
+    parser.add_argument("--output", default=None,
+                        help="cost table to write (default: the table "
+                             "shipped in romanesco/format)")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    benchmark_converters(args.output, args.repeat)
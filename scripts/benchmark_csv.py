@@ -0,0 +1,48 @@
+import argparse
+import random
+import romanesco
+import time
+
+
+def make_csv(rows):
+    random.seed(0)
+    lines = ["id,value,ratio,label,mixed"]
+    for i in xrange(rows):
+        lines.append("%d,%d,%.6f,item%d,%s" % (
+            i, random.randint(-1000, 1000), random.random(), i % 100,
+            random.choice(["1", "2.5", "nan", "", "x"])))
+    return "\n".join(lines) + "\n"
+
+
+def timed(name, function, *args):
+    start = time.time()
+    result = function(*args)
+    print "%-28s %8.3f s" % (name, time.time() - start)
+    return result
+
+
+def benchmark_csv(rows):
+    data = timed("generate %d rows" % rows, make_csv, rows)
+    print "%-28s %8.1f MB" % ("input size", len(data) / 1e6)
+
+    table = timed("csv_to_rows", romanesco.format.csv_to_rows, data)
+    assert len(table["rows"]) == rows
+
+    timed("rows_to_csv", romanesco.format.tables.rows_to_csv, table)
+
+    def stream():
+        output = romanesco.convert_stream(
+            "table", {"format": "csv", "data": [data]}, {"format": "rows"})
+        return sum(len(chunk["rows"]) for chunk in output["data"])
+    assert timed("streamed csv to rows", stream) == rows
+
+    if romanesco.format.columns is not None:
+        timed("csv_to_columns", romanesco.format.columns.csv_to_columns,
+              data)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Time parsing and writing a large generated CSV table.")
+    parser.add_argument("--rows", type=int, default=1000000)
+    args = parser.parse_args()
+    benchmark_csv(args.rows)
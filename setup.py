@@ -70,6 +70,7 @@ setup(
     package_data={
         'romanesco': [
             'worker.dist.cfg',
+            'format/*.json',
             'format/**/*'
         ]
     },
@@ -0,0 +1,7 @@
+import os
+import tempfile
+
+# Keep the converter registry snapshot written when romanesco is imported
+# out of the home directory of whoever runs the tests
+os.environ["ROMANESCO_SNAPSHOT_DIR"] = os.path.join(
+    tempfile.gettempdir(), "romanesco-tests")
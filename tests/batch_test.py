@@ -0,0 +1,66 @@
+import mock
+import romanesco
+import unittest
+
+
+class TestBatch(unittest.TestCase):
+
+    def setUp(self):
+        romanesco.conversion_cache.clear()
+        self.inputs = [{"format": "csv", "data": "a,b\n%d,%d\n" % (i, i * 2)}
+                       for i in range(20)]
+
+    def test_convert_many(self):
+        with mock.patch("romanesco.run") as run:
+            outputs = romanesco.convert_many("table", self.inputs, "rows")
+            self.assertFalse(run.called)
+
+        self.assertEqual(len(outputs), 20)
+        for i, output in enumerate(outputs):
+            self.assertEqual(output["format"], "rows")
+            self.assertEqual(output["data"]["rows"], [{"a": i, "b": i * 2}])
+            self.assertEqual(output["validated"], "table:rows")
+
+        # Results match convert()
+        single = romanesco.convert("table", self.inputs[3],
+                                   {"format": "rows"})
+        self.assertEqual(single["data"], outputs[3]["data"])
+
+    def test_scripts(self):
+        # Python script converters are executed without romanesco.run
+        inputs = [{"format": "rows",
+                   "data": {"fields": ["a"], "rows": [{"a": i}]}}
+                  for i in range(5)]
+        with mock.patch("romanesco.run") as run:
+            tables = romanesco.convert_many("table", inputs, "vtktable")
+            outputs = romanesco.convert_many("table", tables, "rows")
+            self.assertFalse(run.called)
+        for i, output in enumerate(outputs):
+            self.assertEqual(tables[i]["data"].GetNumberOfRows(), 1)
+            self.assertEqual(output["data"], inputs[i]["data"])
+
+    def test_errors(self):
+        inputs = list(self.inputs)
+        inputs[2] = {"format": "objectlist", "data": 5}
+        inputs[4] = {"format": "unknown", "data": ""}
+        outputs = romanesco.convert_many("table", inputs, "rows")
+
+        self.assertEqual(len(outputs), 20)
+        self.assertIn("error", outputs[2])
+        self.assertNotIn("data", outputs[2])
+        self.assertEqual(outputs[4]["error"],
+                         "No conversion path from table:unknown to "
+                         "table:rows.")
+        self.assertEqual(outputs[5]["data"]["rows"], [{"a": 5, "b": 10}])
+
+    def test_pools(self):
+        expected = romanesco.convert_many("table", self.inputs, "rows")
+        for pool in ("thread", "process"):
+            outputs = romanesco.convert_many(
+                "table", self.inputs, "rows", pool=pool, workers=2,
+                chunk_size=3)
+            self.assertEqual(outputs, expected)
+
+        self.assertRaisesRegexp(
+            Exception, "^Invalid pool: fiber$", romanesco.convert_many,
+            "table", self.inputs, "rows", pool="fiber")
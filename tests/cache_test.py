@@ -0,0 +1,188 @@
+import json
+import mock
+import os
+import romanesco
+import shutil
+import unittest
+
+from romanesco.cache import ConversionCache
+
+_tmp = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), 'tmp', 'cache')
+
+
+class TestConversionCache(unittest.TestCase):
+
+    def setUp(self):
+        # The shared cache is disabled by default
+        self.cache = ConversionCache(memoryBytes=1 << 20)
+        self.patch = mock.patch.object(romanesco, 'conversion_cache',
+                                       self.cache)
+        self.patch.start()
+
+    def tearDown(self):
+        self.patch.stop()
+        if os.path.isdir(_tmp):
+            shutil.rmtree(_tmp)
+
+    def test_convert(self):
+        csv = 'a,b\n1,2\n3,4\n'
+        input = {'format': 'csv', 'data': csv}
+        first = romanesco.convert('table', input, {'format': 'rows'})
+        self.assertEqual(self.cache.memory.misses, 1)
+
+        with mock.patch('romanesco.format.apply_converter') as apply:
+            second = romanesco.convert('table', input, {'format': 'rows'})
+            self.assertFalse(apply.called)
+        self.assertEqual(self.cache.memory.hits, 1)
+        self.assertEqual(first['data'], second['data'])
+
+        # Cached results are not shared between callers
+        self.assertIsNot(first['data'], second['data'])
+
+        # Other output formats and in-memory inputs are separate
+        romanesco.convert('table', input, {'format': 'objectlist'})
+        romanesco.convert('table', first, {'format': 'csv'})
+        self.assertEqual(self.cache.stats()['memory']['entries'], 2)
+
+    def test_run(self):
+        task = {
+            'inputs': [{'name': 'a', 'type': 'number', 'format': 'number'}],
+            'outputs': [{'name': 'b', 'type': 'number', 'format': 'number'}],
+            'script': 'b = a + 1'
+        }
+        for i in range(3):
+            out = romanesco.run(task, {'a': {'format': 'json', 'data': '1'}},
+                                {'b': {'format': 'json'}})
+            self.assertEqual(out['b']['data'], '2')
+        self.assertEqual(self.cache.memory.hits, 2)
+
+    def test_memory_eviction(self):
+        cache = ConversionCache(memoryBytes=10)
+        cache.put('a', 'x' * 6)
+        cache.put('b', 'y' * 6)
+        self.assertEqual(cache.get('a'), (False, None))
+        self.assertEqual(cache.get('b'), (True, 'y' * 6))
+
+        # Results over the limit are skipped without pickling all of them
+        with mock.patch('romanesco.cache._BoundedBuffer.getvalue') as value:
+            cache.put('c', range(1000))
+            self.assertFalse(value.called)
+        cache.put('d', 'z' * 11)
+        self.assertEqual(cache.get('b'), (True, 'y' * 6))
+        self.assertEqual(cache.get('c'), (False, None))
+        self.assertEqual(cache.get('d'), (False, None))
+
+        cache.put('e', 'w' * 9)
+        self.assertEqual(cache.get('e'), (True, 'w' * 9))
+
+    def test_disk(self):
+        cache = ConversionCache(diskBytes=200, diskRoot=_tmp)
+        key = cache.key('table', 'csv', 'rows', 'a\n1\n')
+        cache.put(key, {'fields': ['a'], 'rows': [{'a': 1}]})
+        cache.put('unicode', u'\u03c0')
+
+        other = ConversionCache(diskBytes=200, diskRoot=_tmp)
+        self.assertEqual(other.get(key),
+                         (True, {'fields': ['a'], 'rows': [{'a': 1}]}))
+        self.assertEqual(other.get('unicode'), (True, u'\u03c0'))
+        self.assertEqual(other.stats()['disk']['hits'], 2)
+
+        # Unpicklable results are skipped
+        cache.put('object', {'a': lambda: None})
+        self.assertEqual(cache.get('object'), (False, None))
+
+        # Least recently used entries are evicted once over the byte limit
+        cache.put('big', 'x' * 150)
+        self.assertEqual(cache.get(key), (False, None))
+        self.assertEqual(cache.get('big'), (True, 'x' * 150))
+
+        # An entry exactly filling a tier, kind byte included, is kept
+        cache.clear()
+        cache.put('exact', 'x' * 199)
+        self.assertEqual(cache.get('exact'), (True, 'x' * 199))
+        self.assertEqual(cache.stats()['disk']['bytes'], 200)
+        cache.put('over', 'x' * 200)
+        self.assertEqual(cache.get('over'), (False, None))
+
+        # Clearing leaves the temp files of writers in other processes
+        open(os.path.join(_tmp, '.inflight'), 'w').close()
+        cache.clear()
+        self.assertEqual(os.listdir(_tmp), ['.inflight'])
+
+
+class TestValidationCache(unittest.TestCase):
+
+    def setUp(self):
+        romanesco.validation_cache.clear()
+        self.validator = {
+            'inputs': [{'name': 'input', 'type': 'tcheck', 'format': 'x'}],
+            'outputs': [{'name': 'output', 'type': 'boolean',
+                         'format': 'boolean'}],
+            'script': 'output = isinstance(input, (str, list))',
+            'mode': 'python'
+        }
+        romanesco.format.validators['tcheck'] = {'x': self.validator}
+
+    def tearDown(self):
+        del romanesco.format.validators['tcheck']
+
+    def test_script_validator(self):
+        self.assertTrue(romanesco.isvalid('tcheck', {'format': 'x',
+                                                     'data': 'abc'}))
+        self.assertTrue(romanesco.isvalid('tcheck', {'format': 'x',
+                                                     'data': 'abc'}))
+        self.assertTrue(romanesco.isvalid('tcheck', {'format': 'x',
+                                                     'data': u'abc'}))
+        self.assertTrue(romanesco.isvalid('tcheck', {'format': 'x',
+                                                     'data': 'abcd'}))
+        self.assertEqual(romanesco.validation_cache.hits, 2)
+        self.assertEqual(romanesco.validation_cache.misses, 2)
+
+        # Other objects are validated every time and never held by the cache
+        data = ['a']
+        self.assertTrue(romanesco.isvalid('tcheck', {'format': 'x',
+                                                     'data': data}))
+        self.assertTrue(romanesco.isvalid('tcheck', {'format': 'x',
+                                                     'data': data}))
+        self.assertFalse(romanesco.isvalid('tcheck', {'format': 'x',
+                                                      'data': 1}))
+        self.assertEqual(len(romanesco.validation_cache), 2)
+        self.assertEqual(romanesco.validation_cache.misses, 2)
+
+    def test_marks(self):
+        binding = {'format': 'x', 'data': 'abc'}
+        self.assertTrue(romanesco.isvalid('tcheck', binding))
+        self.assertEqual(binding['validated'], 'tcheck:x')
+
+        with mock.patch('romanesco.run') as run:
+            self.assertTrue(romanesco.isvalid('tcheck', binding))
+            self.assertFalse(run.called)
+
+        # Marks given by the caller, such as in JSON bindings, are ignored
+        binding = json.loads(json.dumps(binding))
+        self.assertEqual(binding['validated'], 'tcheck:x')
+        binding['data'] = 1
+        self.assertFalse(romanesco.isvalid('tcheck', binding))
+        self.assertNotIn('validated', romanesco.convert(
+            'tcheck', binding, {'format': 'x'}))
+
+        # Converter outputs carry the mark of their output format
+        output = romanesco.convert(
+            'number', {'format': 'json', 'data': '2'}, {'format': 'number'})
+        self.assertEqual(output['validated'], 'number:number')
+        output = romanesco.convert(
+            'number', {'format': 'number', 'data': 2}, {'format': 'number'})
+        self.assertNotIn('validated', output)
+
+        # Validated outputs of a step are trusted by downstream steps
+        task = {
+            'inputs': [{'name': 'a', 'type': 'tcheck', 'format': 'x'}],
+            'outputs': [{'name': 'b', 'type': 'tcheck', 'format': 'x'}],
+            'script': 'b = a'
+        }
+        out = romanesco.run(task, {'a': {'format': 'x', 'data': 'abc'}})
+        self.assertEqual(out['b']['validated'], 'tcheck:x')
+        with mock.patch('romanesco.format.get_function') as getFunction:
+            romanesco.run(task, {'a': out['b']})
+            self.assertEqual(getFunction.call_count, 1)
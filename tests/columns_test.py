@@ -0,0 +1,155 @@
+import numpy
+import os
+import romanesco
+import unittest
+
+_data = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+
+
+class TestColumns(unittest.TestCase):
+
+    def setUp(self):
+        self.rows = {
+            "fields": ["a", "b", "c"],
+            "rows": [{"a": 1, "b": 1.5, "c": "x"},
+                     {"a": 2, "b": 2.5, "c": "y"},
+                     {"a": 3, "b": -1.0, "c": "z"}]
+        }
+
+    def convert(self, input, format):
+        return romanesco.convert("table", input, {"format": format})["data"]
+
+    def test_rows(self):
+        output = self.convert({"format": "rows", "data": self.rows},
+                              "columns")
+        self.assertEqual(output["fields"], ["a", "b", "c"])
+        self.assertEqual(output["columns"]["a"].dtype, numpy.int64)
+        self.assertEqual(output["columns"]["b"].dtype, numpy.float64)
+        self.assertEqual(output["columns"]["c"].dtype, object)
+        self.assertEqual(output["columns"]["c"].tolist(), ["x", "y", "z"])
+
+        back = self.convert({"format": "columns", "data": output}, "rows")
+        self.assertEqual(back, self.rows)
+        self.assertIsInstance(back["rows"][0]["a"], int)
+
+        # Vectors give two-dimensional columns
+        rows = {"fields": ["a", "b"], "rows": [
+            {"a": [1, 2], "b": ["x", "y"]}, {"a": [3, 4], "b": ["z", "w"]}]}
+        output = self.convert({"format": "rows", "data": rows}, "columns")
+        self.assertEqual(output["columns"]["a"].shape, (2, 2))
+        self.assertEqual(output["columns"]["a"].dtype, numpy.int64)
+        self.assertEqual(output["columns"]["b"].shape, (2, 2))
+        self.assertEqual(self.convert(
+            {"format": "columns", "data": output}, "rows"), rows)
+
+        # Missing values give object columns
+        rows = {"fields": ["a"], "rows": [{"a": 1}, {}]}
+        output = self.convert({"format": "rows", "data": rows}, "columns")
+        self.assertEqual(output["columns"]["a"].tolist(), [1, None])
+
+    def test_csv(self):
+        for name in ("flu.csv", "test.csv", "mammal_lnMass_tiny.csv"):
+            with open(os.path.join(_data, name)) as f:
+                csv = f.read()
+            output = self.convert({"format": "csv", "data": csv}, "columns")
+            rows = romanesco.format.csv_to_rows(csv)
+            self.assertEqual(output["fields"], rows["fields"])
+
+            # Columns match the values parsed row by row
+            for field in rows["fields"]:
+                self.assertEqual(output["columns"][field].tolist(),
+                                 [row[field] for row in rows["rows"]])
+
+        csv = "a,b,c\n1,2.5,x\n2,nan,3\n"
+        output = self.convert({"format": "csv", "data": csv}, "columns")
+        self.assertEqual(output["columns"]["a"].dtype, numpy.int64)
+        self.assertEqual(output["columns"]["b"].tolist(), [2.5, "nan"])
+        self.assertEqual(output["columns"]["c"].tolist(), ["x", 3])
+
+        csv = self.convert({"format": "rows", "data": self.rows}, "csv")
+        output = self.convert({"format": "csv", "data": csv}, "columns")
+        self.assertEqual(self.convert(
+            {"format": "columns", "data": output}, "csv"), csv)
+        tsv = self.convert({"format": "columns", "data": output}, "tsv")
+        self.assertEqual(tsv, self.convert(
+            {"format": "rows", "data": self.rows}, "tsv"))
+        self.assertEqual(self.convert(
+            {"format": "tsv", "data": tsv}, "rows"), self.rows)
+
+        output = self.convert({"format": "csv", "data": "a,b\n"}, "columns")
+        self.assertEqual(output["fields"], ["a", "b"])
+        self.assertEqual(len(output["columns"]["a"]), 0)
+
+    def test_mixed_columns(self):
+        # Blank, text and mixed number columns give the same values through
+        # the columns format as directly from CSV
+        csv = "a,b,c,d,e\n1,,x,1,1\n2,3,4,2.5,\n3,4.5,nan,-1,inf\n"
+        rows = romanesco.format.csv_to_rows(csv)
+        self.assertEqual(rows["rows"][0], {"a": 1, "b": "", "c": "x",
+                                           "d": 1, "e": 1})
+        columns = self.convert({"format": "csv", "data": csv}, "columns")
+        self.assertEqual(self.convert(
+            {"format": "columns", "data": columns}, "rows"), rows)
+        for field in ("b", "c", "d", "e"):
+            self.assertEqual(columns["columns"][field].dtype, object)
+        self.assertIsInstance(columns["columns"]["d"][0], int)
+
+        for format in ("objectlist", "jsonlines", "rows.json"):
+            self.assertEqual(
+                self.convert({"format": "csv", "data": csv}, format),
+                self.convert({"format": "rows", "data": rows}, format))
+
+    def test_objectlist(self):
+        objects = [{"a": 1, "b": {"c": "x"}}, {"a": 2, "b": {"c": "y"}}]
+        output = self.convert({"format": "objectlist", "data": objects},
+                              "columns")
+        self.assertEqual(output["fields"], ["a", "b.c"])
+        self.assertEqual(output["columns"]["a"].tolist(), [1, 2])
+        self.assertEqual(self.convert(
+            {"format": "columns", "data": output}, "objectlist"), objects)
+
+    def test_vtktable(self):
+        columns = {
+            "fields": ["a", "b", "c"],
+            "columns": {"a": numpy.array([1, 2]),
+                        "b": numpy.array([[1.0, 2.0], [3.0, 4.0]]),
+                        "c": numpy.array(["x", "y"], dtype=object)}
+        }
+        table = self.convert({"format": "columns", "data": columns},
+                             "vtktable")
+        self.assertEqual(table.GetNumberOfRows(), 2)
+        self.assertEqual(table.GetColumnByName("b").GetNumberOfComponents(),
+                         2)
+
+        # Matches the row by row converters
+        self.assertEqual(self.convert({"format": "vtktable", "data": table},
+                                      "rows")["rows"],
+                         [{"a": 1.0, "b": [1.0, 2.0], "c": "x"},
+                          {"a": 2.0, "b": [3.0, 4.0], "c": "y"}])
+
+        output = self.convert({"format": "vtktable", "data": table},
+                              "columns")
+        self.assertEqual(output["fields"], ["a", "b", "c"])
+        self.assertEqual(output["columns"]["a"].tolist(), [1.0, 2.0])
+        self.assertEqual(output["columns"]["b"].shape, (2, 2))
+        self.assertEqual(output["columns"]["c"].tolist(), ["x", "y"])
+
+        # Unicode columns give unicode string arrays, as from rows
+        columns["columns"]["c"] = numpy.array([u"\xe9", None], dtype=object)
+        table = self.convert({"format": "columns", "data": columns},
+                             "vtktable")
+        self.assertEqual(table.GetColumnByName("c").GetClassName(),
+                         "vtkUnicodeStringArray")
+        self.assertEqual(table.GetColumnByName("c").GetValue(1), u"")
+
+    def test_validator(self):
+        columns = {"fields": ["a"], "columns": {"a": numpy.arange(3)}}
+        self.assertTrue(romanesco.isvalid(
+            "table", {"format": "columns", "data": columns}))
+        for data in ({"fields": ["a"], "columns": {"a": [1]}},
+                     {"fields": ["a", "b"], "columns": {"a": numpy.arange(3)}},
+                     {"fields": ["a", "b"], "columns": {
+                         "a": numpy.arange(3), "b": numpy.arange(2)}},
+                     self.rows):
+            self.assertFalse(romanesco.isvalid(
+                "table", {"format": "columns", "data": data}))
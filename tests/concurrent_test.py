@@ -0,0 +1,185 @@
+import copy
+import mock
+import os
+import romanesco
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+
+class TestConcurrent(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.task = {
+            "inputs": [{"name": n, "type": "table", "format": "rows"}
+                       for n in ("a", "b", "c", "d")],
+            "outputs": [{"name": n, "type": "table", "format": "rows"}
+                        for n in ("e", "f")],
+            "script": "e = a\nf = {'fields': a['fields'], "
+                      "'rows': a['rows'] + b['rows'] + c['rows'] + d['rows']}",
+            "mode": "python"
+        }
+        self.inputs = {}
+        for i, name in enumerate("abcd"):
+            path = os.path.join(self.tmp, name + ".csv")
+            with open(path, "w") as f:
+                f.write("x,y\n%d,%d\n" % (i, i * 10))
+            self.inputs[name] = {"format": "csv", "url": "file://" + path}
+
+        self.fetch = romanesco.io.local.fetch
+        self.threads = set()
+        self.broken = 0
+
+        # Jobs wait in enter() until `expected` of them are in flight at once
+        self.lock = threading.Lock()
+        self.inFlight = 0
+        self.maxInFlight = 0
+        self.expected = None
+        self.together = threading.Event()
+        self.together.set()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def expect(self, count):
+        self.expected = count
+        self.together.clear()
+
+    def enter(self):
+        with self.lock:
+            self.inFlight += 1
+            self.maxInFlight = max(self.maxInFlight, self.inFlight)
+            if self.inFlight == self.expected:
+                self.together.set()
+        self.together.wait(10)
+        with self.lock:
+            self.inFlight -= 1
+
+    def slowFetch(self, spec, **kwargs):
+        self.threads.add(threading.current_thread().ident)
+        self.enter()
+        if spec["path"].endswith("c.csv") and self.broken:
+            raise Exception("c is broken")
+        if spec["path"].endswith("b.csv") and self.broken > 1:
+            raise Exception("b is broken")
+        return self.fetch(spec, **kwargs)
+
+    def test_inputs(self):
+        self.expect(4)
+        with mock.patch("romanesco.io.local.fetch", self.slowFetch):
+            outputs = romanesco.run(self.task, self.inputs)
+
+        # The four fetches overlap
+        self.assertEqual(self.maxInFlight, 4)
+        self.assertEqual(len(self.threads), 4)
+        self.assertEqual(outputs["f"]["data"]["rows"], [
+            {"x": i, "y": i * 10} for i in range(4)])
+
+    def test_serial(self):
+        try:
+            romanesco.io_threads = 1
+            with mock.patch("romanesco.io.local.fetch", self.slowFetch):
+                outputs = romanesco.run(self.task, self.inputs)
+            self.assertEqual(len(self.threads), 1)
+            self.assertEqual(outputs["e"]["data"]["rows"], [{"x": 0, "y": 0}])
+        finally:
+            romanesco.io_threads = 8
+
+    def test_errors(self):
+        # A single failure is raised as is
+        self.broken = 1
+        with mock.patch("romanesco.io.local.fetch", self.slowFetch):
+            self.assertRaisesRegexp(
+                Exception, "^c is broken$", romanesco.run, self.task,
+                copy.deepcopy(self.inputs))
+
+        # Several failures are reported by input name
+        self.broken = 2
+        with mock.patch("romanesco.io.local.fetch", self.slowFetch):
+            self.assertRaisesRegexp(
+                Exception, "^Errors in inputs:\nb: b is broken\n"
+                "c: c is broken$", romanesco.run, self.task,
+                copy.deepcopy(self.inputs))
+
+    def test_outputs(self):
+        push = romanesco.io.local.push
+        pushed = []
+
+        def slowPush(data, spec, **kwargs):
+            pushed.append(threading.current_thread().ident)
+            self.enter()
+            push(data, spec, **kwargs)
+
+        outputs = {name: {"format": "csv", "mode": "local",
+                          "path": os.path.join(self.tmp, name + ".out")}
+                   for name in ("e", "f")}
+        self.expect(2)
+        with mock.patch("romanesco.io.local.push", slowPush):
+            romanesco.run(self.task, self.inputs, outputs)
+
+        # The two pushes overlap
+        self.assertEqual(self.maxInFlight, 2)
+        self.assertEqual(len(set(pushed)), 2)
+        with open(os.path.join(self.tmp, "f.out")) as f:
+            self.assertEqual(f.read().splitlines()[1:],
+                             ["0,0", "1,10", "2,20", "3,30"])
+
+    def test_r_tasks(self):
+        # Embedded R is not thread-safe, so R tasks run one at a time even
+        # when their jobs are concurrent
+        robjects = mock.MagicMock()
+        robjects.globalenv = {}
+
+        def reval(script, env):
+            # Give another thread time to call into R as well
+            with self.lock:
+                self.inFlight += 1
+                self.maxInFlight = max(self.maxInFlight, self.inFlight)
+            time.sleep(0.05)
+            with self.lock:
+                self.inFlight -= 1
+        robjects.reval.side_effect = reval
+        rpy2 = mock.MagicMock(robjects=robjects)
+
+        task = {"mode": "r", "script": "", "inputs": [], "outputs": []}
+        modules = {"rpy2": rpy2, "rpy2.robjects": robjects}
+        with mock.patch.dict("sys.modules", modules):
+            threads = [threading.Thread(target=romanesco.run, args=(task, {}))
+                       for i in range(2)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(robjects.reval.call_count, 4)
+        self.assertEqual(self.maxInFlight, 1)
+
+    def test_conversion_processes(self):
+        romanesco.convert_processes = 2
+        try:
+            outputs = romanesco.run(self.task, self.inputs)
+            self.assertIsNotNone(romanesco._pool)
+        finally:
+            romanesco.convert_processes = 0
+            romanesco._closePool()
+        self.assertIsNone(romanesco._pool)
+        self.assertEqual(outputs["f"]["data"]["rows"], [
+            {"x": i, "y": i * 10} for i in range(4)])
+
+    def test_daemon_conversion(self):
+        # Daemonic processes such as celery workers convert in threads
+        romanesco.convert_processes = 2
+        try:
+            with mock.patch("multiprocessing.current_process") as current:
+                current.return_value.daemon = True
+                outputs = romanesco.run(self.task, self.inputs)
+                self.assertIsNone(romanesco._pool)
+                converted = romanesco.convert_many(
+                    "table", [self.inputs["a"]], "rows", pool="process")
+        finally:
+            romanesco.convert_processes = 0
+        self.assertEqual(outputs["f"]["data"]["rows"], [
+            {"x": i, "y": i * 10} for i in range(4)])
+        self.assertNotIn("error", converted[0])
@@ -0,0 +1,228 @@
+import json
+import mock
+import os
+import romanesco
+import shutil
+import tempfile
+import time
+import unittest
+
+
+class TestFormat(unittest.TestCase):
+
+    def tearDown(self):
+        romanesco.format.converters.pop("wrapped", None)
+        romanesco.format.validators.pop("wrapped", None)
+
+    def test_native_builtin(self):
+        validator = romanesco.format.validators["number"]["json"]
+        self.assertEqual(romanesco.format.get_function(validator),
+                         romanesco.format.native.is_text)
+
+        with mock.patch("romanesco.run") as run:
+            self.assertTrue(romanesco.isvalid(
+                "number", {"format": "json", "data": "1"}))
+            output = romanesco.convert(
+                "table", {"format": "csv", "data": "a,b\n1,2\n"},
+                {"format": "rows.json"})
+            self.assertFalse(run.called)
+
+        self.assertEqual(romanesco.convert(
+            "table", output, {"format": "rows"})["data"],
+            {"fields": ["a", "b"], "rows": [{"a": 1, "b": 2}]})
+
+    def test_register(self):
+        romanesco.format.register_validator(
+            "wrapped", "list", lambda x: isinstance(x, list))
+        romanesco.format.register_validator(
+            "wrapped", "text", "romanesco.format.native.is_text")
+        romanesco.format.register_validator(
+            "wrapped", "json", "romanesco.format.native.is_text")
+        romanesco.format.register_converter(
+            "wrapped", "list", "text", lambda x: ",".join(x))
+        romanesco.format.register_converter(
+            "wrapped", "text", "json", "json.dumps")
+
+        self.assertTrue(romanesco.isvalid(
+            "wrapped", {"format": "list", "data": ["a"]}))
+        self.assertFalse(romanesco.isvalid(
+            "wrapped", {"format": "list", "data": "a"}))
+
+        # The two-step path is found through the registered converters
+        output = romanesco.convert(
+            "wrapped", {"format": "list", "data": ["a", "b"]},
+            {"format": "json"})
+        self.assertEqual(output["data"], '"a,b"')
+
+        # Native converters also drive conversion within romanesco.run
+        task = {
+            "inputs": [{"name": "a", "type": "wrapped", "format": "text"}],
+            "outputs": [{"name": "b", "type": "wrapped", "format": "text"}],
+            "script": "b = a.upper()",
+            "mode": "python"
+        }
+        outputs = romanesco.run(
+            task, inputs={"a": {"format": "list", "data": ["x", "y"]}},
+            outputs={"b": {"format": "json"}})
+        self.assertEqual(outputs["b"]["data"], '"X,Y"')
+
+    def test_conversion_path(self):
+        romanesco.format.register_converter(
+            "wrapped", "a", "b", lambda x: x + "b")
+        romanesco.format.register_converter(
+            "wrapped", "b", "c", lambda x: x + "c")
+        direct = romanesco.format.register_converter(
+            "wrapped", "a", "c", lambda x: x + "C")
+        romanesco.format.register_converter(
+            "wrapped", "c", "d", lambda x: x + "d")
+
+        # The direct converter is cheapest by default
+        path = romanesco.format.conversion_path("wrapped", "a", "d")
+        self.assertEqual(len(path), 2)
+        self.assertIs(path[0], direct)
+        self.assertIs(romanesco.format.conversion_path("wrapped", "a", "d"),
+                      path)
+
+        # Measured costs change the plan, but never replace a direct
+        # converter with a chain
+        costs = romanesco.format.conversion_costs
+        costs["wrapped"] = {"a": {"c": 1.0}}
+        try:
+            romanesco.format.load_conversion_costs("no_such_file.json")
+            path = romanesco.format.conversion_path("wrapped", "a", "d")
+            self.assertEqual(len(path), 3)
+            self.assertEqual(romanesco.convert(
+                "wrapped", {"format": "a", "data": ""},
+                {"format": "d"})["data"], "bcd")
+            self.assertEqual(romanesco.format.conversion_path(
+                "wrapped", "a", "c"), [direct])
+        finally:
+            del costs["wrapped"]
+            romanesco.format.load_conversion_costs("no_such_file.json")
+
+        self.assertRaisesRegexp(
+            Exception, "^No conversion path from wrapped:d to wrapped:a.$",
+            romanesco.format.conversion_path, "wrapped", "d", "a")
+
+    def test_direct_converters(self):
+        # Chains through other formats may not give the same data, so the
+        # shipped direct converters are used whatever the measured costs
+        for in_format, out_format, function in [
+                ("csv", "rows", romanesco.format.csv_to_rows),
+                ("tsv", "rows", romanesco.format.csv_to_rows),
+                ("rows", "objectlist",
+                 romanesco.format.tables.rows_to_objectlist)]:
+            path = romanesco.format.conversion_path(
+                "table", in_format, out_format)
+            self.assertEqual(len(path), 1)
+            self.assertIs(romanesco.format.get_function(path[0]), function)
+
+        data = "a,b\n1,\n2,3\n"
+        self.assertEqual(romanesco.convert(
+            "table", {"format": "csv", "data": data},
+            {"format": "rows"})["data"], romanesco.format.csv_to_rows(data))
+
+    def test_benchmark(self):
+        def slow(x):
+            time.sleep(0.01)
+            return x
+
+        romanesco.format.register_converter("wrapped", "a", "b", slow)
+        romanesco.format.register_converter(
+            "wrapped", "b", "c", lambda x: x)
+        romanesco.format.register_converter(
+            "wrapped", "c", "a", lambda x: 1 / 0)
+        try:
+            costs = romanesco.format.benchmark_converters(
+                {"wrapped": ("a", "data")}, repeat=2)["wrapped"]
+            self.assertGreaterEqual(costs["a"]["b"], 0.01)
+            self.assertLess(costs["b"]["c"], 0.01)
+            self.assertNotIn("c", costs)
+        finally:
+            romanesco.format.conversion_costs.pop("wrapped", None)
+
+    def test_snapshot(self):
+        tmp = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmp, "wrapped")
+            os.mkdir(path)
+            for name, spec in [
+                ("validate_text.json", {
+                    "inputs": [{"name": "input", "type": "wrapped",
+                                "format": "text"}],
+                    "outputs": [{"name": "output", "type": "boolean",
+                                 "format": "boolean"}],
+                    "function": "romanesco.format.native.is_text"}),
+                ("validate_upper.json", {
+                    "inputs": [{"name": "input", "type": "wrapped",
+                                "format": "upper"}],
+                    "outputs": [{"name": "output", "type": "boolean",
+                                 "format": "boolean"}],
+                    "function": "romanesco.format.native.is_text"}),
+                ("text_to_upper.json", {
+                    "inputs": [{"name": "input", "type": "wrapped",
+                                "format": "text"}],
+                    "outputs": [{"name": "output", "type": "wrapped",
+                                 "format": "upper"}],
+                    "script": "output = input.upper()",
+                    "mode": "python"})]:
+                with open(os.path.join(path, name), "w") as f:
+                    json.dump(spec, f)
+
+            snapshot = os.path.join(tmp, "registry.snapshot")
+            romanesco.format.import_converters([path], snapshot=snapshot)
+            self.assertTrue(os.path.exists(snapshot))
+            romanesco.format.converters.pop("wrapped")
+            romanesco.format.validators.pop("wrapped")
+
+            # A current snapshot is loaded without reading the json files,
+            # and its scripts are compiled ahead of time
+            python = romanesco.tasks.python
+            python.codeCache.clear()
+            with mock.patch("json.load") as load:
+                romanesco.format.import_converters([path], snapshot=snapshot)
+                self.assertFalse(load.called)
+            self.assertIn(python.scriptKey("output = input.upper()"),
+                          python.precompiled)
+            self.assertEqual(romanesco.convert(
+                "wrapped", {"format": "text", "data": "a"},
+                {"format": "upper"})["data"], "A")
+
+            # Modifying a file invalidates the snapshot
+            filename = os.path.join(path, "text_to_upper.json")
+            mtime = os.stat(filename).st_mtime + 10
+            os.utime(filename, (mtime, mtime))
+            with mock.patch("json.load", side_effect=json.load) as load:
+                romanesco.format.import_converters([path], snapshot=snapshot)
+                self.assertEqual(load.call_count, 3)
+        finally:
+            shutil.rmtree(tmp)
+
+    def test_snapshot_import(self):
+        tmp = tempfile.mkdtemp()
+        converters = romanesco.format.converters
+        validators = romanesco.format.validators
+        try:
+            romanesco.format.converters = {}
+            romanesco.format.validators = {}
+            env = {"ROMANESCO_SNAPSHOT_DIR": tmp}
+            with mock.patch.dict(os.environ, env), \
+                    mock.patch("json.load", side_effect=json.load) as load:
+                romanesco.format.import_default_converters()
+                self.assertGreater(load.call_count, 0)
+                self.assertEqual(len(os.listdir(tmp)), 1)
+
+                # The second import reads the snapshot instead of the files
+                load.reset_mock()
+                romanesco.format.converters = {}
+                romanesco.format.validators = {}
+                romanesco.format.import_default_converters()
+                self.assertEqual(load.call_count, 0)
+
+            self.assertEqual(romanesco.format.converters.keys(),
+                             converters.keys())
+        finally:
+            romanesco.format.converters = converters
+            romanesco.format.validators = validators
+            romanesco.format._paths.clear()
+            shutil.rmtree(tmp)
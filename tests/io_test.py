@@ -1,13 +1,137 @@
+import BaseHTTPServer
+import bson
 import copy
 import httmock
+import mock
 import os
+import random
+import re
 import romanesco
 import shutil
+import SocketServer
+import threading
 import unittest
 
 _tmp = None
 
 
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    # Replies with the queued (status, body) responses, then 200 'ok', and
+    # records the method, path and client port of each request
+    protocol_version = 'HTTP/1.1'
+
+    def _reply(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        self.rfile.read(length)
+        self.server.requests.append(
+            (self.command, self.path, self.client_address[1]))
+        status, body = (self.server.responses.pop(0)
+                        if self.server.responses else (200, 'ok'))
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    do_GET = do_PUT = do_POST = _reply
+
+    def log_message(self, *args):
+        pass
+
+
+class _RangeHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    # Serves server.content with byte ranges if server.ranges is set, failing
+    # the first server.errors range requests and cutting off the next
+    # server.drops range responses halfway through
+    protocol_version = 'HTTP/1.1'
+
+    def do_HEAD(self):
+        self._reply(False)
+
+    def do_GET(self):
+        self._reply(True)
+
+    def _reply(self, body):
+        content = self.server.content
+        match = re.match(r'bytes=(\d+)-(\d+)$', self.headers.get('Range', ''))
+        self.server.requests.append((self.command, self.headers.get('Range')))
+        with self.server.lock:
+            fail = match and body and self.server.errors > 0
+            if fail:
+                self.server.errors -= 1
+        if fail:
+            self.send_response(503)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        if match and self.server.ranges:
+            start, end = int(match.group(1)), int(match.group(2)) + 1
+            data = content[start:end]
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes %d-%d/%d' % (
+                start, end - 1, len(content)))
+        else:
+            data = content
+            self.send_response(200)
+        if self.server.ranges:
+            self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        if not body:
+            return
+        with self.server.lock:
+            drop = match and self.server.drops > 0
+            if drop:
+                self.server.drops -= 1
+        if drop:
+            self.wfile.write(data[:len(data) // 2])
+            self.close_connection = 1
+        else:
+            self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+class _EtagHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    # Serves server.content with the ETag server.etag, answering 304 to a
+    # matching If-None-Match header
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        condition = self.headers.get('If-None-Match')
+        self.server.requests.append((self.path, condition))
+        if condition == self.server.etag:
+            self.send_response(304)
+            self.send_header('ETag', self.server.etag)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('ETag', self.server.etag)
+        self.send_header('Content-Disposition',
+                         'attachment; filename="ref.dat"')
+        self.send_header('Content-Length', str(len(self.server.content)))
+        self.end_headers()
+        self.wfile.write(self.server.content)
+
+    def log_message(self, *args):
+        pass
+
+
+class _Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+def _serve(handler=_Handler):
+    server = _Server(('127.0.0.1', 0), handler)
+    server.requests = []
+    server.responses = []
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server, 'http://127.0.0.1:%d' % server.server_port
+
+
 def setUpModule():
     global _tmp
     _tmp = os.path.join(
@@ -112,3 +236,279 @@ class TestIo(unittest.TestCase):
                 task, inputs=copy.deepcopy(inputs), cleanup=False,
                 validate=False, auto_convert=False)
             self.assertEqual(out['y']['data'], 'dummy file contents_suffix')
+
+    def testMongoClientPool(self):
+        with mock.patch.dict(romanesco.io.mongodb._clients, clear=True), \
+                mock.patch('pymongo.MongoClient') as client:
+            first = romanesco.io.mongodb.getClient('otherhost')
+            self.assertIs(romanesco.io.mongodb.getClient('otherhost'), first)
+            client.assert_called_once_with('otherhost')
+
+    def testMongoIo(self):
+        import pymongo
+        db = pymongo.MongoClient('mongodb://localhost')['test']
+        db['io'].drop()
+        db['io'].insert([{'_id': i, 'x': i} for i in range(5)])
+        spec = {'mode': 'mongodb', 'db': 'test', 'collection': 'io',
+                'batchSize': 2}
+
+        data = romanesco.io.fetch(spec)
+        self.assertEqual(bson.decode_all(data),
+                         [{'_id': i, 'x': i} for i in range(5)])
+        chunks = list(romanesco.io.fetch(
+            spec, task_input={'target': 'stream'}))
+        self.assertEqual([len(bson.decode_all(c)) for c in chunks],
+                         [2, 2, 1])
+        self.assertEqual(''.join(chunks), data)
+
+        def encode(docs):
+            return ''.join(bson.BSON.encode(d) for d in docs)
+
+        def contents():
+            return sorted(db['io'].find(), key=lambda d: d['_id'])
+
+        # Appended and upserted documents are written in chunks
+        romanesco.io.push(encode([{'_id': 5, 'x': 5}]),
+                          dict(spec, writeMode='append'))
+        self.assertEqual(len(contents()), 6)
+        romanesco.io.push(
+            iter([encode([{'_id': 0, 'x': 'new'}, {'_id': 6, 'x': 6}]),
+                  encode([{'x': 7}])]), dict(spec, writeMode='upsert'))
+        docs = contents()
+        self.assertEqual(len(docs), 8)
+        self.assertEqual(docs[0], {'_id': 0, 'x': 'new'})
+        self.assertEqual(docs[1], {'_id': 1, 'x': 1})
+
+        # The default mode replaces the collection once all are written
+        romanesco.io.push(encode([{'_id': 'a'}, {'_id': 'b'}, {'_id': 'c'}]),
+                          spec)
+        self.assertEqual(contents(), [{'_id': 'a'}, {'_id': 'b'},
+                                      {'_id': 'c'}])
+        self.assertEqual(sorted(name for name in db.collection_names()
+                                if name.startswith('io')), ['io'])
+        with self.assertRaisesRegexp(Exception, 'Incomplete BSON'):
+            romanesco.io.push(encode([{'_id': 'd'}])[:-1], spec)
+        self.assertEqual(len(contents()), 3)
+
+        romanesco.io.push('', spec)
+        self.assertEqual(contents(), [])
+        with self.assertRaisesRegexp(Exception, 'Invalid MongoDB write'):
+            romanesco.io.push('', dict(spec, writeMode='drop'))
+
+    def testMongoSelection(self):
+        import pymongo
+        db = pymongo.MongoClient('mongodb://localhost')['test']
+        db['select'].drop()
+        db['select'].insert([{'_id': i, 'x': i, 'y': i % 2, 'z': 'z'}
+                             for i in range(10)])
+        spec = {'mode': 'mongodb', 'db': 'test', 'collection': 'select',
+                'query': {'y': 1}, 'fields': ['x', 'z'], 'limit': 3}
+        self.assertEqual(bson.decode_all(romanesco.io.fetch(spec)), [
+            {'x': 1, 'z': 'z'}, {'x': 3, 'z': 'z'}, {'x': 5, 'z': 'z'}])
+
+        spec = {'mode': 'mongodb', 'db': 'test', 'collection': 'select',
+                'filter': {'x': {'$gte': 8}}, 'columns': ['_id']}
+        self.assertEqual(bson.decode_all(romanesco.io.fetch(spec)),
+                         [{'_id': 8}, {'_id': 9}])
+
+    def testDelimitedSelection(self):
+        path = os.path.join(_tmp, 'select.csv')
+        if not os.path.isdir(_tmp):
+            os.makedirs(_tmp)
+        with open(path, 'w') as f:
+            f.write('a,b,c\n')
+            for i in range(100000):
+                f.write('%d,"x, %d",%d\n' % (i, i, i % 3))
+        spec = {'mode': 'local', 'path': path, 'format': 'csv',
+                'columns': ['c', 'b'], 'query': {'c': 2}, 'limit': 3}
+        self.assertEqual(romanesco.io.fetch(spec),
+                         'c,b\n2,"x, 2"\n2,"x, 5"\n2,"x, 8"\n')
+
+        # Selected bindings are parsed like any other
+        task = {
+            'mode': 'python',
+            'script': 'y = len(x["rows"])',
+            'inputs': [{'name': 'x', 'type': 'table', 'format': 'rows'}],
+            'outputs': [{'name': 'y', 'type': 'number', 'format': 'number'}]
+        }
+        out = romanesco.run(task, inputs={'x': dict(
+            spec, query={'b': 'x, 7'}, limit=None)})
+        self.assertEqual(out['y']['data'], 1)
+
+        # Streamed inputs are selected from as they are read
+        @httmock.all_requests
+        def fetchMock(url, request):
+            return {'status_code': 200,
+                    'content': ('a\tb\n' + '1\t2\n' * 50000)}
+
+        with httmock.HTTMock(fetchMock):
+            stream = romanesco.io.fetch(
+                {'mode': 'http', 'url': 'https://foo.com/t.tsv',
+                 'format': 'tsv', 'fields': ['b'], 'limit': 2},
+                task_input={'target': 'stream'})
+            self.assertEqual(''.join(stream), 'b\n2\n2\n')
+
+        with self.assertRaisesRegexp(Exception, 'Unknown column: d'):
+            romanesco.io.fetch(dict(spec, columns=['d']))
+
+    def testHttpSessionPool(self):
+        pool = romanesco.utils.sessionPool
+        self.assertIs(pool.session('https://a.com/x'),
+                      pool.session('https://A.com/y?z=1'))
+        self.assertIsNot(pool.session('https://a.com/x'),
+                         pool.session('http://a.com/x'))
+        self.assertIsNot(pool.session('https://a.com/x'),
+                         pool.session('https://b.com/x'))
+
+        server, url = _serve()
+        romanesco.config.set('romanesco', 'http_backoff', '0')
+        pool.clear()
+        try:
+            # Idempotent requests are retried, over the same connection
+            server.responses = [(503, 'busy'), (502, 'busy')]
+            self.assertEqual(romanesco.io.fetch(
+                {'mode': 'http', 'url': url + '/a'}), 'ok')
+            self.assertEqual(romanesco.io.fetch(
+                {'mode': 'http', 'url': url + '/b'}), 'ok')
+            self.assertEqual([r[:2] for r in server.requests],
+                             [('GET', '/a')] * 3 + [('GET', '/b')])
+            self.assertEqual(len(set(r[2] for r in server.requests)), 1)
+
+            # Others are not
+            server.requests = []
+            server.responses = [(503, 'busy')]
+            with self.assertRaises(Exception):
+                romanesco.io.push('x', {'mode': 'http', 'url': url + '/c'})
+            self.assertEqual(len(server.requests), 1)
+
+            # Job updates share the session
+            server.requests = []
+            with romanesco.utils.JobManager(False, url + '/job') as job:
+                job.write('log', forceFlush=True)
+            self.assertEqual([r[:2] for r in server.requests],
+                             [('PUT', '/job')] * 3)
+            self.assertIs(pool.session(url), pool.session(url + '/job'))
+        finally:
+            romanesco.config.remove_option('romanesco', 'http_backoff')
+            pool.clear()
+            server.shutdown()
+
+    def testHttpParallelFetch(self):
+        server, url = _serve(_RangeHandler)
+        server.content = ''.join(chr(random.randrange(256))
+                                 for i in xrange(300001))
+        server.ranges = True
+        server.drops = 2
+        server.errors = 0
+        server.lock = threading.Lock()
+        romanesco.config.set('romanesco', 'http_backoff', '0')
+        task = {
+            'mode': 'python',
+            'script': 'y = open(x, "rb").read()',
+            'inputs': [{'name': 'x', 'type': 'string', 'format': 'text',
+                        'target': 'filepath'}],
+            'outputs': [{'name': 'y', 'type': 'string', 'format': 'text'}]
+        }
+        spec = {'mode': 'http', 'url': url + '/data.nc', 'parallel': 4}
+        try:
+            out = romanesco.run(task, inputs={'x': dict(spec)},
+                                validate=False, auto_convert=False)
+            self.assertEqual(out['y']['data'], server.content)
+            ranges = [r[1] for r in server.requests if r[0] == 'GET']
+            self.assertEqual(server.requests[0], ('HEAD', None))
+            for r in ['bytes=0-75000', 'bytes=75001-150001',
+                      'bytes=150002-225002', 'bytes=225003-300000']:
+                self.assertIn(r, ranges)
+
+            # Cut off ranges were resumed where they stopped
+            self.assertEqual(len(ranges), 6)
+            self.assertEqual(server.drops, 0)
+
+            with self.assertRaisesRegexp(Exception, 'max download size'):
+                romanesco.run(
+                    task, inputs={'x': dict(spec, maxSize=300000)},
+                    validate=False, auto_convert=False)
+
+            # Without range support the file is fetched in one request
+            server.requests = []
+            server.ranges = False
+            out = romanesco.run(task, inputs={'x': dict(spec)},
+                                validate=False, auto_convert=False)
+            self.assertEqual(out['y']['data'], server.content)
+            self.assertEqual(server.requests, [('HEAD', None), ('GET', None)])
+
+            # Failing ranges are requested http_retries more times in all,
+            # not retried again by the session
+            romanesco.config.set('romanesco', 'http_retries', '2')
+            server.requests = []
+            server.ranges = True
+            server.errors = 100
+            with self.assertRaisesRegexp(IOError, 'HTTP status 503'):
+                romanesco.run(task, inputs={'x': dict(spec)},
+                              validate=False, auto_convert=False)
+            ranges = [r for r in server.requests if r[0] == 'GET']
+            self.assertEqual(len(ranges), 12)
+        finally:
+            romanesco.config.remove_option('romanesco', 'http_backoff')
+            romanesco.config.remove_option('romanesco', 'http_retries')
+            server.shutdown()
+
+    def testHttpCache(self):
+        server, url = _serve(_EtagHandler)
+        server.content = 'reference data' * 1000
+        server.etag = '"v1"'
+        cache = romanesco.cache.HttpCache(
+            diskBytes=40000, diskRoot=os.path.join(_tmp, 'http_cache'))
+        spec = {'mode': 'http', 'url': url + '/ref', 'headers': {'a': 'b'}}
+        try:
+            with mock.patch('romanesco.http_cache', cache):
+                self.assertEqual(romanesco.io.fetch(spec), server.content)
+                self.assertEqual(cache.stats()['misses'], 1)
+
+                # Unmodified responses are read from the cache
+                self.assertEqual(romanesco.io.fetch(spec), server.content)
+                path = romanesco.io.fetch(
+                    spec, task_input={'target': 'filepath'},
+                    _tmp_dir=_tmp)
+                self.assertEqual(os.path.basename(path), 'ref.dat')
+                with open(path, 'rb') as f:
+                    self.assertEqual(f.read(), server.content)
+                self.assertEqual(server.requests, [
+                    ('/ref', None), ('/ref', '"v1"'), ('/ref', '"v1"')])
+                self.assertEqual(cache.stats()['hits'], 2)
+
+                # Modified responses replace the entry
+                server.content = 'new data'
+                server.etag = '"v2"'
+                self.assertEqual(romanesco.io.fetch(spec), 'new data')
+                self.assertEqual(''.join(romanesco.io.fetch(
+                    spec, task_input={'target': 'stream'})), 'new data')
+                self.assertEqual(server.requests[-1], ('/ref', '"v2"'))
+
+                # Other headers and opted out bindings have separate entries
+                server.requests = []
+                romanesco.io.fetch(dict(spec, headers={'a': 'c'}))
+                romanesco.io.fetch(dict(spec, cache=False))
+                self.assertEqual(server.requests, [('/ref', None)] * 2)
+
+                # The least recently used entries are evicted
+                server.content = 'x' * 15000
+                for name in ('/1', '/2', '/3'):
+                    romanesco.io.fetch(dict(spec, url=url + name))
+                self.assertLessEqual(cache.stats()['bytes'], 40000)
+                server.requests = []
+                romanesco.io.fetch(dict(spec, url=url + '/3'))
+                romanesco.io.fetch(dict(spec, url=url + '/1'))
+                self.assertEqual(server.requests,
+                                 [('/3', '"v2"'), ('/1', None)])
+
+                # Bodies that are not read to the end are not cached
+                cache.clear()
+                stream = romanesco.io.fetch(
+                    spec, task_input={'target': 'stream'})
+                next(stream)
+                stream.close()
+                self.assertEqual(cache.stats()['bytes'], 0)
+                self.assertEqual(os.listdir(cache.diskRoot), ['.lock'])
+        finally:
+            server.shutdown()
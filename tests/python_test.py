@@ -0,0 +1,61 @@
+import romanesco
+import sys
+import traceback
+import unittest
+
+from romanesco.tasks import python
+
+
+class TestPythonMode(unittest.TestCase):
+
+    def setUp(self):
+        self.task = {
+            "inputs": [{"name": "a", "type": "number", "format": "number"}],
+            "outputs": [{"name": "b", "type": "number", "format": "number"}],
+            "script": "b = a * 2",
+            "mode": "python"
+        }
+        python.codeCache.clear()
+
+    def test_code_cache(self):
+        for i in range(3):
+            outputs = romanesco.run(
+                self.task, inputs={"a": {"format": "number", "data": i}},
+                validate=False, auto_convert=False)
+            self.assertEqual(outputs["b"]["data"], i * 2)
+
+        self.assertEqual(python.codeCache.misses, 1)
+        self.assertEqual(python.codeCache.hits, 2)
+        self.assertEqual(len(python.codeCache), 1)
+
+        # Equal scripts share a compiled code object
+        self.assertIs(python.compileScript("b = a * 2"),
+                      python.compileScript(u"b = a * 2"))
+
+    def test_code_cache_eviction(self):
+        python.codeCache.maxSize = 2
+        try:
+            first = python.compileScript("x = 1")
+            python.compileScript("x = 2")
+            python.compileScript("x = 3")
+            self.assertEqual(len(python.codeCache), 2)
+            self.assertIsNot(python.compileScript("x = 1"), first)
+        finally:
+            python.codeCache.maxSize = 1024
+
+    def test_error_line_numbers(self):
+        self.task["script"] = "c = 1\nb = a / 0"
+
+        for i in range(2):
+            try:
+                romanesco.run(
+                    self.task, inputs={"a": {"format": "number", "data": 1}},
+                    validate=False, auto_convert=False)
+            except Exception as e:
+                self.assertIn("2: b = a / 0", str(e))
+                frame = traceback.extract_tb(sys.exc_info()[2])
+                self.assertEqual(frame[-1][:2], ("<string>", 2))
+            else:
+                self.fail("Expected a ZeroDivisionError")
+
+        self.assertEqual(python.codeCache.hits, 1)
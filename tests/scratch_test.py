@@ -0,0 +1,126 @@
+import httmock
+import mock
+import os
+import romanesco
+import shutil
+import unittest
+
+from romanesco.utils import scratchManager
+
+_tmp = None
+
+
+def setUpModule():
+    global _tmp
+    _tmp = os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), 'tmp', 'scratch')
+    romanesco.config.set('romanesco', 'tmp_root', _tmp)
+
+
+def tearDownModule():
+    scratchManager.flush()
+    if os.path.isdir(_tmp):
+        shutil.rmtree(_tmp)
+
+
+class TestScratch(unittest.TestCase):
+    def setUp(self):
+        scratchManager.flush()
+        if os.path.isdir(_tmp):
+            shutil.rmtree(_tmp)
+        scratchManager._pool.clear()
+        scratchManager._usage.clear()
+        scratchManager._sizes.clear()
+        scratchManager.scanInterval = 60
+
+        self.task = {
+            'mode': 'python',
+            'script': 'y = len(open(x).read())',
+            'inputs': [{
+                'id': 'x',
+                'format': 'string',
+                'type': 'string',
+                'target': 'filepath'
+            }],
+            'outputs': [{
+                'id': 'y',
+                'format': 'number',
+                'type': 'number'
+            }]
+        }
+
+    def tearDown(self):
+        if romanesco.config.has_option('romanesco', 'tmp_quota'):
+            romanesco.config.remove_option('romanesco', 'tmp_quota')
+
+    def _run(self):
+        @httmock.all_requests
+        def fetchMock(url, request):
+            return 'dummy file contents'
+
+        with httmock.HTTMock(fetchMock):
+            return romanesco.run(self.task, inputs={
+                'x': {'mode': 'http', 'url': 'https://foo.com/file.txt'}
+            }, validate=False, auto_convert=False)
+
+    def testLazyCreation(self):
+        romanesco.run({
+            'inputs': [{'id': 'a', 'type': 'number', 'format': 'number'}],
+            'outputs': [{'id': 'b', 'type': 'number', 'format': 'number'}],
+            'script': 'b = a'
+        }, inputs={'a': {'format': 'json', 'data': '1'}},
+            outputs={'b': {'format': 'json'}})
+        self.assertFalse(os.path.exists(_tmp))
+
+    def testPooling(self):
+        self.assertEqual(self._run()['y']['data'], 19)
+        scratchManager.flush()
+
+        # The directory was emptied and returned to the pool
+        dirs = os.listdir(_tmp)
+        self.assertEqual(len(dirs), 1)
+        self.assertEqual(os.listdir(os.path.join(_tmp, dirs[0])), [])
+        self.assertEqual(scratchManager._pool[_tmp],
+                         [os.path.join(_tmp, dirs[0])])
+
+        self.assertEqual(self._run()['y']['data'], 19)
+        scratchManager.flush()
+        self.assertEqual(os.listdir(_tmp), dirs)
+
+    def testQuota(self):
+        romanesco.config.set('romanesco', 'tmp_quota', '10')
+        self.assertEqual(self._run()['y']['data'], 19)
+
+        scratch = scratchManager.acquire(cleanup=False)
+        with open(os.path.join(scratch.path, 'big'), 'w') as f:
+            f.write('x' * 100)
+        scratch.release()
+
+        self.assertRaisesRegexp(
+            Exception, '^Scratch space quota of 10 bytes', self._run)
+
+    def testQuotaRescan(self):
+        romanesco.config.set('romanesco', 'tmp_quota', '10')
+        self.assertEqual(self._run()['y']['data'], 19)
+
+        # Files appearing behind the manager's back are only seen once the
+        # running count is re-scanned
+        with open(os.path.join(_tmp, 'other'), 'w') as f:
+            f.write('x' * 100)
+        self.assertEqual(self._run()['y']['data'], 19)
+
+        scratchManager.scanInterval = 0
+        self.assertRaisesRegexp(
+            Exception, '^Scratch space quota of 10 bytes', self._run)
+
+    def testQuotaIgnoresCaches(self):
+        romanesco.config.set('romanesco', 'tmp_quota', '10')
+        cacheDir = os.path.join(_tmp, 'conversion_cache')
+        os.makedirs(cacheDir)
+        with open(os.path.join(cacheDir, 'entry'), 'w') as f:
+            f.write('x' * 100)
+
+        with mock.patch.object(
+                romanesco.conversion_cache, 'diskRoot', cacheDir):
+            self.assertEqual(scratchManager.usage(_tmp), 0)
+            self.assertEqual(self._run()['y']['data'], 19)
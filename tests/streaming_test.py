@@ -0,0 +1,127 @@
+import os
+import romanesco
+import shutil
+import tempfile
+import unittest
+
+from romanesco.format import streams
+
+_data = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+
+
+def _blocks(data, size):
+    return (data[i:i + size] for i in xrange(0, len(data), size))
+
+
+class TestStreaming(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_csv_to_rows(self):
+        # Chunked parsing matches csv_to_rows for every block size
+        for name in ("test.csv", "flu.csv", "mammal_lnMass_tiny.csv"):
+            with open(os.path.join(_data, name)) as f:
+                csv = f.read()
+            expected = romanesco.format.csv_to_rows(csv)
+            for size in (7, 4096, len(csv)):
+                output = romanesco.convert_stream(
+                    "table", {"format": "csv", "data": _blocks(csv, size)},
+                    {"format": "rows"}, chunk_size=50)
+                chunks = list(output["data"])
+                self.assertTrue(all(len(c["rows"]) <= 50 for c in chunks))
+                self.assertEqual(chunks[0]["fields"], expected["fields"])
+                self.assertEqual(
+                    [row for c in chunks for row in c["rows"]],
+                    expected["rows"])
+
+    def test_empty(self):
+        output = romanesco.convert_stream(
+            "table", {"format": "csv", "data": "a,b\n"}, {"format": "rows"})
+        self.assertEqual(list(output["data"]),
+                         [{"fields": ["a", "b"], "rows": []}])
+
+    def test_roundtrip(self):
+        rows = {"fields": ["a", "b"],
+                "rows": [{"a": i, "b": "x%d" % i} for i in range(25)]}
+        output = romanesco.convert_stream(
+            "table", {"format": "rows", "data": rows}, {"format": "tsv"},
+            chunk_size=10)
+        chunks = list(output["data"])
+        self.assertEqual(len(chunks), 3)
+        tsv = "".join(chunks)
+        self.assertEqual(tsv, romanesco.convert(
+            "table", {"format": "rows", "data": rows},
+            {"format": "tsv"})["data"])
+
+        output = romanesco.convert_stream(
+            "table", {"format": "tsv", "data": tsv}, {"format": "objectlist"},
+            chunk_size=10)
+        self.assertEqual([row for c in output["data"] for row in c],
+                         [{"a": i, "b": "x%d" % i} for i in range(25)])
+
+    def test_late_fields(self):
+        # The header is already out when a later chunk adds a field
+        objects = [{"a": 1}, {"a": 2}, {"a": 3, "b": 4}]
+        output = romanesco.convert_stream(
+            "table", {"format": "objectlist", "data": objects},
+            {"format": "csv"}, chunk_size=2)
+        chunks = output["data"]
+        self.assertEqual(next(chunks), "a\r\n1\r\n2\r\n")
+        self.assertRaisesRegexp(
+            Exception, "^Fields 'b' first appear after the header",
+            next, chunks)
+
+    def test_file_to_file(self):
+        source = os.path.join(self.tmp, "in.jsonlines")
+        with open(source, "w") as f:
+            for i in range(1000):
+                f.write('{"a": %d, "b": {"c": "%d"}}\n' % (i, i))
+
+        # Each stage consumes its input lazily, a chunk at a time
+        target = os.path.join(self.tmp, "out.csv")
+        read = []
+        original = streams.jsonlines_to_objectlist
+
+        def counting(chunks, chunk_size):
+            for chunk in original(chunks, chunk_size):
+                read.append(len(chunk))
+                yield chunk
+
+        streams.register_stream_converter(
+            "table", "jsonlines", "objectlist", counting)
+        try:
+            romanesco.convert_stream(
+                "table", {"format": "jsonlines", "url": "file://" + source},
+                {"format": "csv", "mode": "local", "path": target},
+                chunk_size=100)
+        finally:
+            streams.register_stream_converter(
+                "table", "jsonlines", "objectlist", original)
+        self.assertEqual(read, [100] * 10)
+
+        with open(target) as f:
+            output = romanesco.format.csv_to_rows(f.read())
+        self.assertEqual(output["fields"], ["a", "b.c"])
+        self.assertEqual(output["rows"][999], {"a": 999, "b.c": 999})
+
+        # And back to jsonlines
+        target2 = os.path.join(self.tmp, "out.jsonlines")
+        romanesco.convert_stream(
+            "table", {"format": "csv", "url": "file://" + target},
+            {"format": "jsonlines", "mode": "local", "path": target2})
+        with open(target2) as f:
+            lines = f.read().splitlines()
+        self.assertEqual(len(lines), 1000)
+        self.assertEqual(romanesco.convert(
+            "table", {"format": "jsonlines", "data": lines[5]},
+            {"format": "objectlist"})["data"], [{"a": 5, "b": {"c": 5}}])
+
+    def test_no_path(self):
+        self.assertRaisesRegexp(
+            Exception, "^No stream conversion path from table:csv to "
+            "table:vtktable.$", romanesco.convert_stream, "table",
+            {"format": "csv", "data": "a\n1\n"}, {"format": "vtktable"})
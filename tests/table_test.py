@@ -199,6 +199,35 @@ class TestTable(unittest.TestCase):
         self.assertEqual(t.GetValueByName(0, "bb"), 2)
         self.assertEqual(t.GetValueByName(1, "bb"), 4)
 
+    def test_vtktable_arrays(self):
+        rows = {
+            "fields": ["a", "b", "c", "d"],
+            "rows": [{"a": i, "b": [i, -i], "c": "x%d" % i, "d": u"\xe9"}
+                     for i in range(1000)]
+        }
+        rows["rows"][5] = {"a": 5, "c": "x5"}
+        t = romanesco.convert("table", {"format": "rows", "data": rows},
+                              {"format": "vtktable"})["data"]
+        self.assertEqual(t.GetNumberOfRows(), 1000)
+        self.assertTrue(isinstance(t.GetColumnByName("d"),
+                                   vtk.vtkUnicodeStringArray))
+        self.assertEqual(t.GetColumnByName("b").GetNumberOfComponents(), 2)
+
+        output = romanesco.convert("table", {"format": "vtktable", "data": t},
+                                   {"format": "rows"})["data"]
+        self.assertEqual(output["fields"], rows["fields"])
+        self.assertEqual(output["rows"][7], {
+            "a": 7.0, "b": [7.0, -7.0], "c": "x7", "d": "\xc3\xa9"})
+
+        # Missing values are empty strings or NaN
+        self.assertEqual(output["rows"][5]["d"], "")
+        self.assertTrue(all(math.isnan(v) for v in output["rows"][5]["b"]))
+
+        rows["rows"][5]["e"] = 1
+        self.assertRaisesRegexp(
+            Exception, "Unexpected key: e", romanesco.convert, "table",
+            {"format": "rows", "data": rows}, {"format": "vtktable"})
+
     def test_mongo_to_python(self):
         outputs = romanesco.run(
             self.analysis,
@@ -424,6 +453,22 @@ class TestTable(unittest.TestCase):
                     self.assertFalse(math.isnan(row[field]))
                     self.assertFalse(math.isinf(row[field]))
 
+    def test_csv_types(self):
+        output = romanesco.format.csv_to_rows(
+            'a,b,c,d\n1,2.5,x,nan\n+ 2,-inf,3,\n"4","1\n2",1e3,0.5\n5\n')
+        self.assertEqual(output["fields"], ["a", "b", "c", "d"])
+        self.assertEqual(output["rows"], [
+            {"a": 1, "b": 2.5, "c": "x", "d": "nan"},
+            {"a": 2, "b": "-inf", "c": 3, "d": ""},
+            {"a": 4, "b": "1\n2", "c": 1000.0, "d": 0.5},
+            {"a": 5, "b": None, "c": None, "d": None}
+        ])
+        self.assertIsInstance(output["rows"][0]["a"], int)
+
+        # Extra values are kept under the None key like csv.DictReader
+        output = romanesco.format.csv_to_rows("a\n1,2,3\n")
+        self.assertEqual(output["rows"], [{"a": 1, None: ["2", "3"]}])
+
     def test_vector(self):
         rows = {
             "fields": ["a", "b"],
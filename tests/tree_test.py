@@ -1,7 +1,53 @@
 import bson
+import mock
 import os
 import romanesco
+import tempfile
 import unittest
+from StringIO import StringIO
+
+from romanesco.format.trees import walk
+
+
+def ladder_tree(tips):
+    """
+    A nested tree in which every internal node has one tip and one internal
+    child, so its depth is the number of tips.
+    """
+    root = node = {"node_fields": ["node name", "node weight"],
+                   "edge_fields": ["weight"],
+                   "node_data": {"node name": "", "node weight": 0.0}}
+    for i in xrange(tips - 1):
+        tip = {"node_data": {"node name": "t%d" % i, "node weight": i + 1.0},
+               "edge_data": {"weight": 1.0}}
+        inner = {"node_data": {"node name": "", "node weight": i + 1.0},
+                 "edge_data": {"weight": 1.0}}
+        node["children"] = [tip, inner]
+        node = inner
+    node["node_data"]["node name"] = "t%d" % (tips - 1)
+    return root
+
+
+def balanced_tree(nodes):
+    """
+    A nested binary tree with the given number of nodes in breadth-first
+    order.
+    """
+    tree = [{"node_data": {"node name": "n%d" % i, "node weight": i * 0.5},
+             "edge_data": {"weight": 0.5}} for i in xrange(nodes)]
+    for i in xrange(1, nodes):
+        tree[(i - 1) // 2].setdefault("children", []).append(tree[i])
+    root = tree[0]
+    del root["edge_data"]
+    root["node_fields"] = ["node name", "node weight"]
+    root["edge_fields"] = ["weight"]
+    return root
+
+
+def flatten(tree):
+    # Compare trees without recursing through them
+    return [(node["node_data"], node.get("edge_data"),
+             len(node.get("children", []))) for parent, node in walk(tree)]
 
 
 class TestTree(unittest.TestCase):
@@ -196,3 +242,193 @@ END;"""
         self.assertEqual(allogus["branch_length"], 1)
         self.assertEqual(rubribarbus["name"], "rubribarbus")
         self.assertEqual(rubribarbus["branch_length"], 3)
+
+    def test_large_trees(self):
+        for tree in (ladder_tree(50001), balanced_tree(100001)):
+            expected = flatten(tree)
+            self.assertEqual(len(expected), 100001)
+
+            vtktree = romanesco.convert(
+                "tree", {"format": "nested", "data": tree},
+                {"format": "vtktree"})["data"]
+            self.assertEqual(vtktree.GetNumberOfVertices(), 100001)
+            output = romanesco.convert(
+                "tree", {"format": "vtktree", "data": vtktree},
+                {"format": "nested"})["data"]
+            self.assertEqual(output["node_fields"], tree["node_fields"])
+            self.assertEqual(flatten(output), expected)
+
+            text = romanesco.convert(
+                "tree", {"format": "nested", "data": tree},
+                {"format": "nested.json"})["data"]
+            output = romanesco.convert(
+                "tree", {"format": "nested.json", "data": text},
+                {"format": "nested"})["data"]
+            self.assertEqual(flatten(output), expected)
+
+    def test_nested_json(self):
+        tree = balanced_tree(10)
+        text = romanesco.format.trees.nested_to_nested_json(tree)
+        self.assertEqual(text, bson.json_util.dumps(tree))
+        self.assertEqual(romanesco.format.trees.loads(text),
+                         bson.json_util.loads(text))
+        self.assertEqual(romanesco.format.trees.loads(
+            ' [1, -2.5e3, "\\u00e9", {"a": [true, false, null]}, {}, []] '),
+            [1, -2500.0, u"\u00e9", {"a": [True, False, None]}, {}, []])
+        self.assertRaisesRegexp(ValueError, "Expecting , delimiter: char 3",
+                                romanesco.format.trees.loads, "[1 2]")
+
+    def test_newick_parser(self):
+        parse = romanesco.format.newick.parse_newick
+        self.assertEqual(parse("((a,b)x,'c d':1[comment])r;"), (
+            [-1, 0, 1, 1, 0], ["r", "x", "a", "b", "c d"],
+            [None, None, None, None, 1.0]))
+        self.assertEqual(parse("('it''s':2.5e-3, b);"), (
+            [-1, 0, 0], ["", "it's", "b"], [None, 0.0025, None]))
+        for text in ("((a,b);", "(a,b));", "(a b);", "(a:x);", "(a,b)c,d;",
+                     "'a", ""):
+            self.assertRaises(ValueError, parse, text)
+
+        # Without any lengths there are no weights, as with VTK
+        output = romanesco.convert(
+            "tree", {"format": "newick", "data": "((a,b)x,c)r;"},
+            {"format": "nested"})["data"]
+        self.assertEqual(output["node_fields"], ["node name"])
+        self.assertEqual(output["edge_fields"], [])
+        self.assertEqual(output["children"][1],
+                         {"node_data": {"node name": "c"}, "edge_data": {}})
+        self.assertEqual(romanesco.convert(
+            "tree", {"format": "nested", "data": output},
+            {"format": "newick"})["data"], "((a,b)x,c)r;")
+
+        tree = ladder_tree(50001)
+        newick = romanesco.format.newick.nested_to_newick(tree)
+        self.assertEqual(flatten(romanesco.format.newick.newick_to_nested(
+            newick)), flatten(tree))
+
+    def test_nexus(self):
+        output = romanesco.convert(
+            "tree", {"format": "nexus", "data": self.nexus},
+            {"format": "newick"})["data"]
+        self.assertEqual(output, "((A:1,B:1):1,(C:1,D:1):1);")
+
+        # Skip the comment on line 2 and ignore spaces vs. tabs
+        output = romanesco.convert(
+            "tree", {"format": "newick", "data": output},
+            {"format": "nexus"})["data"]
+        self.assertEqual(" ".join(output.split("\n", 2)[2].split()),
+                         " ".join(self.nexus.split("\n", 2)[2].split()))
+        self.assertRaises(ValueError, romanesco.format.newick.parse_nexus,
+                          self.newick)
+
+    def test_phyloxml(self):
+        phyloxml = """<?xml version="1.0" encoding="UTF-8"?>
+<phyloxml xmlns="http://www.phyloxml.org">
+  <phylogeny rooted="true">
+    <name>example</name>
+    <clade>
+      <clade branch_length="0.06">
+        <confidence type="bootstrap">89</confidence>
+        <clade>
+          <name>A</name>
+          <branch_length>0.102</branch_length>
+          <taxonomy><code>OCTVU</code></taxonomy>
+        </clade>
+        <clade><name>B</name><branch_length>0.23</branch_length></clade>
+      </clade>
+      <clade><name>C</name><color><red>255</red></color></clade>
+    </clade>
+  </phylogeny>
+</phyloxml>"""
+        output = romanesco.convert(
+            "tree", {"format": "phyloxml", "data": phyloxml},
+            {"format": "treestore"})["data"]
+        self.assertEqual(bson.decode_all(output), [
+            {"_id": 0, "name": "A", "branch_length": 0.102,
+             "taxonomies": [{"code": "OCTVU"}]},
+            {"_id": 1, "name": "B", "branch_length": 0.23},
+            {"_id": 2, "branch_length": 0.06, "clades": [0, 1],
+             "confidences": [{"type": "bootstrap", "value": 89.0}]},
+            {"_id": 3, "name": "C", "color": {"red": 255}},
+            {"_id": 4, "clades": [2, 3]},
+            {"_id": 5, "rooted": True, "clades": [4], "name": "example"}])
+
+        class Collection(object):
+            batches = []
+
+            def insert(self, docs):
+                self.batches.append(docs)
+
+        collection = Collection()
+        handle = romanesco.format.phyloxml.insert_treestore(
+            StringIO(phyloxml), collection, batch_size=4)
+        self.assertEqual(handle, 5)
+        self.assertEqual([len(b) for b in collection.batches], [4, 2])
+
+    def test_multi(self):
+        trees = ["((a:1,b:2)x:0.5,'c d':3);", "(a,(b,c));", "((b,a),c);"]
+        text = "\n".join(trees) + "\n"
+        analysis = {
+            "name": "count_trees",
+            "inputs": [{"name": "a", "type": "tree",
+                        "format": "nested_multi"}],
+            "outputs": [{"name": "b", "type": "number", "format": "number"}],
+            "script": ("import types\n"
+                       "assert isinstance(a, types.GeneratorType)\n"
+                       "b = sum(1 for tree in a)")
+        }
+        outputs = romanesco.run(
+            analysis, inputs={"a": {"format": "newick_multi", "data": text}})
+        self.assertEqual(outputs["b"]["data"], 3)
+
+        # Files are read as a stream, also when inputs are validated
+        chunks = {
+            "name": "count_chunks",
+            "inputs": [{"name": "a", "type": "tree",
+                        "format": "newick_multi"}],
+            "outputs": [{"name": "b", "type": "number", "format": "number"}],
+            "script": ("assert not isinstance(a, basestring)\n"
+                       "b = \"\".join(a).count(\";\")")
+        }
+        with tempfile.NamedTemporaryFile(suffix=".phy") as f:
+            f.write(text)
+            f.flush()
+            for task in (analysis, chunks):
+                with mock.patch("romanesco.io.fetch",
+                                side_effect=romanesco.io.fetch) as fetch:
+                    outputs = romanesco.run(task, inputs={"a": {
+                        "format": "newick_multi", "url": "file://" + f.name}})
+                self.assertEqual(outputs["b"]["data"], 3)
+                self.assertEqual(fetch.call_count, 1)
+                self.assertEqual(fetch.call_args[1]["task_input"],
+                                 {"target": "stream"})
+
+        # Validators look only at the start of tree set text
+        nexus = "#NEXUS\nBEGIN TREES;\n" + "[x]" * 10 ** 6
+        self.assertTrue(romanesco.isvalid(
+            "tree", {"format": "nexus_multi", "data": nexus}))
+        self.assertFalse(romanesco.isvalid(
+            "tree", {"format": "newick_multi", "data": nexus}))
+        self.assertFalse(romanesco.isvalid(
+            "tree", {"format": "nexus_multi", "data": text}))
+
+        # Chunks may split tokens anywhere
+        chunks = iter(text[i:i + 1] for i in xrange(len(text)))
+        output = romanesco.convert(
+            "tree", {"format": "newick_multi", "data": chunks},
+            {"format": "nested_multi"})["data"]
+        nested = [romanesco.format.newick.newick_to_nested(t) for t in trees]
+        self.assertEqual(list(output), nested)
+
+        output = romanesco.convert(
+            "tree", {"format": "nested_multi", "data": iter(nested)},
+            {"format": "newick_multi"})["data"]
+        self.assertEqual("".join(output), text)
+
+        nexus = romanesco.convert(
+            "tree", {"format": "nested_multi", "data": iter(nested)},
+            {"format": "nexus_multi"})["data"]
+        output = romanesco.convert(
+            "tree", {"format": "nexus_multi", "data": nexus},
+            {"format": "nested_multi"})["data"]
+        self.assertEqual(list(output), nested)
@@ -0,0 +1,120 @@
+import math
+import numpy
+import romanesco
+import unittest
+
+from romanesco.format import apetrees, treearrays
+from tests.tree_test import flatten, ladder_tree
+
+
+class TestTreeArrays(unittest.TestCase):
+
+    def setUp(self):
+        self.newick = "((ahli:0,allogus:1):2,rubribarbus:3);"
+
+    def convert(self, input, format):
+        return romanesco.convert("tree", input, {"format": format})["data"]
+
+    def test_newick(self):
+        arrays = self.convert({"format": "newick", "data": self.newick},
+                              "arrays")
+        self.assertEqual(arrays["parent"].tolist(), [-1, 0, 1, 1, 0])
+        self.assertEqual(arrays["label"].tolist(),
+                         ["", "", "ahli", "allogus", "rubribarbus"])
+        self.assertTrue(math.isnan(arrays["edge_length"][0]))
+        self.assertEqual(arrays["edge_length"][1:].tolist(), [2, 0, 1, 3])
+        self.assertEqual(arrays["node_data"]["fields"], ["node weight"])
+        self.assertEqual(
+            arrays["node_data"]["columns"]["node weight"].tolist(),
+            [0, 2, 2, 3, 3])
+
+        self.assertEqual(self.convert({"format": "arrays", "data": arrays},
+                                      "newick"), self.newick)
+
+        # Labels are quoted when needed and lengths are optional
+        arrays["label"][2] = "a b"
+        arrays["edge_length"][4] = numpy.nan
+        arrays["edge_length"][3] = 0.25
+        self.assertEqual(treearrays.arrays_to_newick(arrays),
+                         "(('a b':0,allogus:0.25):2,rubribarbus);")
+
+    def test_nested(self):
+        nested = self.convert({"format": "newick", "data": self.newick},
+                              "nested")
+        arrays = self.convert({"format": "nested", "data": nested}, "arrays")
+        self.assertEqual(self.convert({"format": "arrays", "data": arrays},
+                                      "nested"), nested)
+
+        # Other node and edge attributes are kept in the tables
+        nested["node_fields"].append("size")
+        nested["edge_fields"].append("support")
+        nested["node_data"]["size"] = 3
+        for i, child in enumerate(nested["children"]):
+            child["node_data"]["size"] = i
+            child["edge_data"]["support"] = "s%d" % i
+        arrays = self.convert({"format": "nested", "data": nested}, "arrays")
+        self.assertEqual(arrays["node_data"]["fields"],
+                         ["node weight", "size"])
+        self.assertEqual(arrays["edge_data"]["fields"], ["support"])
+        self.assertEqual(arrays["edge_data"]["columns"]["support"].tolist(),
+                         ["s0", None, None, "s1"])
+        output = self.convert({"format": "arrays", "data": arrays}, "nested")
+        self.assertEqual(output["node_fields"],
+                         ["node name", "node weight", "size"])
+        self.assertEqual(output["edge_fields"], ["weight", "support"])
+        self.assertEqual(output["children"][1]["edge_data"],
+                         {"weight": 3.0, "support": "s1"})
+
+    def test_vtktree(self):
+        arrays = self.convert({"format": "newick", "data": self.newick},
+                              "arrays")
+        vtktree = self.convert({"format": "arrays", "data": arrays},
+                               "vtktree")
+        self.assertEqual(vtktree.GetNumberOfVertices(), 5)
+        self.assertEqual(self.convert(
+            {"format": "vtktree", "data": vtktree}, "newick"), self.newick)
+
+        output = self.convert({"format": "vtktree", "data": vtktree},
+                              "arrays")
+        for key in ("parent", "label"):
+            self.assertEqual(output[key].tolist(), arrays[key].tolist())
+        self.assertEqual(output["edge_length"][1:].tolist(),
+                         arrays["edge_length"][1:].tolist())
+
+    def test_large_tree(self):
+        tree = ladder_tree(50001)
+        arrays = self.convert({"format": "nested", "data": tree}, "arrays")
+        self.assertEqual(len(arrays["parent"]), 100001)
+        self.assertEqual(arrays["parent"].dtype, numpy.int64)
+        self.assertEqual(flatten(self.convert(
+            {"format": "arrays", "data": arrays}, "nested")), flatten(tree))
+
+        newick = self.convert({"format": "arrays", "data": arrays}, "newick")
+        self.assertTrue(newick.startswith("(t0:1,(t1:1,(t2:1,"))
+        self.assertIn("(t49999:1,t50000:1):1)", newick)
+        self.assertEqual(newick.count("("), 50000)
+
+    def test_validator(self):
+        arrays = self.convert({"format": "newick", "data": self.newick},
+                              "arrays")
+        self.assertTrue(romanesco.isvalid(
+            "tree", {"format": "arrays", "data": arrays}))
+        arrays["label"] = arrays["label"][1:]
+        self.assertFalse(romanesco.isvalid(
+            "tree", {"format": "arrays", "data": arrays}))
+        self.assertFalse(romanesco.isvalid(
+            "tree", {"format": "arrays", "data": {"parent": [-1]}}))
+
+    def test_r_apetree(self):
+        arrays = self.convert({"format": "newick", "data": self.newick},
+                              "arrays")
+        apetree = self.convert({"format": "arrays", "data": arrays},
+                               "r.apetree")
+        self.assertEqual(
+            str(apetree)[:52],
+            '\nPhylogenetic tree with 3 tips and 2 internal nodes.')
+        output = apetrees.r_apetree_to_arrays(apetree)
+        for key in ("parent", "label"):
+            self.assertEqual(output[key].tolist(), arrays[key].tolist())
+        self.assertEqual(output["edge_length"][1:].tolist(),
+                         arrays["edge_length"][1:].tolist())
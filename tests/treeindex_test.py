@@ -0,0 +1,188 @@
+import bson
+import os
+import romanesco
+import unittest
+import weakref
+
+from romanesco.format import newick, treeindex
+from tests.tree_test import balanced_tree, flatten, ladder_tree
+
+
+class TestTreeIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.newick = "((ahli:0,allogus:1):2,(rubribarbus:3,b:1)c:1);"
+        self.nested = newick.newick_to_nested(self.newick)
+        self.analysis_path = os.path.join(
+            os.path.dirname(os.path.realpath(__file__)), "..", "analysis",
+            "tree")
+
+    def convert(self, input, format):
+        return romanesco.convert("tree", input, {"format": format})["data"]
+
+    def test_index(self):
+        index = self.convert({"format": "newick", "data": self.newick},
+                             "treeindex")
+        self.assertEqual(index.format, "nested")
+        self.assertEqual(index.labels, ["", "", "ahli", "allogus", "c",
+                                        "rubribarbus", "b"])
+        self.assertEqual(index.parent.tolist(), [-1, 0, 1, 1, 0, 4, 4])
+        self.assertEqual(index.end.tolist(), [7, 4, 3, 4, 7, 6, 7])
+        self.assertEqual(index.depth.tolist(), [0, 1, 2, 2, 1, 2, 2])
+        self.assertEqual(index.distance.tolist(), [0, 2, 2, 3, 1, 4, 2])
+        self.assertEqual(index.offset("rubribarbus"), 5)
+        self.assertEqual(index.offset(3), 3)
+        with self.assertRaisesRegexp(Exception, "not found"):
+            index.offset("anolis")
+
+        # Indexes are built once per tree
+        self.assertIs(treeindex.nested_to_treeindex(self.nested),
+                      treeindex.nested_to_treeindex(self.nested))
+        self.assertIsNot(treeindex.nested_to_treeindex(self.nested), index)
+        self.assertIs(index.to_nested(), index.nodes[0])
+
+        # The cache keeps neither unused indexes nor their trees alive
+        class Tree(dict):
+            pass
+        tree = Tree(node_data={"node name": "a"})
+        ref = weakref.ref(tree)
+        first = weakref.ref(treeindex.nested_to_treeindex(tree))
+        del tree
+        self.assertIsNone(ref())
+        self.assertIsNone(first())
+        self.assertEqual(
+            self.convert({"format": "treeindex", "data": index}, "newick"),
+            self.newick)
+
+    def test_lca(self):
+        index = treeindex.nested_to_treeindex(self.nested)
+        self.assertEqual(index.lca("ahli", "allogus"), 1)
+        self.assertEqual(index.lca("ahli", "b"), 0)
+        self.assertEqual(index.lca("rubribarbus", "c"), 4)
+        self.assertEqual(index.lca("b"), 6)
+
+        # Check against walking up from both nodes in a large tree
+        tree = balanced_tree(5000)
+        index = treeindex.nested_to_treeindex(tree)
+        parent = index.parent.tolist()
+
+        def ancestors(node):
+            path = [node]
+            while parent[path[-1]] >= 0:
+                path.append(parent[path[-1]])
+            return path
+
+        for a, b in [(1, 2), (3, 4000), (4999, 4998), (2500, 1250),
+                     (100, 101), (7, 7), (0, 3000)]:
+            a = index.offset("n%d" % a)
+            b = index.offset("n%d" % b)
+            up = set(ancestors(a))
+            expected = next(node for node in ancestors(b) if node in up)
+            self.assertEqual(index.lca(a, b), expected)
+
+        # Deep trees are indexed without recursion
+        index = treeindex.nested_to_treeindex(ladder_tree(5000))
+        self.assertEqual(index.depth.max(), 4999)
+        self.assertEqual(index.labels[index.lca("t4998", "t4999")], "")
+        self.assertEqual(index.depth[index.lca("t4998", "t4999")], 4998)
+
+    def test_subtree(self):
+        index = treeindex.nested_to_treeindex(self.nested)
+        subtree = index.subtree("c")
+        self.assertEqual(newick.nested_to_newick(subtree.to_nested()),
+                         "(rubribarbus:3,b:1)c;")
+        self.assertEqual(subtree.distance.tolist(), [0, 3, 1])
+        self.assertNotIn("edge_data", subtree.to_nested())
+        self.assertIn("edge_data", index.nodes[4])
+
+        # Node weights count from the new root, as for pruned trees
+        self.assertEqual([node[0] for node in flatten(subtree.to_nested())], [
+            {"node name": "c", "node weight": 0.0},
+            {"node name": "rubribarbus", "node weight": 3.0},
+            {"node name": "b", "node weight": 1.0}])
+        self.assertEqual(index.nodes[5]["node_data"]["node weight"], 4.0)
+        self.assertEqual(
+            subtree.to_nested(),
+            index.prune(["rubribarbus", "b"]).to_nested())
+        self.assertEqual(newick.nested_to_newick(index.subtree(2).nodes[0]),
+                         "ahli;")
+
+        tree = balanced_tree(10000)
+        subtree = treeindex.nested_to_treeindex(tree).subtree("n2")
+        self.assertEqual(len(subtree), 4095)
+        child = tree["children"][1]["children"][0]
+        self.assertIsNot(subtree.nodes[1], child)
+        self.assertEqual(subtree.nodes[1]["node_data"]["node name"],
+                         child["node_data"]["node name"])
+
+    def test_prune(self):
+        index = treeindex.nested_to_treeindex(self.nested)
+        pruned = index.prune(["ahli", "rubribarbus", "b"])
+        self.assertEqual(newick.nested_to_newick(pruned.to_nested()),
+                         "(ahli:2,(rubribarbus:3,b:1)c:1);")
+        pruned = index.prune(["allogus", "rubribarbus"])
+        self.assertEqual(newick.nested_to_newick(pruned.to_nested()),
+                         "(allogus:3,rubribarbus:4);")
+        self.assertEqual(flatten(pruned.to_nested())[2][0],
+                         {"node name": "rubribarbus", "node weight": 4.0})
+        pruned = index.prune(["rubribarbus", "b"])
+        self.assertEqual(newick.nested_to_newick(pruned.to_nested()),
+                         "(rubribarbus:3,b:1)c;")
+        with self.assertRaisesRegexp(Exception, "No taxa"):
+            index.prune([])
+
+        index = treeindex.nested_to_treeindex(ladder_tree(3000))
+        pruned = index.prune(["t0", "t1500", "t2999"])
+        self.assertEqual(newick.nested_to_newick(pruned.to_nested()),
+                         "(t0:1,(t1500:1,t2999:1499):1500);")
+
+    def test_treestore(self):
+        data = self.convert({"format": "newick", "data": self.newick},
+                            "treeindex").to_treestore()
+        docs = bson.decode_all(data)
+        self.assertEqual(docs[-1], {"rooted": True, "clades": [0], "_id": 7})
+        self.assertEqual(docs[2], {"_id": 2, "name": "ahli",
+                                   "branch_length": 0.0})
+
+        index = self.convert({"format": "treestore", "data": data},
+                             "treeindex")
+        self.assertEqual(index.format, "treestore")
+        self.assertIs(index, treeindex.treestore_to_treeindex(data[:]))
+        self.assertIs(index.to_treestore(), data)
+        self.assertEqual(index.labels[index.lca("rubribarbus", "b")], "c")
+        self.assertEqual(
+            self.convert({"format": "treestore", "data": data}, "newick"),
+            self.newick)
+
+        subtree = index.subtree("c")
+        docs = bson.decode_all(subtree.to_treestore())
+        self.assertEqual(docs[-1], {"rooted": True, "clades": [4], "_id": 7})
+        self.assertEqual(docs[0], {"_id": 4, "name": "c", "clades": [5, 6]})
+
+        pruned = index.prune(["allogus", "b"])
+        self.assertEqual(pruned.ids, [0, 3, 6])
+        self.assertEqual(
+            newick.nested_to_newick(pruned.to_nested()), "(allogus:3,b:2);")
+
+    def test_analyses(self):
+        tree = {"format": "nested", "data": self.nested}
+        subtree = romanesco.load(os.path.join(self.analysis_path,
+                                              "subtree.json"))
+        outputs = romanesco.run(
+            subtree, {"tree": tree, "node": {"format": "object", "data": "c"}},
+            outputs={"subtree": {"format": "newick"}})
+        self.assertEqual(outputs["subtree"]["data"], "(rubribarbus:3,b:1)c;")
+
+        prune = romanesco.load(os.path.join(self.analysis_path, "prune.json"))
+        outputs = romanesco.run(
+            prune, {"tree": tree, "taxa": {"format": "object",
+                                           "data": ["ahli", "allogus"]}},
+            outputs={"pruned": {"format": "nested"}})
+        self.assertEqual(newick.nested_to_newick(outputs["pruned"]["data"]),
+                         "(ahli:0,allogus:1);")
+
+        lca = romanesco.load(os.path.join(self.analysis_path, "lca.json"))
+        outputs = romanesco.run(
+            lca, {"tree": tree, "taxa": {"format": "object",
+                                         "data": ["ahli", "allogus"]}})
+        self.assertEqual(outputs["node"]["data"], 1)